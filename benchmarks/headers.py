@@ -0,0 +1,120 @@
+"""
+Microbenchmark of the preparation of the headers and the cookies of the requests to Next.js and of its responses,
+which runs for each rendered page.
+
+Usage:
+
+    python -m benchmarks.headers --number 100000
+
+The results (microseconds per call of each step, the best of several repeats) are written as JSON.
+"""
+
+import argparse
+import json
+import os
+import timeit
+
+# A request of a browser with a typical set of headers and cookies
+REQUEST_HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Pragma": "no-cache",
+    "Sec-Ch-Ua": '"Chromium";v="130", "Google Chrome";v="130", "Not?A_Brand";v="99"',
+    "Sec-Ch-Ua-Mobile": "?0",
+    "Sec-Ch-Ua-Platform": '"Linux"',
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "same-origin",
+    "Upgrade-Insecure-Requests": "1",
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0 Safari/537.36",
+    "Referer": "https://example.com/",
+}
+COOKIES = {
+    "csrftoken": "a" * 32,
+    "sessionid": "b" * 32,
+    "_ga": "GA1.1.123456789.1700000000",
+    "_ga_ABCDEF": "GS1.1.1700000000.1.1.1700000000.0.0.0",
+    "theme": "dark",
+    "locale": "en",
+    "NEXT_LOCALE": "en",
+    "consent": "true",
+}
+# A response of Next.js to a page request
+RESPONSE_HEADERS = [
+    ("Vary", "RSC, Next-Router-State-Tree, Next-Router-Prefetch, Accept-Encoding"),
+    ("Link", "</_next/static/media/font.woff2>; rel=preload; as=font; crossorigin"),
+    ("Link", "</_next/static/css/app.css>; rel=preload; as=style"),
+    ("Cache-Control", "private, no-cache, no-store, max-age=0, must-revalidate"),
+    ("Content-Type", "text/html; charset=utf-8"),
+    ("Set-Cookie", "NEXT_LOCALE=en; Path=/; SameSite=Lax"),
+    ("Set-Cookie", "session-hint=1; Path=/; HttpOnly"),
+    ("X-Powered-By", "Next.js"),
+    ("Date", "Thu, 01 Jan 2026 00:00:00 GMT"),
+    ("Connection", "keep-alive"),
+    ("Keep-Alive", "timeout=5"),
+    ("Transfer-Encoding", "chunked"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=100_000, help="Number of calls of each step")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of measurements of each step")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    import django
+
+    django.setup()
+
+    from django.test import RequestFactory
+    from multidict import CIMultiDict, CIMultiDictProxy
+
+    from django_nextjs.cache import get_cache_key
+    from django_nextjs.render import (
+        _get_nextjs_request_cookies,
+        _get_nextjs_request_headers,
+        _get_nextjs_response_headers,
+    )
+
+    def make_request():
+        request = RequestFactory().get("/page", headers=REQUEST_HEADERS)
+        request.COOKIES = dict(COOKIES)
+        return request
+
+    request = make_request()
+    response_headers = CIMultiDictProxy(CIMultiDict(RESPONSE_HEADERS))
+
+    def new_request_headers():
+        # `request.headers` is cached on the request, so a new request is measured each time.
+        request = make_request()
+        _get_nextjs_request_headers(request)
+
+    def new_request_cache_key():
+        request = make_request()
+        get_cache_key(request)
+
+    steps = {
+        "request_headers": lambda: _get_nextjs_request_headers(request),
+        "request_headers_new_request": new_request_headers,
+        "new_request": make_request,
+        "cache_key_new_request": new_request_cache_key,
+        "request_cookies": lambda: _get_nextjs_request_cookies(request),
+        "response_headers": lambda: _get_nextjs_response_headers(response_headers),
+    }
+    results = {}
+    for name, step in steps.items():
+        best = min(timeit.repeat(step, number=args.number, repeat=args.repeat))
+        results[name] = round(best / args.number * 1e6, 3)
+    # The costs for a new request, without the cost of creating the request
+    new_request = results.pop("new_request")
+    for name in ("request_headers_new_request", "cache_key_new_request"):
+        results[name] = round(results[name] - new_request, 3)
+    print(json.dumps({"microseconds_per_call": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+Benchmarks for rendering, streaming and proxying Next.js pages through Django.
+
+A stub Next.js server (see stub_server.py) is started in a separate process, and requests are sent
+in-process to Django's ASGI application (wrapped in NextJsMiddleware, like uvicorn would run it)
+and to its WSGI application (from a thread pool, like a threaded WSGI server would run it).
+
+Usage:
+
+    python -m benchmarks.run --requests 2000 --concurrency 32 --output results.json
+    python -m benchmarks.run --compare results.json  # Exit with an error if results regressed
+
+The results are written as JSON: throughput, latency percentiles and memory usage of each scenario.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import stub_server
+
+# (name, server, path)
+SCENARIOS = [
+    ("render", "asgi", "/page"),
+    ("render", "wsgi", "/page"),
+    ("render_template", "asgi", "/page-template"),
+    ("render_template", "wsgi", "/page-template"),
+    ("render_template_cached", "asgi", "/page-template-cached"),
+    ("render_template_cached", "wsgi", "/page-template-cached"),
+    ("render_sync", "wsgi", "/page-sync"),
+    ("render_template_sync", "wsgi", "/page-template-sync"),
+    ("stream", "asgi", "/stream"),
+    # NextJsHttpProxy (used by NextJsMiddleware) and NextJSProxyView (used by django_nextjs.urls)
+    ("http_proxy", "asgi", "/_next/static/chunks/main.js"),
+    ("proxy_view", "wsgi", "/_next/static/chunks/main.js"),
+]
+
+
+class AsgiClient:
+    """
+    Sends requests to an ASGI application in the current event loop, including the lifespan protocol.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.state = {}
+        self._lifespan_messages = asyncio.Queue()
+        self._lifespan_events = asyncio.Queue()
+        self._lifespan_task = None
+
+    async def startup(self):
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}, "state": self.state}
+
+        async def send(message):
+            await self._lifespan_events.put(message)
+
+        self._lifespan_task = asyncio.create_task(self.app(scope, self._lifespan_messages.get, send))
+        await self._lifespan_messages.put({"type": "lifespan.startup"})
+        assert (await self._lifespan_events.get())["type"] == "lifespan.startup.complete"
+
+    async def shutdown(self):
+        await self._lifespan_messages.put({"type": "lifespan.shutdown"})
+        assert (await self._lifespan_events.get())["type"] == "lifespan.shutdown.complete"
+        await self._lifespan_task
+
+    async def request(self, path: str) -> tuple[int, int, int]:
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"host", b"testserver"), (b"user-agent", b"benchmark")],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+            "state": self.state.copy(),
+        }
+        response_complete = asyncio.Event()
+        request_sent = False
+        status = 0
+        size = 0
+        messages = 0
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await response_complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status, size, messages
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+                messages += 1
+                if not message.get("more_body", False):
+                    response_complete.set()
+
+        await self.app(scope, receive, send)
+        return status, size, messages
+
+
+class WsgiClient:
+    """
+    Sends requests to a WSGI application from the current thread.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, path: str) -> tuple[int, int, int]:
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "SCRIPT_NAME": "",
+            "PATH_INFO": path,
+            "QUERY_STRING": "",
+            "SERVER_NAME": "testserver",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "REMOTE_ADDR": "127.0.0.1",
+            "HTTP_HOST": "testserver",
+            "HTTP_USER_AGENT": "benchmark",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": _EmptyInput(),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        status_line = ""
+
+        def start_response(status, headers, exc_info=None):
+            nonlocal status_line
+            status_line = status
+
+        body = self.app(environ, start_response)
+        size = 0
+        chunks = 0
+        try:
+            for chunk in body:
+                size += len(chunk)
+                chunks += 1
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+        return int(status_line.split(" ", 1)[0]), size, chunks
+
+
+class _EmptyInput:
+    def read(self, size=-1):
+        return b""
+
+    def readline(self, size=-1):
+        return b""
+
+
+def summarize(name, server, latencies, errors, elapsed, sizes, chunks, peak_memory):
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    percentiles = statistics.quantiles(latencies_ms, n=100, method="inclusive") if len(latencies_ms) > 1 else []
+    return {
+        "name": name,
+        "server": server,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies_ms), 3) if latencies_ms else None,
+            "p50": round(percentiles[49], 3) if percentiles else None,
+            "p90": round(percentiles[89], 3) if percentiles else None,
+            "p99": round(percentiles[98], 3) if percentiles else None,
+            "max": round(latencies_ms[-1], 3) if latencies_ms else None,
+        },
+        "response_bytes": max(sizes) if sizes else 0,
+        # Number of body messages (ASGI) or chunks (WSGI) of each response
+        "response_chunks": round(statistics.fmean(chunks), 1) if chunks else 0,
+        "peak_traced_memory_bytes": peak_memory,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+async def run_asgi_scenario(client: AsgiClient, name, path, requests, concurrency, warmup, trace_memory):
+    for _ in range(warmup):
+        await client.request(path)
+
+    latencies, sizes, chunks = [], set(), []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                status, size, response_chunks = await client.request(path)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            sizes.add(size)
+            chunks.append(response_chunks)
+            if status != 200:
+                errors += 1
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return summarize(name, "asgi", latencies, errors, elapsed, sizes, chunks, peak_memory)
+
+
+def run_wsgi_scenario(client: WsgiClient, name, path, requests, concurrency, warmup, trace_memory):
+    for _ in range(warmup):
+        client.request(path)
+
+    latencies, sizes, chunks = [], set(), []
+    errors = 0
+    lock = threading.Lock()
+
+    def send_request(_):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            status, size, response_chunks = client.request(path)
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            sizes.add(size)
+            chunks.append(response_chunks)
+            if status != 200:
+                errors += 1
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send_request, range(requests)))
+    elapsed = time.perf_counter() - start
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return summarize(name, "wsgi", latencies, errors, elapsed, sizes, chunks, peak_memory)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the changes relative to the baseline results, and return the regressions.
+    """
+    baseline_results = {(result["name"], result["server"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = baseline_results.get((result["name"], result["server"]))
+        if old is None:
+            continue
+        throughput_ratio = result["throughput_rps"] / old["throughput_rps"]
+        p99_ratio = result["latency_ms"]["p99"] / old["latency_ms"]["p99"]
+        label = f"{result['name']} ({result['server']})"
+        print(f"{label:<40} throughput x{throughput_ratio:.2f}  p99 latency x{p99_ratio:.2f}", file=sys.stderr)
+        if throughput_ratio < 1 - tolerance or p99_ratio > 1 + tolerance:
+            regressions.append(label)
+    return regressions
+
+
+def wait_for_port(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=0.1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="Number of requests of each scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of concurrent requests")
+    parser.add_argument("--warmup", type=int, default=20, help="Number of requests sent before measuring")
+    parser.add_argument("--scenarios", nargs="*", help="Names of scenarios to run (default: all)")
+    parser.add_argument("--servers", nargs="*", choices=["asgi", "wsgi"], default=["asgi", "wsgi"])
+    parser.add_argument("--trace-memory", action="store_true", help="Measure peak Python memory (slower)")
+    parser.add_argument("--port", type=int, default=3999, help="Port of the stub Next.js server")
+    parser.add_argument("--output", help="Write the results to this JSON file (default: stdout)")
+    parser.add_argument("--compare", help="Compare the results with a previous JSON results file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed regression ratio for --compare")
+    parser.add_argument(
+        "--stream-flush-bytes", type=int, help="The `stream_flush_bytes` setting (0 disables chunk coalescing)"
+    )
+    stub_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    stub = multiprocessing.Process(
+        target=stub_server.serve,
+        args=("127.0.0.1", args.port, args.document_size, args.chunk_count, args.latency, args.asset_size),
+        daemon=True,
+    )
+    stub.start()
+    wait_for_port("127.0.0.1", args.port)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    os.environ["BENCHMARK_NEXTJS_SERVER_URL"] = f"http://127.0.0.1:{args.port}"
+    if args.stream_flush_bytes is not None:
+        os.environ["BENCHMARK_STREAM_FLUSH_BYTES"] = str(args.stream_flush_bytes)
+
+    import django
+    from django.core.asgi import get_asgi_application
+    from django.core.wsgi import get_wsgi_application
+
+    django.setup()
+    from django_nextjs.asgi import NextJsMiddleware
+
+    scenarios = [
+        scenario
+        for scenario in SCENARIOS
+        if (not args.scenarios or scenario[0] in args.scenarios) and scenario[1] in args.servers
+    ]
+    options = dict(
+        requests=args.requests, concurrency=args.concurrency, warmup=args.warmup, trace_memory=args.trace_memory
+    )
+    results = []
+
+    async def run_asgi_scenarios():
+        client = AsgiClient(NextJsMiddleware(get_asgi_application()))
+        await client.startup()
+        for name, server, path in scenarios:
+            if server == "asgi":
+                results.append(await run_asgi_scenario(client, name, path, **options))
+        await client.shutdown()
+
+    try:
+        asyncio.run(run_asgi_scenarios())
+        wsgi_client = WsgiClient(get_wsgi_application())
+        for name, server, path in scenarios:
+            if server == "wsgi":
+                results.append(run_wsgi_scenario(wsgi_client, name, path, **options))
+    finally:
+        stub.terminate()
+
+    import django_nextjs
+
+    report = {
+        "meta": {
+            "django_nextjs": django_nextjs.__version__,
+            "django": django.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "options": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
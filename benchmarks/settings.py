@@ -0,0 +1,32 @@
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SECRET_KEY = "benchmark"
+
+# The development proxies (NextJsHttpProxy and NextJSProxyView) only run in DEBUG mode
+DEBUG = True
+ALLOWED_HOSTS = ["*"]
+APPEND_SLASH = False
+USE_TZ = False
+
+INSTALLED_APPS = [
+    "django_nextjs.apps.DjangoNextJSConfig",
+]
+
+MIDDLEWARE = []
+
+ROOT_URLCONF = "benchmarks.urls"
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "DIRS": [os.path.join(BASE_DIR, "templates")],
+        "APP_DIRS": True,
+    },
+]
+
+NEXTJS_SETTINGS = {
+    "nextjs_server_url": os.environ.get("BENCHMARK_NEXTJS_SERVER_URL", "http://127.0.0.1:3000"),
+    "ensure_csrf_token": False,
+    "stream_flush_bytes": int(os.environ.get("BENCHMARK_STREAM_FLUSH_BYTES", 16 * 1024)),
+}
@@ -0,0 +1,85 @@
+"""
+A stub of the Next.js server for benchmarks.
+
+- Pages (any path) return an HTML document with the django-nextjs markers and an inline RSC payload.
+- Paths starting with /stream return the same kind of document in many small chunks, like a streamed RSC response.
+- Paths starting with /_next/ return a static asset.
+
+Run it standalone with `python -m benchmarks.stub_server --port 3000`.
+"""
+
+import argparse
+import asyncio
+
+from aiohttp import web
+
+DOCUMENT_HEAD = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8"/>'
+    '<link rel="stylesheet" href="/_next/static/css/app.css"/>'
+    '<script src="/_next/static/chunks/main.js" async=""></script>'
+    '</head><body id="__django_nextjs_body"><div id="__django_nextjs_body_begin"></div>'
+)
+DOCUMENT_TAIL = '<div id="__django_nextjs_body_end"></div></body></html>'
+RSC_CHUNK = '<script>self.__next_f.push([1,"{}"])</script>'
+
+
+def make_document(size: int) -> bytes:
+    payload_size = max(size - len(DOCUMENT_HEAD) - len(DOCUMENT_TAIL), 0)
+    return (DOCUMENT_HEAD + "<main>" + "x" * payload_size + "</main>" + DOCUMENT_TAIL).encode()
+
+
+def make_app(document_size: int, chunk_count: int, latency: float, asset_size: int) -> web.Application:
+    document = make_document(document_size)
+    chunk_payload = "x" * max(document_size // max(chunk_count, 1) - len(RSC_CHUNK), 0)
+    asset = b"/* asset */" + b"x" * asset_size
+
+    async def page(request: web.Request) -> web.StreamResponse:
+        if latency:
+            await asyncio.sleep(latency)
+        return web.Response(body=document, content_type="text/html", charset="utf-8")
+
+    async def stream(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/html; charset=utf-8"})
+        await response.prepare(request)
+        await response.write(DOCUMENT_HEAD.encode())
+        for _ in range(chunk_count):
+            # Even without latency, each chunk is written separately (like React flushes its stream).
+            await asyncio.sleep(latency / chunk_count)
+            await response.write(RSC_CHUNK.format(chunk_payload).encode())
+        await response.write(DOCUMENT_TAIL.encode())
+        await response.write_eof()
+        return response
+
+    async def static(request: web.Request) -> web.StreamResponse:
+        return web.Response(
+            body=asset,
+            content_type="application/javascript",
+            headers={"Cache-Control": "public, max-age=31536000, immutable"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/_next/{path:.*}", static)
+    app.router.add_get("/stream{path:.*}", stream)
+    app.router.add_get("/{path:.*}", page)
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--document-size", type=int, default=100_000, help="Size of the HTML documents in bytes")
+    parser.add_argument("--chunk-count", type=int, default=100, help="Number of chunks of streamed documents")
+    parser.add_argument("--latency", type=float, default=0.0, help="Rendering time of each page in seconds")
+    parser.add_argument("--asset-size", type=int, default=50_000, help="Size of static assets in bytes")
+
+
+def serve(host: str, port: int, document_size: int, chunk_count: int, latency: float, asset_size: int) -> None:
+    app = make_app(document_size, chunk_count, latency, asset_size)
+    web.run_app(app, host=host, port=port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.document_size, args.chunk_count, args.latency, args.asset_size)
@@ -0,0 +1,16 @@
+from django.urls import include, path, re_path
+
+from django_nextjs.views import nextjs_page, nextjs_page_sync
+
+urlpatterns = [
+    path("", include("django_nextjs.urls")),
+    path("page", nextjs_page()),
+    path("page-template", nextjs_page(template_name="benchmark_document.html")),
+    path(
+        "page-template-cached",
+        nextjs_page(template_name="benchmark_document.html", template_cache_key=lambda request: None),
+    ),
+    path("page-sync", nextjs_page_sync()),
+    path("page-template-sync", nextjs_page_sync(template_name="benchmark_document.html")),
+    re_path(r"^stream", nextjs_page(stream=True)),
+]
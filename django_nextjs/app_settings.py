@@ -4,6 +4,83 @@ from django.conf import settings
 
 NEXTJS_SETTINGS = getattr(settings, "NEXTJS_SETTINGS", {})
 
-NEXTJS_SERVER_URL = NEXTJS_SETTINGS.get("nextjs_server_url", "http://127.0.0.1:3000")
+_nextjs_server_url = NEXTJS_SETTINGS.get("nextjs_server_url", "http://127.0.0.1:3000")
+# A list of URLs can be used to distribute requests between several Next.js server instances.
+NEXTJS_SERVER_URLS = [_nextjs_server_url] if isinstance(_nextjs_server_url, str) else list(_nextjs_server_url)
+NEXTJS_SERVER_URL = NEXTJS_SERVER_URLS[0]
 ENSURE_CSRF_TOKEN = NEXTJS_SETTINGS.get("ensure_csrf_token", True)
 PUBLIC_SUBDIRECTORY = NEXTJS_SETTINGS.get("public_subdirectory", "/next")
+
+# Connection pool used for requests to the Next.js server
+CONNECTION_LIMIT = NEXTJS_SETTINGS.get("connection_limit", 100)
+CONNECTION_LIMIT_PER_HOST = NEXTJS_SETTINGS.get("connection_limit_per_host", 0)
+KEEPALIVE_TIMEOUT = NEXTJS_SETTINGS.get("keepalive_timeout", 15)
+DNS_CACHE_TTL = NEXTJS_SETTINGS.get("dns_cache_ttl", 10)
+UNIX_SOCKET_PATH = NEXTJS_SETTINGS.get("unix_socket_path", None)
+# Send requests over HTTP/2 without TLS (h2c), which requires a Next.js server (or a proxy in front of it)
+# supporting it and the `http2` extra of this package
+UPSTREAM_HTTP2 = NEXTJS_SETTINGS.get("upstream_http2", False)
+UPSTREAM_MAX_FAILURES = NEXTJS_SETTINGS.get("upstream_max_failures", 3)
+UPSTREAM_COOLDOWN = NEXTJS_SETTINGS.get("upstream_cooldown", 10)
+
+# Timeouts (in seconds) of requests to the Next.js server
+CONNECT_TIMEOUT = NEXTJS_SETTINGS.get("connect_timeout", 5)
+FIRST_BYTE_TIMEOUT = NEXTJS_SETTINGS.get("first_byte_timeout", 60)
+TOTAL_TIMEOUT = NEXTJS_SETTINGS.get("total_timeout", 300)
+# Template rendered (with status 503) when the Next.js server is unavailable
+UNAVAILABLE_TEMPLATE = NEXTJS_SETTINGS.get("unavailable_template", None)
+
+# Cache for the responses of the Next.js server
+CACHE_BACKEND = NEXTJS_SETTINGS.get("cache_backend", None)
+CACHE_MAX_BYTES = NEXTJS_SETTINGS.get("cache_max_bytes", 64 * 1024 * 1024)
+CACHE_VARY = NEXTJS_SETTINGS.get("cache_vary", None)
+
+# Directories from which /_next/static/ (the `.next/static` build directory) and the public subdirectory
+# (the `public` directory of Next.js) are served without sending requests to the Next.js server
+STATIC_DIRECTORY = NEXTJS_SETTINGS.get("static_directory", None)
+PUBLIC_DIRECTORY = NEXTJS_SETTINGS.get("public_directory", None)
+
+# Serving the static assets of Next.js (/_next/static/) through Django in production
+ASSETS_PROXY = NEXTJS_SETTINGS.get("assets_proxy", False)
+ASSETS_CACHE_MAX_BYTES = NEXTJS_SETTINGS.get("assets_cache_max_bytes", 64 * 1024 * 1024)
+ASSETS_CACHE_DIRECTORY = NEXTJS_SETTINGS.get("assets_cache_directory", None)
+ASSETS_CACHE_DISK_MAX_BYTES = NEXTJS_SETTINGS.get("assets_cache_disk_max_bytes", 1024 * 1024 * 1024)
+
+# Coalescing of concurrent identical requests to the Next.js server
+COALESCE_REQUESTS = NEXTJS_SETTINGS.get("coalesce_requests", False)
+COALESCE_EXCLUDE_COOKIES = frozenset(NEXTJS_SETTINGS.get("coalesce_exclude_cookies", [settings.SESSION_COOKIE_NAME]))
+COALESCE_EXCLUDE_HEADERS = frozenset(NEXTJS_SETTINGS.get("coalesce_exclude_headers", ["Authorization"]))
+
+# Maximum number of rendered templates kept when the `template_cache_key` option is used
+TEMPLATE_CACHE_SIZE = NEXTJS_SETTINGS.get("template_cache_size", 1000)
+# Maximum number of routes whose static shell is kept when the `cache_shell` option is used
+SHELL_CACHE_SIZE = NEXTJS_SETTINGS.get("shell_cache_size", 1000)
+
+# Observability: the Server-Timing response header and the tracing headers forwarded to Next.js
+SERVER_TIMING = NEXTJS_SETTINGS.get("server_timing", False)
+TRACE_HEADERS = list(NEXTJS_SETTINGS.get("trace_headers", []))
+
+# Headers forwarded to Next.js and headers of its responses sent to the client, in addition to the default ones
+EXTRA_REQUEST_HEADERS = list(NEXTJS_SETTINGS.get("extra_request_headers", []))
+EXTRA_RESPONSE_HEADERS = list(NEXTJS_SETTINGS.get("extra_response_headers", []))
+
+# Coalescing of the small chunks of streamed responses: the buffered data is sent when it reaches this size,
+# after this time (in seconds), or when it contains one of the markers (React's scripts which reveal the content
+# of resolved Suspense boundaries). It's disabled by default (`stream_flush_bytes` is 0): each chunk is sent
+# as it's received.
+STREAM_FLUSH_BYTES = NEXTJS_SETTINGS.get("stream_flush_bytes", 0)
+STREAM_FLUSH_INTERVAL = NEXTJS_SETTINGS.get("stream_flush_interval", 0.005)
+STREAM_FLUSH_MARKERS = tuple(
+    marker.encode() for marker in NEXTJS_SETTINGS.get("stream_flush_markers", ["$RC(", "$RX("])
+)
+
+# Compression of the responses of Next.js pages, in the order of preference of the encodings
+# ("zstd" and "br" are used only if the `zstandard` (or Python 3.14+) and `brotli` packages are installed)
+COMPRESS_RESPONSES = NEXTJS_SETTINGS.get("compress_responses", False)
+COMPRESSION_ENCODINGS = list(NEXTJS_SETTINGS.get("compression_encodings", ["zstd", "br", "gzip"]))
+COMPRESSION_MIN_BYTES = NEXTJS_SETTINGS.get("compression_min_bytes", 200)
+
+# 103 Early Hints: the assets in the head of the pages rendered by Next.js are remembered (for this many paths)
+# and preloaded by the following requests to the same paths before the page is rendered (ASGI only)
+EARLY_HINTS = NEXTJS_SETTINGS.get("early_hints", False)
+EARLY_HINTS_CACHE_SIZE = NEXTJS_SETTINGS.get("early_hints_cache_size", 1000)
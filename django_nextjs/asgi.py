@@ -11,8 +11,21 @@ from django.conf import settings
 from websockets import Data
 from websockets.asyncio.client import ClientConnection
 
-from django_nextjs.app_settings import NEXTJS_SERVER_URL, PUBLIC_SUBDIRECTORY
+from django_nextjs.app_settings import (
+    ASSETS_PROXY,
+    EARLY_HINTS,
+    PUBLIC_SUBDIRECTORY,
+    UNIX_SOCKET_PATH,
+    UPSTREAM_COOLDOWN,
+)
+from django_nextjs.assets import STATIC_ASSETS_PREFIX, get_static_asset, is_not_modified
+from django_nextjs.early_hints import get_early_hints
 from django_nextjs.exceptions import NextJsImproperlyConfigured
+from django_nextjs.instrumentation import RequestTimings
+from django_nextjs.session import HTTP_SESSION_KEY, Session, create_session, get_session
+from django_nextjs.static_files import StaticFile, find_static_file, static_routes
+from django_nextjs.streaming import iter_coalesced
+from django_nextjs.upstreams import UPSTREAM_ERRORS, upstreams
 
 # https://github.com/encode/starlette/blob/b9db010d49cfa33d453facde56e53a621325c720/starlette/types.py
 Scope = typing.MutableMapping[str, typing.Any]
@@ -28,14 +41,17 @@ class StopReceiving(Exception):
 
 class NextJsProxyBase(ABC):
     scope: Scope
+    receive: Receive
     send: Send
+    development_only = True
 
     def __init__(self):
-        if not settings.DEBUG:
+        if self.development_only and not settings.DEBUG:
             raise NextJsImproperlyConfigured("This proxy is for development only.")
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send):
         self.scope = scope
+        self.receive = receive
         self.send = send
 
         while True:
@@ -73,34 +89,51 @@ class NextJsHttpProxy(NextJsProxyBase):
     headers and body content are correctly relayed, and the response from
     the Next.js server is streamed back to the client. This is primarily
     used in development to serve Next.js assets through Django's ASGI server.
+
+    The request body is streamed to Next.js as it's received, so large uploads aren't buffered in memory.
     """
 
     def __init__(self):
         super().__init__()
-        self.body = []
+        self.disconnected = False
 
     async def handle_message(self, message: Message) -> None:
         if message["type"] == "http.request":
-            self.body.append(message.get("body", b""))
-            if not message.get("more_body", False):
-                await self.handle_request(b"".join(self.body))
+            body = message.get("body", b"")
+            try:
+                await self.handle_request(self.stream_body(body) if message.get("more_body", False) else body)
+            except Exception:
+                if self.disconnected:
+                    raise StopReceiving
+                raise
         elif message["type"] == "http.disconnect":
             raise StopReceiving
 
-    async def handle_request(self, body: bytes):
-        url = NEXTJS_SERVER_URL + self.scope["path"] + "?" + self.scope["query_string"].decode()
-        headers = {k.decode(): v.decode() for k, v in self.scope["headers"]}
+    async def stream_body(self, first_chunk: bytes) -> typing.AsyncIterator[bytes]:
+        """
+        Yield the chunks of the request body as they're received.
+        The next chunk is received only when aiohttp has sent the previous one, which applies backpressure to the client.
+        """
+        yield first_chunk
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                self.disconnected = True
+                raise StopReceiving
+            yield message.get("body", b"")
+            if not message.get("more_body", False):
+                return
 
-        if session := self.scope.get("state", {}).get(NextJsMiddleware.HTTP_SESSION_KEY):
-            session_is_temporary = False
-        else:
-            # If the shared session is not available, we create a temporary session.
-            # This is typically the case when the ASGI server does not support the lifespan protocol (e.g. Daphne).
-            session = aiohttp.ClientSession()
-            session_is_temporary = True
+    async def handle_request(self, body: typing.Union[bytes, typing.AsyncIterator[bytes]]):
+        path = self.scope["path"] + "?" + self.scope["query_string"].decode()
+        headers = {k.decode(): v.decode() for k, v in self.scope["headers"]}
+        session = get_session(self.scope)
+        timings = RequestTimings("proxy", self.scope["method"], self.scope["path"])
 
         try:
-            async with session.get(url, data=body, headers=headers) as response:
+            async with upstreams.request(
+                session, self.scope["method"], path, timings=timings, data=body, headers=headers
+            ) as response:
                 nextjs_response_headers = [
                     (name.encode(), value.encode())
                     for name, value in response.headers.items()
@@ -110,12 +143,121 @@ class NextJsHttpProxy(NextJsProxyBase):
                 await self.send(
                     {"type": "http.response.start", "status": response.status, "headers": nextjs_response_headers}
                 )
-                async for data in response.content.iter_any():
+                async for data in iter_coalesced(response.content):
                     await self.send({"type": "http.response.body", "body": data, "more_body": True})
                 await self.send({"type": "http.response.body", "body": b"", "more_body": False})
+        except BaseException as error:
+            timings.finish(error=error)
+            raise
+        timings.finish()
+
+
+class NextJsStaticAssetsProxy(NextJsProxyBase):
+    """
+    Serves the static assets of Next.js (/_next/static/...) in production, when `assets_proxy` is enabled.
+
+    Assets are cached after the first request, so the following requests (and conditional requests
+    answered with 304) are served without sending a request to the Next.js server.
+    """
+
+    development_only = False
+
+    async def handle_message(self, message: Message) -> None:
+        if message["type"] == "http.request":
+            if not message.get("more_body", False):
+                await self.handle_request()
+        elif message["type"] == "http.disconnect":
+            raise StopReceiving
+
+    async def handle_request(self):
+        if self.scope["method"] not in ("GET", "HEAD"):
+            await self.send_response(405, {"Allow": "GET, HEAD"}, b"")
+            return
+
+        request_headers = {name.decode().lower(): value.decode() for name, value in self.scope["headers"]}
+        timings = RequestTimings("proxy", self.scope["method"], self.scope["path"])
+        try:
+            status, headers, content = await get_static_asset(
+                self.scope,
+                self.scope["path"],
+                accept_encoding=request_headers.get("accept-encoding", ""),
+                if_none_match=request_headers.get("if-none-match", ""),
+                if_modified_since=request_headers.get("if-modified-since", ""),
+                timings=timings,
+            )
+        except UPSTREAM_ERRORS as error:
+            timings.finish(error=error)
+            await self.send_response(503, {"Retry-After": str(UPSTREAM_COOLDOWN)}, b"")
+            return
+        timings.status = status
+        timings.finish()
+        await self.send_response(status, headers, content)
+
+    async def send_response(self, status: int, headers: dict[str, str], content: bytes):
+        response_headers = [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+        if status != 304:
+            # The length of the asset is also sent in response to HEAD requests, whose body is empty.
+            response_headers.append((b"content-length", str(len(content)).encode()))
+        await self.send({"type": "http.response.start", "status": status, "headers": response_headers})
+        await self.send({"type": "http.response.body", "body": b"" if self.scope["method"] == "HEAD" else content})
+
+
+class NextJsStaticFiles(NextJsProxyBase):
+    """
+    Serves the files of the `static_directory` (/_next/static/...) and `public_directory` (the public subdirectory)
+    settings from the disk, without sending requests to the Next.js server.
+
+    If the ASGI server supports the zero-copy send extension, the file is sent by the server (e.g. using sendfile).
+    """
+
+    development_only = False
+    chunk_size = 64 * 1024
+
+    def __init__(self, static_file: StaticFile):
+        super().__init__()
+        self.static_file = static_file
+
+    async def handle_message(self, message: Message) -> None:
+        if message["type"] == "http.request":
+            if not message.get("more_body", False):
+                await self.handle_request()
+        elif message["type"] == "http.disconnect":
+            raise StopReceiving
+
+    async def handle_request(self):
+        request_headers = {name.decode().lower(): value.decode() for name, value in self.scope["headers"]}
+        headers = self.static_file.headers
+        if is_not_modified(
+            headers, request_headers.get("if-none-match", ""), request_headers.get("if-modified-since", "")
+        ):
+            await self.send_start(304, {name: value for name, value in headers.items() if name != "Content-Type"})
+            await self.send({"type": "http.response.body", "body": b""})
+            return
+
+        await self.send_start(200, {**headers, "Content-Length": str(self.static_file.size)})
+        if self.scope["method"] == "HEAD":
+            await self.send({"type": "http.response.body", "body": b""})
+            return
+
+        file = await asyncio.to_thread(open, self.static_file.path, "rb")
+        try:
+            if "http.response.zerocopysend" in self.scope.get("extensions", {}):
+                await self.send({"type": "http.response.zerocopysend", "file": file})
+                return
+            while chunk := await asyncio.to_thread(file.read, self.chunk_size):
+                await self.send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await self.send({"type": "http.response.body", "body": b""})
         finally:
-            if session_is_temporary:
-                await session.close()
+            file.close()
+
+    async def send_start(self, status: int, headers: dict[str, str]):
+        await self.send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            }
+        )
 
 
 class NextJsWebSocketProxy(NextJsProxyBase):
@@ -150,12 +292,20 @@ class NextJsWebSocketProxy(NextJsProxyBase):
             raise StopReceiving
 
     async def connect(self):
-        nextjs_websocket_url = f"ws://{urlparse(NEXTJS_SERVER_URL).netloc}{self.scope['path']}"
+        # The upstream is only held during the handshake, so that the long-lived connection isn't counted
+        # as an outstanding request, nor keeps the probe of an ejected instance in progress.
+        upstream = upstreams.acquire()
+        nextjs_websocket_url = f"ws://{urlparse(upstream.url).netloc}{self.scope['path']}"
         try:
-            self.nextjs_connection = await websockets.connect(nextjs_websocket_url)
+            if UNIX_SOCKET_PATH:
+                self.nextjs_connection = await websockets.unix_connect(UNIX_SOCKET_PATH, nextjs_websocket_url)
+            else:
+                self.nextjs_connection = await websockets.connect(nextjs_websocket_url)
         except:
+            upstreams.release(upstream, failed=True)
             await self.send({"type": "websocket.close"})
             raise
+        upstreams.release(upstream)
         self.nextjs_listener_task = asyncio.create_task(self._receive_from_nextjs_server(self.nextjs_connection))
         await self.send({"type": "websocket.accept"})
 
@@ -203,13 +353,15 @@ class NextJsMiddleware:
       mode and forwards them to the Next.js development server. This works as a transparent
       proxy, handling both HTTP requests and WebSocket connections (for Hot Module Replacement).
 
+    - Sends 103 Early Hints for the Next.js pages whose assets are known, if `early_hints` is enabled.
+
     - Manages an aiohttp ClientSession throughout the application lifecycle using the ASGI
       lifespan protocol. The session is created during application startup and properly closed
       during shutdown, ensuring efficient reuse of HTTP connections when communicating with the
       Next.js server.
     """
 
-    HTTP_SESSION_KEY = "django_nextjs_http_session"
+    HTTP_SESSION_KEY = HTTP_SESSION_KEY
 
     def __init__(self, inner_app: ASGIApp) -> None:
         self.inner_app = inner_app
@@ -218,6 +370,8 @@ class NextJsMiddleware:
             # Pre-create ASGI callables for the consumers
             self.nextjs_http_proxy = NextJsHttpProxy.as_asgi()
             self.nextjs_websocket_proxy = NextJsWebSocketProxy.as_asgi()
+        elif ASSETS_PROXY:
+            self.nextjs_static_assets_proxy = NextJsStaticAssetsProxy.as_asgi()
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
 
@@ -235,9 +389,44 @@ class NextJsMiddleware:
                 elif scope["type"] == "websocket":
                     return await self.nextjs_websocket_proxy(scope, receive, send)
 
+        # --- Next.js static files on the disk (production, if enabled) ---
+        elif (
+            static_routes
+            and scope["type"] == "http"
+            and scope["method"] in ("GET", "HEAD")
+            and (static_file := find_static_file(scope.get("path", ""), self._get_accept_encoding(scope)))
+        ):
+            return await NextJsStaticFiles(static_file)(scope, receive, send)
+
+        # --- Next.js static assets (production, if enabled) ---
+        elif ASSETS_PROXY and scope["type"] == "http" and scope.get("path", "").startswith(STATIC_ASSETS_PREFIX):
+            return await self.nextjs_static_assets_proxy(scope, receive, send)
+
+        # --- Early hints of the Next.js pages (if enabled and supported by the ASGI server) ---
+        if EARLY_HINTS and scope["type"] == "http":
+            await self._send_early_hints(scope, send)
+
         # --- Default Handling ---
         return await self.inner_app(scope, receive, send)
 
+    @staticmethod
+    async def _send_early_hints(scope: Scope, send: Send) -> None:
+        """
+        Send a 103 Early Hints response which preloads the assets of the page, if it has been rendered before,
+        so that the browser fetches them while the page is being rendered.
+        """
+        if scope["method"] != "GET" or "http.response.early_hint" not in scope.get("extensions", {}):
+            return
+        # Client-side navigations request the RSC payload of the page, which doesn't need the assets of the document.
+        if any(name.lower() == b"rsc" for name, _ in scope["headers"]):
+            return
+        if links := get_early_hints(scope["path"]):
+            await send({"type": "http.response.early_hint", "links": links})
+
+    @staticmethod
+    def _get_accept_encoding(scope: Scope) -> str:
+        return next((value.decode() for name, value in scope["headers"] if name.lower() == b"accept-encoding"), "")
+
     async def _handle_lifespan(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
         Handle the lifespan protocol for the ASGI application.
@@ -252,13 +441,13 @@ class NextJsMiddleware:
                 # Create a new aiohttp ClientSession and store it in the scope's state.
                 # This session will be used for making HTTP requests to the Next.js server
                 # during the application's lifetime.
-                scope["state"][self.HTTP_SESSION_KEY] = aiohttp.ClientSession()
+                scope["state"][self.HTTP_SESSION_KEY] = create_session()
             return message
 
         async def lifespan_send(message: Message) -> None:
             if message["type"] == "lifespan.shutdown.complete" and "state" in scope:
                 # Clean up resources after inner app shutdown is complete
-                http_session: typing.Optional[aiohttp.ClientSession] = scope["state"].get(self.HTTP_SESSION_KEY)
+                http_session: typing.Optional[Session] = scope["state"].get(self.HTTP_SESSION_KEY)
                 if http_session:
                     await http_session.close()
             await send(message)
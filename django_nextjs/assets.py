@@ -0,0 +1,237 @@
+import asyncio
+import functools
+import hashlib
+import os
+import threading
+import typing
+from collections import OrderedDict
+from typing import Optional
+
+from django.utils.http import parse_etags, parse_http_date_safe
+
+from .app_settings import ASSETS_CACHE_DIRECTORY, ASSETS_CACHE_DISK_MAX_BYTES, ASSETS_CACHE_MAX_BYTES
+from .cache import single_flight
+from .instrumentation import RequestTimings
+from .session import get_session
+from .upstreams import upstreams
+
+# Next.js adds the build ID or the content hash to the paths of these files, so they never change.
+STATIC_ASSETS_PREFIX = "/_next/static/"
+
+# Headers of Next.js responses which are forwarded to the client
+ASSET_RESPONSE_HEADERS = ("Content-Type", "Content-Encoding", "Cache-Control", "ETag", "Last-Modified", "Vary")
+
+# Encodings requested from Next.js on behalf of the client, in the order of preference
+ASSET_ENCODINGS = ("br", "gzip")
+
+
+class CachedAsset(typing.NamedTuple):
+    headers: dict[str, str]
+    content_hash: str
+    size: int
+    content: Optional[bytes]  # None if the content is stored on the disk
+
+
+class AssetCache:
+    """
+    Thread-safe LRU cache of static assets.
+
+    Up to `max_bytes` of contents are kept in memory. If `directory` is set, the least recently used contents
+    are moved to files named by their hash in that directory (up to `disk_max_bytes`) instead of being dropped.
+    """
+
+    def __init__(self, max_bytes: int, directory: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.size = 0
+        self.disk_size = 0
+        self._memory: OrderedDict[tuple, CachedAsset] = OrderedDict()
+        self._disk: OrderedDict[tuple, CachedAsset] = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: tuple) -> Optional[CachedAsset]:
+        with self._lock:
+            for entries in (self._memory, self._disk):
+                if (asset := entries.get(key)) is not None:
+                    entries.move_to_end(key)
+                    return asset
+        return None
+
+    def set(self, key: tuple, headers: dict[str, str], content: bytes) -> CachedAsset:
+        """
+        Store the asset. The evicted contents may be written to the disk, so this should be called in a thread.
+        """
+        asset = CachedAsset(headers, hashlib.sha256(content).hexdigest(), len(content), content)
+        evicted = []
+        with self._lock:
+            self._delete(key)
+            self._memory[key] = asset
+            self.size += asset.size
+            while self.size > self.max_bytes:
+                evicted_key, evicted_asset = self._memory.popitem(last=False)
+                self.size -= evicted_asset.size
+                evicted.append((evicted_key, evicted_asset))
+        # The files are written without holding the lock, so that other threads aren't blocked meanwhile.
+        for evicted_key, evicted_asset in evicted:
+            self._spill(evicted_key, evicted_asset)
+        return asset
+
+    def delete(self, key: tuple) -> None:
+        with self._lock:
+            self._delete(key)
+
+    def read(self, asset: CachedAsset) -> bytes:
+        """
+        Return the content of the asset (from the disk if it's not in memory).
+
+        Raise FileNotFoundError if its file has been removed (e.g. by another process sharing the directory).
+        """
+        if asset.content is not None:
+            return asset.content
+        with open(self._get_path(asset.content_hash), "rb") as file:
+            return file.read()
+
+    def _spill(self, key: tuple, asset: CachedAsset) -> None:
+        if not self.directory or asset.size > self.disk_max_bytes:
+            return
+        path = self._get_path(asset.content_hash)
+        if not os.path.exists(path):
+            # Write to a temporary file first, so that other processes never read a partial file.
+            temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "wb") as file:
+                file.write(asset.content)
+            os.replace(temporary_path, path)
+
+        removed = []
+        with self._lock:
+            if key in self._memory or key in self._disk:
+                # The asset has been stored again meanwhile.
+                return
+            self._disk[key] = asset._replace(content=None)
+            self.disk_size += asset.size
+            while self.disk_size > self.disk_max_bytes:
+                _, evicted = self._disk.popitem(last=False)
+                self.disk_size -= evicted.size
+                if not any(item.content_hash == evicted.content_hash for item in self._disk.values()):
+                    removed.append(self._get_path(evicted.content_hash))
+        # Other processes sharing the directory may still refer to the removed files, and they fetch the assets again.
+        for removed_path in removed:
+            try:
+                os.remove(removed_path)
+            except FileNotFoundError:
+                pass
+
+    def _delete(self, key: tuple) -> None:
+        if (asset := self._memory.pop(key, None)) is not None:
+            self.size -= asset.size
+        if (asset := self._disk.pop(key, None)) is not None:
+            self.disk_size -= asset.size
+
+    def _get_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, content_hash)
+
+    def __len__(self):
+        return len(self._memory) + len(self._disk)
+
+
+def get_asset_encoding(accept_encoding: str) -> str:
+    """
+    Return the encoding requested from Next.js for a client which accepts `accept_encoding`.
+    """
+    accepted = {value.split(";")[0].strip().lower() for value in accept_encoding.split(",")}
+    return next((encoding for encoding in ASSET_ENCODINGS if encoding in accepted), "identity")
+
+
+def is_not_modified(headers: typing.Mapping[str, str], if_none_match: str, if_modified_since: str) -> bool:
+    """
+    Whether the client already has the asset, according to its conditional request headers.
+    """
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        # Weak comparison (RFC 9110, section 13.1.2)
+        return "*" in etags or headers.get("ETag", "").removeprefix("W/") in [etag.removeprefix("W/") for etag in etags]
+    if if_modified_since and "Last-Modified" in headers:
+        since = parse_http_date_safe(if_modified_since)
+        last_modified = parse_http_date_safe(headers["Last-Modified"])
+        return since is not None and last_modified is not None and last_modified <= since
+    return False
+
+
+async def get_static_asset(
+    scope: Optional[dict],
+    path: str,
+    accept_encoding: str = "",
+    if_none_match: str = "",
+    if_modified_since: str = "",
+    timings: Optional[RequestTimings] = None,
+) -> tuple[int, dict[str, str], bytes]:
+    """
+    Return the status, headers and content of the response to a request for a static asset of Next.js.
+
+    Assets are served from the cache without sending a request to Next.js. Only successful responses are cached.
+    """
+    encoding = get_asset_encoding(accept_encoding)
+    key = (path, encoding)
+    asset = asset_cache.get(key)
+    if timings is not None:
+        timings.cache = "miss" if asset is None else "hit"
+    if asset is None:
+        status, headers, content = await _load_static_asset(scope, path, encoding, timings)
+        if status != 200:
+            return status, headers, content
+    else:
+        headers, content = asset.headers, asset.content
+
+    if is_not_modified(headers, if_none_match, if_modified_since):
+        return 304, {name: value for name, value in headers.items() if name != "Content-Type"}, b""
+    if content is None:
+        try:
+            content = await asyncio.get_running_loop().run_in_executor(None, asset_cache.read, asset)
+        except FileNotFoundError:
+            # Another process sharing the cache directory has removed the file, so the asset is fetched again.
+            asset_cache.delete(key)
+            if timings is not None:
+                timings.cache = "miss"
+            return await _load_static_asset(scope, path, encoding, timings)
+    return 200, headers, content
+
+
+async def _load_static_asset(
+    scope: Optional[dict], path: str, encoding: str, timings: Optional[RequestTimings]
+) -> tuple[int, dict[str, str], bytes]:
+    """
+    Fetch the asset from Next.js and store it in the cache if the response is successful.
+    """
+    # Concurrent requests for the same asset share a single request to Next.js
+    status, headers, content = await single_flight.run(
+        f"asset:{path}:{encoding}", functools.partial(_fetch_static_asset, scope, path, encoding, timings)
+    )
+    if status == 200:
+        # Storing the asset may write the evicted assets to the disk.
+        await asyncio.to_thread(asset_cache.set, (path, encoding), headers, content)
+    return status, headers, content
+
+
+async def _fetch_static_asset(
+    scope: Optional[dict], path: str, encoding: str, timings: Optional[RequestTimings]
+) -> tuple[int, dict[str, str], bytes]:
+    async with upstreams.request(
+        get_session(scope),
+        "GET",
+        path,
+        timings=timings,
+        headers={"Accept-Encoding": encoding},
+        # The content is cached and served as sent by Next.js (e.g. compressed).
+        auto_decompress=False,
+    ) as response:
+        content = await response.read()
+        headers = {name: response.headers[name] for name in ASSET_RESPONSE_HEADERS if name in response.headers}
+        if "ETag" not in headers:
+            headers["ETag"] = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+        return response.status, headers, content
+
+
+asset_cache = AssetCache(ASSETS_CACHE_MAX_BYTES, ASSETS_CACHE_DIRECTORY, ASSETS_CACHE_DISK_MAX_BYTES)
@@ -0,0 +1,281 @@
+import asyncio
+import hashlib
+import sys
+import threading
+import time
+import typing
+import weakref
+from collections import OrderedDict
+from typing import Optional
+
+from django.core.cache import caches
+from django.http import HttpRequest
+from django.http.request import HttpHeaders
+from django.utils.module_loading import import_string
+
+from .app_settings import (
+    CACHE_BACKEND,
+    CACHE_MAX_BYTES,
+    CACHE_VARY,
+    COALESCE_EXCLUDE_COOKIES,
+    COALESCE_EXCLUDE_HEADERS,
+    SHELL_CACHE_SIZE,
+    TEMPLATE_CACHE_SIZE,
+)
+
+# Only responses with these statuses are cached
+CACHEABLE_STATUSES = frozenset([200, 301, 308, 404])
+
+# Request headers which change the response of Next.js (full HTML or RSC payload)
+VARY_HEADERS = ("Rsc", "Next-Url")
+VARY_HEADER_PREFIX = "Next-Router-"
+# The keys of these headers in `request.META`
+VARY_META_KEYS = frozenset(HttpHeaders.to_wsgi_name(name) for name in VARY_HEADERS)
+VARY_META_KEY_PREFIX = HttpHeaders.to_wsgi_name(VARY_HEADER_PREFIX)
+COALESCE_EXCLUDE_META_KEYS = frozenset(HttpHeaders.to_wsgi_name(name) for name in COALESCE_EXCLUDE_HEADERS)
+
+# Used for "stale-while-revalidate" without a value (one year)
+UNLIMITED_STALENESS = 31536000
+
+
+class CachedPage(typing.NamedTuple):
+    """
+    A response of the Next.js server, before applying the template.
+    """
+
+    content: bytes
+    status: int
+    headers: dict[str, str]
+    expires: float  # Unix time after which the page is stale
+    stale_until: float  # Unix time until which the stale page may be served while it's revalidated
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires
+
+
+class CachedShell(typing.NamedTuple):
+    """
+    The beginning of a streamed page (the template and the Next.js document until the body begins),
+    which is sent before the Next.js response arrives when the `cache_shell` option is used.
+    """
+
+    content: bytes
+    head: bytes  # Sections 1 to 3 of the Next.js document, to detect when they change
+    headers: dict[str, str]
+    charset: str
+
+
+class MemoryCache:
+    """
+    Thread-safe in-process LRU cache with a total size budget.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._pages: OrderedDict[str, tuple[CachedPage, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[CachedPage]:
+        with self._lock:
+            item = self._pages.get(key)
+            if item is None:
+                return None
+            page, _ = item
+            if time.time() >= page.stale_until:
+                self._delete(key)
+                return None
+            self._pages.move_to_end(key)
+            return page
+
+    async def set(self, key: str, page: CachedPage) -> None:
+        size = sys.getsizeof(page.content) + sum(map(sys.getsizeof, page.headers.values()))
+        with self._lock:
+            self._delete(key)
+            if size > self.max_bytes:
+                return
+            self._pages[key] = (page, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._delete(next(iter(self._pages)))
+
+    def _delete(self, key: str) -> None:
+        if item := self._pages.pop(key, None):
+            self.size -= item[1]
+
+
+class LRUCache:
+    """
+    A thread-safe mapping which keeps the `max_size` most recently used items.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                return default
+            return self._items[key]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DjangoCache:
+    """
+    Stores pages in a Django cache backend, so that they can be shared between processes.
+    """
+
+    def __init__(self, alias: str):
+        self.alias = alias
+
+    async def get(self, key: str) -> Optional[CachedPage]:
+        page = await caches[self.alias].aget(key)
+        return CachedPage(*page) if page is not None else None
+
+    async def set(self, key: str, page: CachedPage) -> None:
+        # Store a plain tuple, so that entries stay readable across versions of this class.
+        await caches[self.alias].aset(key, tuple(page), timeout=max(page.stale_until - time.time(), 1))
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls with the same key, so that they share a single execution and its result.
+
+    The call runs in its own task, so a caller being cancelled (e.g. the client disconnected)
+    doesn't cancel it for the other callers.
+    """
+
+    def __init__(self):
+        # Tasks are bound to their event loop, so there's a separate map for each loop.
+        self._calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Task]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    async def run(self, key: str, function: typing.Callable[[], typing.Awaitable]):
+        return await asyncio.shield(self.start(key, function))
+
+    def start(self, key: str, function: typing.Callable[[], typing.Awaitable]) -> asyncio.Task:
+        """
+        Start the call in the running loop without waiting for it, unless a call with the same key is running.
+        """
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+        task = calls.get(key)
+        if task is None:
+            task = calls[key] = loop.create_task(function())
+            task.add_done_callback(lambda _: calls.pop(key, None))
+        return task
+
+    def __len__(self):
+        return sum(map(len, self._calls.values()))
+
+
+def is_shareable(request: HttpRequest) -> bool:
+    """
+    Whether the response of Next.js for this request can be shared with other requests with the same cache key.
+    Requests with user-specific cookies or headers (e.g. the session cookie) are not shareable.
+    """
+    return not (
+        any(name in request.COOKIES for name in COALESCE_EXCLUDE_COOKIES)
+        or any(key in request.META for key in COALESCE_EXCLUDE_META_KEYS)
+    )
+
+
+def get_page_cache() -> Optional[typing.Union[MemoryCache, DjangoCache]]:
+    if not CACHE_BACKEND:
+        return None
+    if CACHE_BACKEND == "memory":
+        return MemoryCache(CACHE_MAX_BYTES)
+    return DjangoCache(CACHE_BACKEND)
+
+
+def get_cache_key(request: HttpRequest, allow_redirects: bool = False, headers: Optional[dict] = None) -> Optional[str]:
+    """
+    Return the cache key of the Next.js page for this request, or None if the request shouldn't use the cache.
+
+    The key contains the path, the query string, the headers Next.js uses to select the response type,
+    the options of the request to Next.js and the value of the `cache_vary` function.
+    """
+    vary = ""
+    if CACHE_VARY:
+        vary_function = import_string(CACHE_VARY) if isinstance(CACHE_VARY, str) else CACHE_VARY
+        vary = vary_function(request)
+        if vary is None:
+            return None
+
+    # A single pass over `request.META`, which is cheaper than building `request.headers`
+    request_headers = [
+        (HttpHeaders.parse_header_name(key).lower(), value)
+        for key, value in request.META.items()
+        if key in VARY_META_KEYS or key.startswith(VARY_META_KEY_PREFIX)
+    ]
+    key = repr(
+        (
+            request.path_info,
+            request.META.get("QUERY_STRING", ""),
+            sorted(request_headers),
+            allow_redirects,
+            sorted((headers or {}).items()),
+            str(vary),
+        )
+    )
+    return "django_nextjs:page:" + hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_cache_lifetime(status: int, headers: typing.Mapping[str, str]) -> Optional[tuple[int, int]]:
+    """
+    Return (max-age, stale-while-revalidate) of a Next.js response according to its Cache-Control header,
+    or None if the response must not be stored in a shared cache.
+    """
+    if status not in CACHEABLE_STATUSES or "Set-Cookie" in headers:
+        return None
+
+    directives = {}
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name.lower()] = value.strip('"')
+
+    if {"private", "no-store", "no-cache"} & directives.keys():
+        return None
+
+    try:
+        if "s-maxage" in directives:
+            max_age = int(directives["s-maxage"])
+        elif "max-age" in directives and "public" in directives:
+            max_age = int(directives["max-age"])
+        else:
+            return None
+        if "stale-while-revalidate" in directives:
+            # Next.js may send "stale-while-revalidate" without a value, which means it's unlimited.
+            stale_while_revalidate = int(directives["stale-while-revalidate"] or UNLIMITED_STALENESS)
+        else:
+            stale_while_revalidate = 0
+    except ValueError:
+        return None
+
+    if max_age <= 0 and stale_while_revalidate <= 0:
+        return None
+    return max_age, stale_while_revalidate
+
+
+page_cache = get_page_cache()
+single_flight = SingleFlight()
+template_fragments_cache = LRUCache(TEMPLATE_CACHE_SIZE)
+shell_cache = LRUCache(SHELL_CACHE_SIZE)
@@ -0,0 +1,142 @@
+import contextlib
+import typing
+import zlib
+from typing import Optional
+
+from .app_settings import COMPRESSION_ENCODINGS, COMPRESSION_MIN_BYTES
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+else:
+    zstandard = None
+
+# Fast compression levels, so that compressing a streamed response doesn't take more CPU time than rendering it
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+# Content types of the Next.js responses which are compressed
+COMPRESSIBLE_CONTENT_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+
+class Compressor(typing.Protocol):
+    def compress(self, data: bytes) -> bytes:
+        """
+        Compress the data and flush it, so that the client can decode everything received so far.
+        """
+
+    def finish(self) -> bytes:
+        """
+        Return the end of the compressed stream.
+        """
+
+
+class GzipCompressor:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self):
+        if zstd is not None:
+            self._compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL)
+        else:
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        if zstd is not None:
+            return self._compressor.compress(data, zstd.ZstdCompressor.FLUSH_BLOCK)
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def get_compressors() -> dict[str, typing.Callable[[], Compressor]]:
+    """
+    Return the compressors of the configured encodings whose libraries are installed, in the order of preference.
+    """
+    available = {
+        "zstd": ZstdCompressor if zstd is not None or zstandard is not None else None,
+        "br": BrotliCompressor if brotli is not None else None,
+        "gzip": GzipCompressor,
+    }
+    return {encoding: available[encoding] for encoding in COMPRESSION_ENCODINGS if available.get(encoding)}
+
+
+def get_response_encoding(accept_encoding: str, content_type: str) -> Optional[str]:
+    """
+    Return the encoding used to compress a response for a client which accepts `accept_encoding`,
+    or None if the response shouldn't be compressed.
+    """
+    if not compressors or not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES):
+        return None
+    accepted, rejected = set(), set()
+    for value in accept_encoding.split(","):
+        encoding, _, params = value.partition(";")
+        _, _, quality = params.partition("q=")
+        try:
+            (accepted if float(quality or 1) > 0 else rejected).add(encoding.strip().lower())
+        except ValueError:
+            continue
+    for encoding in compressors:
+        if encoding in accepted or ("*" in accepted and encoding not in rejected):
+            return encoding
+    return None
+
+
+def compress(content: bytes, encoding: str) -> Optional[bytes]:
+    """
+    Compress the whole content, or return None if it's too small to be worth compressing.
+    """
+    if len(content) < COMPRESSION_MIN_BYTES:
+        return None
+    compressor = compressors[encoding]()
+    return compressor.compress(content) + compressor.finish()
+
+
+async def compress_stream(chunks: typing.AsyncGenerator[bytes, None], encoding: str) -> typing.AsyncIterator[bytes]:
+    """
+    Compress a stream incrementally. Each chunk is flushed, so the client can render it without waiting for the rest.
+    The stream is closed when the compressed stream is closed.
+    """
+    compressor = compressors[encoding]()
+    async with contextlib.aclosing(chunks):
+        async for chunk in chunks:
+            if compressed := compressor.compress(chunk):
+                yield compressed
+    yield compressor.finish()
+
+
+compressors = get_compressors()
@@ -0,0 +1,106 @@
+import html
+import re
+import typing
+from typing import Optional
+
+from .app_settings import EARLY_HINTS_CACHE_SIZE
+from .cache import LRUCache
+
+HEAD_END_MARKER = b"</head>"
+
+# The head is searched for assets only up to this size
+MAX_HEAD_SIZE = 1024 * 1024
+
+# Maximum number of assets preloaded by the early hints of a page
+MAX_LINKS = 32
+
+TAG_RE = re.compile(rb"<(link|script)\b([^>]*)>", re.IGNORECASE)
+ATTRIBUTE_RE = re.compile(rb"""([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?""")
+# Only assets of the same origin (e.g. /_next/static/...) are preloaded, with URLs which are valid in a Link header.
+LOCAL_URL_RE = re.compile(r"/(?!/)[!#$%&'()*+,./0-9:;=?@A-Z\[\]_a-z~-]*")
+
+
+def get_preload_links(head: bytes) -> list[bytes]:
+    """
+    Return the values of the Link header which preload the stylesheets, scripts and preloaded assets
+    of the head of a document.
+    """
+    links = {}
+    for tag, attributes in TAG_RE.findall(head):
+        attributes = _parse_attributes(attributes)
+        if tag.lower() == b"script":
+            # Scripts with nomodule are the polyfills, which are not executed by modern browsers.
+            url, destination = attributes.get("src"), None if "nomodule" in attributes else "script"
+        else:
+            rel = attributes.get("rel", "").lower().split()
+            url = attributes.get("href")
+            if "stylesheet" in rel:
+                destination = "style"
+            elif "preload" in rel and "imagesrcset" not in attributes:
+                destination = attributes.get("as", "").lower()
+            else:
+                destination = None
+        if not url or not destination or not LOCAL_URL_RE.fullmatch(url):
+            continue
+        link = f"<{url}>; rel=preload; as={destination}"
+        if "crossorigin" in attributes:
+            link += (
+                "; crossorigin=use-credentials" if attributes["crossorigin"] == "use-credentials" else "; crossorigin"
+            )
+        links[link.encode()] = None
+        if len(links) == MAX_LINKS:
+            break
+    return list(links)
+
+
+def _parse_attributes(attributes: bytes) -> dict[str, str]:
+    return {
+        name.decode("latin-1").lower(): html.unescape((a or b or c).decode("latin-1"))
+        for name, a, b, c in ATTRIBUTE_RE.findall(attributes)
+    }
+
+
+def get_early_hints(path: str) -> Optional[list[bytes]]:
+    return early_hints_cache.get(path)
+
+
+def learn_early_hints(path: str, status: int, headers: typing.Mapping[str, str], content: bytes) -> None:
+    """
+    Remember the assets of the head of a document rendered by Next.js,
+    so that they're sent as early hints on the following requests to the same path.
+
+    `content` may be the whole document or its beginning (e.g. the first chunks of a stream).
+    """
+    if not headers.get("Content-Type", "").startswith("text/html") or "Content-Encoding" in headers:
+        # e.g. an RSC payload, which is requested from the same path by client-side navigations
+        return
+    if status != 200:
+        early_hints_cache.delete(path)
+        return
+    end = content.find(HEAD_END_MARKER, 0, MAX_HEAD_SIZE)
+    if end == -1:
+        return
+    if links := get_preload_links(content[:end]):
+        early_hints_cache.set(path, links)
+    else:
+        early_hints_cache.delete(path)
+
+
+async def learn_early_hints_from_stream(
+    path: str, status: int, headers: typing.Mapping[str, str], chunks: typing.AsyncIterator[bytes]
+) -> typing.AsyncIterator[bytes]:
+    """
+    Pass the chunks of a streamed document through, and learn its early hints when its head has been received.
+    """
+    buffer: Optional[bytearray] = bytearray()
+    async for chunk in chunks:
+        if buffer is not None:
+            start = max(len(buffer) - len(HEAD_END_MARKER) + 1, 0)
+            buffer += chunk
+            if buffer.find(HEAD_END_MARKER, start) != -1 or len(buffer) > MAX_HEAD_SIZE:
+                learn_early_hints(path, status, headers, bytes(buffer))
+                buffer = None
+        yield chunk
+
+
+early_hints_cache = LRUCache(EARLY_HINTS_CACHE_SIZE)
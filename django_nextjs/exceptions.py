@@ -1,2 +1,6 @@
 class NextJsImproperlyConfigured(Exception):
     pass
+
+
+class NextJsUnavailable(Exception):
+    pass
@@ -0,0 +1,87 @@
+import time
+import types
+import typing
+from typing import Optional
+
+import aiohttp
+
+from .signals import nextjs_request_finished
+
+
+class RequestTimings:
+    """
+    Measurements of a request handled by django-nextjs, sent with the `nextjs_request_finished` signal.
+
+    Durations are in seconds. Values which don't apply to the request (e.g. upstream timings of a page
+    served from the cache, or the template render time of a page without a template) are None.
+    """
+
+    def __init__(self, source: str, method: str, path: str):
+        self.source = source  # "render", "stream", "proxy" or "prefetch"
+        self.method = method
+        self.path = path
+        self.upstream_url: Optional[str] = None
+        self.status: Optional[int] = None
+        self.cache: Optional[str] = None  # "hit" or "miss", if the cache is enabled
+        self.connection_acquire: Optional[float] = None  # Until a connection to Next.js is acquired from the pool
+        self.ttfb: Optional[float] = None  # Until the response headers of Next.js are received
+        self.upstream_total: Optional[float] = None  # Until the response body of Next.js is received
+        self.bytes_received: Optional[int] = None
+        self.template_render: Optional[float] = None
+        self.total: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        self.start = time.perf_counter()
+
+    def finish(self, request=None, error: Optional[BaseException] = None) -> None:
+        """
+        Record the total time and send the `nextjs_request_finished` signal.
+        """
+        self.total = time.perf_counter() - self.start
+        self.error = error
+        nextjs_request_finished.send(sender=self.source, timings=self, request=request)
+
+    def server_timing(self) -> str:
+        """
+        Return the value of the Server-Timing header of the response.
+        If the request isn't finished yet, the total time is measured until now.
+        """
+        total = self.total if self.total is not None else time.perf_counter() - self.start
+        metrics = [] if self.cache is None else [f'nextjs-cache;desc="{self.cache}"']
+        for name, duration in [
+            ("nextjs-connect", self.connection_acquire),
+            ("nextjs-ttfb", self.ttfb),
+            ("nextjs-template", self.template_render),
+            ("nextjs-total", total),
+        ]:
+            if duration is not None:
+                metrics.append(f"{name};dur={duration * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def as_dict(self) -> dict[str, typing.Any]:
+        return {name: value for name, value in vars(self).items() if name != "start"}
+
+    def __repr__(self):
+        return f"<RequestTimings {self.source} {self.method} {self.path}>"
+
+
+async def _on_request_start(
+    session: aiohttp.ClientSession, context: types.SimpleNamespace, params: aiohttp.TraceRequestStartParams
+) -> None:
+    context.request_start = time.perf_counter()
+
+
+async def _on_connection_acquired(session: aiohttp.ClientSession, context: types.SimpleNamespace, params) -> None:
+    if isinstance(context.trace_request_ctx, RequestTimings):
+        context.trace_request_ctx.connection_acquire = time.perf_counter() - context.request_start
+
+
+def create_trace_config() -> aiohttp.TraceConfig:
+    """
+    Create a trace config which records the connection acquire time
+    of requests sent with a `RequestTimings` object as `trace_request_ctx`.
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_connection_create_end.append(_on_connection_acquired)
+    trace_config.on_connection_reuseconn.append(_on_connection_acquired)
+    return trace_config
@@ -0,0 +1,62 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_nextjs.prefetch import DEFAULT_CONCURRENCY, prefetch_nextjs_pages
+from django_nextjs.session import background_loop
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch Next.js pages concurrently to store them in the page cache (e.g. after a deployment), "
+        "and optionally write them to a directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", help="The paths of the pages, e.g. / /about?tab=team")
+        parser.add_argument(
+            "--paths-file", help='A file with a path on each line ("-" to read the paths from the standard input).'
+        )
+        parser.add_argument("--template", default="", help="The template applied to the pages written to the disk.")
+        parser.add_argument("--output-dir", help="Write each page with status 200 to <output-dir>/<path>/index.html.")
+        parser.add_argument("--host", help="The Host header of the requests, e.g. example.com.")
+        parser.add_argument("--allow-redirects", action="store_true", help="Follow the redirects of Next.js.")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help=f"The maximum number of pages fetched at the same time (default: {DEFAULT_CONCURRENCY}).",
+        )
+
+    def handle(self, *args, **options):
+        paths = list(options["paths"])
+        if options["paths_file"]:
+            file = sys.stdin if options["paths_file"] == "-" else open(options["paths_file"])
+            with file:
+                paths += [path for line in file if (path := line.strip()) and not path.startswith("#")]
+        if not paths:
+            raise CommandError("No paths were given.")
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+
+        results = background_loop.run_sync(
+            prefetch_nextjs_pages(
+                paths,
+                template_name=options["template"],
+                allow_redirects=options["allow_redirects"],
+                host=options["host"],
+                output_dir=options["output_dir"],
+                concurrency=options["concurrency"],
+            )
+        )
+
+        failed = 0
+        for result in results:
+            if result.error is not None or result.status >= 400:
+                failed += 1
+                self.stderr.write(f"{result.status or 'error'} {result.path} {result.error or ''}".rstrip())
+                continue
+            notes = [note for note in ("cached" if result.cached else "", result.file or "") if note]
+            self.stdout.write(f"{result.status} {result.path}" + (f" ({', '.join(notes)})" if notes else ""))
+        if failed:
+            raise CommandError(f"{failed} of {len(results)} pages couldn't be prefetched.")
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import typing
+from typing import Optional
+
+from django.http import HttpRequest, QueryDict
+from django.utils._os import safe_join
+
+from .cache import page_cache
+from .instrumentation import RequestTimings
+from .render import (
+    TemplateCacheKey,
+    _apply_template,
+    _get_charset,
+    _prepare_nextjs_fetch,
+    _run_request_code,
+    _store_nextjs_page,
+)
+from .upstreams import UNAVAILABLE_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Number of pages fetched from Next.js at the same time
+DEFAULT_CONCURRENCY = 8
+
+
+class PrefetchResult(typing.NamedTuple):
+    path: str
+    status: Optional[int]  # None if the page couldn't be fetched
+    cached: bool  # Whether the page has been stored in the cache
+    file: Optional[str]  # The file the page has been written to
+    error: Optional[Exception]
+
+
+def build_request(path: str, host: Optional[str] = None) -> HttpRequest:
+    """
+    Build a GET request for the path (which may contain a query string), like the ones received by the views.
+    It doesn't go through the middlewares, so it doesn't have their attributes (e.g. `request.user`).
+    """
+    path, _, query_string = path.partition("?")
+    request = HttpRequest()
+    request.method = "GET"
+    request.path = request.path_info = "/" + path.lstrip("/")
+    request.META = {
+        "QUERY_STRING": query_string,
+        "REMOTE_ADDR": "127.0.0.1",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        **({"HTTP_HOST": host} if host else {}),
+    }
+    request.GET = QueryDict(query_string)
+    return request
+
+
+def get_output_file(output_dir: str, path: str) -> str:
+    """
+    Return the file a page is written to: `index.html` in the directory of its path.
+    Raise ValueError if the path has a query string (the pages of `/blog` and `/blog?page=2` would be written to the
+    same file), and SuspiciousFileOperation if the file isn't in `output_dir`.
+    """
+    path, separator, _ = path.partition("?")
+    if separator:
+        raise ValueError("Pages with a query string can't be written to a file.")
+    return safe_join(output_dir, path.strip("/"), "index.html")
+
+
+async def prefetch_nextjs_pages(
+    paths: typing.Iterable[str],
+    template_name: str = "",
+    context: Optional[dict] = None,
+    using: Optional[str] = None,
+    allow_redirects: bool = False,
+    headers: Optional[dict] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+    stale_while_revalidate: Optional[int] = None,
+    host: Optional[str] = None,
+    output_dir: Optional[str] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> list[PrefetchResult]:
+    """
+    Fetch the pages from the Next.js server concurrently (at most `concurrency` at a time), e.g. to warm the cache
+    after a deployment. The cacheable pages are stored in the page cache (replacing the cached ones).
+
+    If `output_dir` is set, the pages with status 200 are written to files in it (after applying the template),
+    e.g. to pre-generate popular pages. The paths with a query string are then rejected (with a ValueError).
+    The results are returned in the order of `paths`; the errors of the pages are returned instead of being raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def prefetch(path: str) -> PrefetchResult:
+        async with semaphore:
+            return await _prefetch_nextjs_page(
+                path,
+                template_name,
+                context,
+                using,
+                allow_redirects,
+                headers,
+                template_cache_key,
+                stale_while_revalidate,
+                host,
+                output_dir,
+            )
+
+    return await asyncio.gather(*[prefetch(path) for path in paths])
+
+
+async def _prefetch_nextjs_page(
+    path: str,
+    template_name: str,
+    context: Optional[dict],
+    using: Optional[str],
+    allow_redirects: bool,
+    headers: Optional[dict],
+    template_cache_key: Optional[TemplateCacheKey],
+    stale_while_revalidate: Optional[int],
+    host: Optional[str],
+    output_dir: Optional[str],
+) -> PrefetchResult:
+    request = build_request(path, host)
+    timings = RequestTimings("prefetch", request.method, request.path)
+    status, cached, file = None, False, None
+    try:
+        # Checked before fetching the page, so that the pages which can't be written aren't cached either.
+        output_file = get_output_file(output_dir, path) if output_dir else None
+        cache_key, _, fetch = await _run_request_code(_prepare_nextjs_fetch, request, allow_redirects, headers)
+        content, status, response_headers = await fetch(timings=timings)
+
+        if cache_key and page_cache and status not in UNAVAILABLE_STATUSES:
+            cached = await _store_nextjs_page(cache_key, content, status, response_headers, stale_while_revalidate)
+
+        if output_file and status == 200:
+            if template_name:
+                template_start = time.perf_counter()
+                content = await _apply_template(
+                    content,
+                    _get_charset(response_headers),
+                    request,
+                    template_name,
+                    context,
+                    using,
+                    template_cache_key,
+                )
+                timings.template_render = time.perf_counter() - template_start
+            await asyncio.to_thread(_write_file, output_file, content)
+            file = output_file
+    except Exception as error:
+        logger.warning("Failed to prefetch the Next.js page %s: %r", path, error)
+        timings.finish(request, error)
+        return PrefetchResult(path, status, cached, file, error)
+
+    timings.finish(request)
+    return PrefetchResult(path, status, cached, file, None)
+
+
+def _write_file(path: str, content: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first, so that the file is never served partially written.
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(content)
+    os.replace(temporary_path, path)
@@ -1,14 +1,18 @@
 import logging
-import urllib.request
-from http.client import HTTPResponse
+from contextlib import AsyncExitStack
 
+import aiohttp
 from django import http
 from django.conf import settings
 from django.views import View
 
-from django_nextjs.app_settings import NEXTJS_SERVER_URL
+from django_nextjs.app_settings import UPSTREAM_COOLDOWN
 from django_nextjs.asgi import NextJsHttpProxy, NextJsWebSocketProxy
+from django_nextjs.assets import get_static_asset
 from django_nextjs.exceptions import NextJsImproperlyConfigured
+from django_nextjs.instrumentation import RequestTimings
+from django_nextjs.session import background_loop, get_session
+from django_nextjs.upstreams import UPSTREAM_ERRORS, upstreams
 
 logger = logging.getLogger(__name__)
 
@@ -52,22 +56,73 @@ class NextJSProxyView(View):
         return super().dispatch(request, *args, **kwargs)
 
     def get(self, request):
-        url = NEXTJS_SERVER_URL + request.path + "?" + request.GET.urlencode()
+        path = request.path + "?" + request.GET.urlencode()
         headers = {}
         for header in ["Cookie", "User-Agent"]:
             if header in request.headers:
                 headers[header] = request.headers[header]
 
-        urllib_response = urllib.request.urlopen(urllib.request.Request(url, headers=headers))
+        timings = RequestTimings("proxy", request.method, request.path)
+        exit_stack = AsyncExitStack()
+        try:
+            nextjs_response = background_loop.run_sync(self._request(path, headers, exit_stack, timings))
+        except Exception as error:
+            timings.finish(request, error)
+            raise
 
         return http.StreamingHttpResponse(
-            self._iter_content(urllib_response), headers={"Content-Type": urllib_response.headers.get("Content-Type")}
+            self._iter_content(request, nextjs_response, exit_stack, timings),
+            headers={"Content-Type": nextjs_response.headers.get("Content-Type")},
         )
 
-    def _iter_content(self, urllib_response: HTTPResponse):
-        while True:
-            chunk = urllib_response.read(urllib_response.length or 1)
-            if not chunk:
-                urllib_response.close()
-                break
-            yield chunk
+    async def _request(
+        self, path: str, headers: dict, exit_stack: AsyncExitStack, timings: RequestTimings
+    ) -> aiohttp.ClientResponse:
+        return await exit_stack.enter_async_context(
+            upstreams.request(get_session(), "GET", path, timings=timings, headers=headers)
+        )
+
+    def _iter_content(
+        self,
+        request: http.HttpRequest,
+        nextjs_response: aiohttp.ClientResponse,
+        exit_stack: AsyncExitStack,
+        timings: RequestTimings,
+    ):
+        error = None
+        try:
+            while chunk := background_loop.run_sync(nextjs_response.content.readany()):
+                yield chunk
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            background_loop.run_sync(exit_stack.aclose())
+            timings.finish(request, error)
+
+
+class NextJSStaticAssetsView(View):
+    """
+    Serves the static assets of Next.js (/_next/static/...) in production, when `assets_proxy` is enabled.
+    This is the WSGI counterpart of `NextJsStaticAssetsProxy`.
+    """
+
+    def get(self, request):
+        timings = RequestTimings("proxy", request.method, request.path)
+        try:
+            status, headers, content = background_loop.run_sync(
+                get_static_asset(
+                    None,
+                    request.path,
+                    accept_encoding=request.headers.get("Accept-Encoding", ""),
+                    if_none_match=request.headers.get("If-None-Match", ""),
+                    if_modified_since=request.headers.get("If-Modified-Since", ""),
+                    timings=timings,
+                )
+            )
+        except UPSTREAM_ERRORS as error:
+            timings.finish(request, error)
+            return http.HttpResponse(status=503, headers={"Retry-After": str(UPSTREAM_COOLDOWN)})
+        timings.status = status
+        timings.finish(request)
+        return http.HttpResponse(content, status=status, headers=headers)
@@ -1,124 +1,963 @@
-from http.cookies import Morsel
+import asyncio
+import functools
+import logging
+import operator
+import time
+import typing
+import uuid
+from contextlib import AsyncExitStack
+from http.cookies import CookieError, Morsel
 from typing import Optional
 from urllib.parse import quote
 
-import aiohttp
-from asgiref.sync import sync_to_async
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
 from django.conf import settings
 from django.core.handlers.asgi import ASGIRequest
 from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.http.request import HttpHeaders
 from django.middleware.csrf import get_token as get_csrf_token
 from django.template.loader import render_to_string
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_header_parameters
 from multidict import MultiMapping
 
-from .app_settings import ENSURE_CSRF_TOKEN, NEXTJS_SERVER_URL
-from .asgi import NextJsMiddleware
-from .utils import filter_mapping_obj
+from .app_settings import (
+    CACHE_VARY,
+    COALESCE_REQUESTS,
+    COMPRESS_RESPONSES,
+    EARLY_HINTS,
+    ENSURE_CSRF_TOKEN,
+    EXTRA_REQUEST_HEADERS,
+    EXTRA_RESPONSE_HEADERS,
+    SERVER_TIMING,
+    TRACE_HEADERS,
+    UNAVAILABLE_TEMPLATE,
+    UPSTREAM_COOLDOWN,
+)
+from .cache import (
+    CachedPage,
+    CachedShell,
+    get_cache_key,
+    get_cache_lifetime,
+    is_shareable,
+    page_cache,
+    shell_cache,
+    single_flight,
+    template_fragments_cache,
+)
+from .compression import compress, compress_stream, get_response_encoding
+from .early_hints import get_early_hints, learn_early_hints, learn_early_hints_from_stream
+from .instrumentation import RequestTimings
+from .session import background_loop, get_session
+from .streaming import iter_coalesced
+from .upstreams import UNAVAILABLE_STATUSES, UPSTREAM_ERRORS, upstreams
 
-morsel = Morsel()
+logger = logging.getLogger(__name__)
 
+# Returns the values (e.g. the language or whether the user is authenticated) the output of the template depends on.
+# It may be an async function, which is awaited in the event loop instead of being called in a thread.
+TemplateCacheKey = typing.Callable[[HttpRequest], typing.Union[typing.Hashable, typing.Awaitable[typing.Hashable]]]
 
-def _get_render_context(html: str, extra_context: Optional[dict] = None):
-    a = html.find("<head>")
-    b = html.find('</head><body id="__django_nextjs_body"', a)
-    c = html.find('<div id="__django_nextjs_body_begin"', b)
-    d = html.find('<div id="__django_nextjs_body_end"', c)
+Response = typing.TypeVar("Response", HttpResponse, StreamingHttpResponse)
+
+
+# These markers split the Next.js document into the sections passed to the template
+HEAD_MARKER = "<head>"
+BODY_MARKER = '</head><body id="__django_nextjs_body"'
+BODY_BEGIN_MARKER = '<div id="__django_nextjs_body_begin"'
+BODY_END_MARKER = '<div id="__django_nextjs_body_end"'
+MARKERS = (HEAD_MARKER, BODY_MARKER, BODY_BEGIN_MARKER, BODY_END_MARKER)
+ENCODED_MARKERS = tuple(marker.encode() for marker in MARKERS)
+SECTION_NAMES = ("section1", "section2", "section3", "section4", "section5")
+
+# Requests with these methods are sent to Next.js as GET requests without a body, and may use the page cache.
+# Requests with other methods (e.g. server actions and route handlers) are forwarded as they are.
+SAFE_METHODS = ("GET", "HEAD")
+
+# Size of the chunks of the request body which are read and sent to Next.js
+REQUEST_BODY_CHUNK_SIZE = 64 * 1024
+
+# Used instead of the fragments of a template, to cache the shell of a page streamed without a template
+EMPTY_TEMPLATE_FRAGMENTS = [b""] * (len(SECTION_NAMES) + 1)
+
+# Headers of the response of Next.js which aren't sent with the cached page or shell,
+# since they belong to the response they're cached from
+UNCACHED_HEADERS = ("Set-Cookie", "Date", "Connection", "Keep-Alive")
+
+
+def _get_meta_keys(header_names: typing.Iterable[str]) -> dict[str, str]:
+    """
+    Map the keys of the headers in `request.META` (e.g. HTTP_USER_AGENT) to their names.
+    """
+    return {HttpHeaders.to_wsgi_name(name): name for name in header_names}
+
+
+# Headers of the request forwarded to Next.js, by their key in `request.META`
+NEXTJS_REQUEST_HEADERS = _get_meta_keys(
+    [
+        # These headers are used by Next.js to indicate if a request is expecting a full HTML
+        # response, or an RSC response.
+        "Rsc",
+        "Next-Action",
+        "Next-Router-State-Tree",
+        "Next-Router-Prefetch",
+        "Next-Url",
+        "Cookie",
+        "Accept-Encoding",
+        # Tracing context (e.g. the W3C traceparent header or a request ID) to correlate the request in Next.js
+        *TRACE_HEADERS,
+        *EXTRA_REQUEST_HEADERS,
+    ]
+)
+# Headers of the requests with a body (e.g. server actions) which are forwarded too
+NEXTJS_BODY_REQUEST_HEADERS = {
+    **NEXTJS_REQUEST_HEADERS,
+    **_get_meta_keys(["Content-Type", "Accept", "Origin"]),
+}
+
+# Headers of the response of Next.js sent to the client
+NEXTJS_RESPONSE_HEADER_NAMES = [
+    "Location",
+    "Vary",
+    "Content-Type",
+    "Set-Cookie",
+    "Link",
+    "Cache-Control",
+    "Connection",
+    "Date",
+    "Keep-Alive",
+    # Headers of the responses to server actions and RSC requests
+    "X-Action-Revalidated",
+    "X-Action-Redirect",
+    "X-Nextjs-Rewritten-Path",
+    "X-Nextjs-Stale-Time",
+    *EXTRA_RESPONSE_HEADERS,
+]
+# The names of the headers by their name and by their lowercase name (in which Next.js sends most headers)
+NEXTJS_RESPONSE_HEADERS = {
+    **{name.lower(): name for name in NEXTJS_RESPONSE_HEADER_NAMES},
+    **{name: name for name in NEXTJS_RESPONSE_HEADER_NAMES},
+}
+# The values of the Set-Cookie headers of a response are joined with a newline, which can't be in a header,
+# so that they're kept separate. The values of other repeated headers are joined with a comma.
+SET_COOKIE_SEPARATOR = "\n"
+
+# Rendered pages larger than this are compressed in a thread instead of the event loop
+THREADED_COMPRESSION_MIN_BYTES = 64 * 1024
+
+# When streaming with a template, the head of the document is buffered until the body begins.
+# If the body doesn't begin within this size, the document is streamed without applying the template.
+MAX_STREAMED_HEAD_SIZE = 1024 * 1024
+
+
+def _split_document(document: typing.Union[str, bytes]) -> Optional[tuple]:
+    """
+    Split the Next.js document into the five sections passed to the template,
+    or return None if the document doesn't have the markers.
+
+    If the document is bytes, the sections are memoryviews of it, so the document is not copied.
+    """
+    head_marker, body_marker, body_begin_marker, body_end_marker = (
+        MARKERS if isinstance(document, str) else ENCODED_MARKERS
+    )
+    find = document.find
+    if not isinstance(document, str):
+        document = memoryview(document)
+
+    a = find(head_marker)
+    b = find(body_marker, a)
+    c = find(body_begin_marker, b)
+    d = find(body_end_marker, c)
 
     if any(i == -1 for i in (a, b, c, d)):
         return None
 
+    a += len(head_marker)
+    return document[:a], document[a:b], document[b:c], document[c:d], document[d:]
+
+
+def _get_render_context(html: str, extra_context: Optional[dict] = None):
+    sections = _split_document(html)
+    if sections is None:
+        return None
+
     return {
         **(extra_context or {}),
-        "django_nextjs__": {
-            "section1": html[: a + len("<head>")],
-            "section2": html[a + len("<head>") : b],
-            "section3": html[b:c],
-            "section4": html[c:d],
-            "section5": html[d:],
-        },
+        "django_nextjs__": dict(zip(SECTION_NAMES, sections)),
     }
 
 
-def _get_nextjs_request_cookies(request: HttpRequest):
+def _get_charset(headers: typing.Mapping[str, str]) -> str:
+    _, params = parse_header_parameters(headers.get("Content-Type", ""))
+    return params.get("charset", "utf-8")
+
+
+def _render_template_fragments(
+    template_name: str, context: Optional[dict], request: HttpRequest, using: Optional[str], charset: str = "utf-8"
+) -> Optional[list[bytes]]:
     """
-    Ensure we always send a CSRF cookie to Next.js server (if there is none in `request` object, generate one)
+    Render the template with placeholders instead of the sections of the Next.js document,
+    and return the six fragments of the output around the sections (encoded with `charset`).
+
+    Return None if the output doesn't contain each section exactly once and in order
+    (e.g. the template modifies a section), in which case the template can't be applied to a stream.
     """
-    unreserved_cookies = {k: v for k, v in request.COOKIES.items() if k and not morsel.isReservedKey(k)}
-    if ENSURE_CSRF_TOKEN is True and settings.CSRF_COOKIE_NAME not in unreserved_cookies:
-        unreserved_cookies[settings.CSRF_COOKIE_NAME] = get_csrf_token(request)
-    return unreserved_cookies
-
-
-def _get_nextjs_request_headers(request: HttpRequest, headers: Optional[dict] = None):
-    # These headers are used by Next.js to indicate if a request is expecting a full HTML
-    # response, or an RSC response.
-    server_component_headers = filter_mapping_obj(
-        request.headers,
-        selected_keys=[
-            "Rsc",
-            "Next-Router-State-Tree",
-            "Next-Router-Prefetch",
-            "Next-Url",
-            "Cookie",
-            "Accept-Encoding",
-        ],
+    placeholders = [f"__django_nextjs_{name}_{uuid.uuid4().hex}__" for name in SECTION_NAMES]
+    html = render_to_string(
+        template_name,
+        context={**(context or {}), "django_nextjs__": dict(zip(SECTION_NAMES, placeholders))},
+        request=request,
+        using=using,
     )
+    fragments = []
+    for placeholder in placeholders:
+        if html.count(placeholder) != 1:
+            return None
+        fragment, _, html = html.partition(placeholder)
+        fragments.append(fragment.encode(charset))
+    fragments.append(html.encode(charset))
+    return fragments
 
-    return {
-        "x-real-ip": request.headers.get("X-Real-Ip", "") or request.META.get("REMOTE_ADDR", ""),
-        "user-agent": request.headers.get("User-Agent", ""),
-        **server_component_headers,
-        **(headers or {}),
+
+def _get_context_key(context: Optional[dict]) -> Optional[tuple]:
+    """
+    Return a hashable key of the context of the template,
+    or None if some of its values can't be hashed (e.g. lists), in which case the output isn't cached.
+    """
+    key = tuple(sorted((context or {}).items(), key=operator.itemgetter(0)))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _get_template_fragments_sync(
+    template_name: str,
+    context: Optional[dict],
+    request: HttpRequest,
+    using: Optional[str],
+    charset: str = "utf-8",
+    template_cache_key: Optional[TemplateCacheKey] = None,
+) -> Optional[list[bytes]]:
+    """
+    Return the fragments of the template (see `_render_template_fragments`).
+
+    If `template_cache_key` is provided, the fragments are rendered once for each value it returns (and each context)
+    and then reused, which avoids rendering the template on each request.
+    """
+    context_key = _get_context_key(context)
+    if template_cache_key is None or context_key is None:
+        return _render_template_fragments(template_name, context, request, using, charset)
+
+    if iscoroutinefunction(template_cache_key):
+        template_key = async_to_sync(template_cache_key)(request)
+    else:
+        template_key = template_cache_key(request)
+    return _get_cached_template_fragments(
+        (template_name, using, charset, context_key, template_key), template_name, context, request, using, charset
+    )
+
+
+def _get_cached_template_fragments(
+    key: tuple,
+    template_name: str,
+    context: Optional[dict],
+    request: HttpRequest,
+    using: Optional[str],
+    charset: str,
+) -> Optional[list[bytes]]:
+    fragments = template_fragments_cache.get(key)
+    if fragments is None:
+        # An empty tuple is cached for templates which can't be split, so that they aren't tried again.
+        fragments = _render_template_fragments(template_name, context, request, using, charset) or ()
+        template_fragments_cache.set(key, fragments)
+    return list(fragments) or None
+
+
+async def _get_template_fragments(
+    template_name: str,
+    context: Optional[dict],
+    request: HttpRequest,
+    using: Optional[str],
+    charset: str = "utf-8",
+    template_cache_key: Optional[TemplateCacheKey] = None,
+) -> Optional[list[bytes]]:
+    """
+    Asynchronous version of `_get_template_fragments_sync`.
+
+    A sync `template_cache_key` is called in the thread which renders the template (see `_run_request_code`).
+    With an async one, cached fragments are returned without switching to a thread.
+    """
+    if (
+        template_cache_key is not None
+        and iscoroutinefunction(template_cache_key)
+        and (context_key := _get_context_key(context)) is not None
+    ):
+        key = (template_name, using, charset, context_key, await template_cache_key(request))
+        fragments = template_fragments_cache.get(key)
+        if fragments is not None:
+            return list(fragments) or None
+        return await sync_to_async(_get_cached_template_fragments)(key, template_name, context, request, using, charset)
+    return await sync_to_async(_get_template_fragments_sync)(
+        template_name, context, request, using, charset, template_cache_key
+    )
+
+
+def _join_template_fragments(fragments: list[bytes], sections: tuple) -> bytes:
+    parts = [fragments[0]]
+    for section, fragment in zip(sections, fragments[1:]):
+        parts += (section, fragment)
+    return b"".join(parts)
+
+
+async def _read_nextjs_head(chunks: typing.AsyncIterator[bytes]) -> tuple[bytearray, Optional[tuple[int, int, int]]]:
+    """
+    Buffer the head of the streamed Next.js document (sections 1 to 3) until the body begins.
+    Return the buffered data and the ends of sections 1 to 3 in it, or None if the document doesn't have the markers.
+    """
+    head_marker, body_marker, body_begin_marker, _ = ENCODED_MARKERS
+    buffer = bytearray()
+
+    c = -1
+    async for chunk in chunks:
+        # Only search the new data (and the end of the old data, in case the marker is split between chunks)
+        start = max(len(buffer) - len(body_begin_marker) + 1, 0)
+        buffer += chunk
+        c = buffer.find(body_begin_marker, start)
+        if c != -1 or len(buffer) > MAX_STREAMED_HEAD_SIZE:
+            break
+    a = buffer.find(head_marker, 0, max(c, 0))
+    b = buffer.find(body_marker, a, max(c, 0))
+
+    if -1 in (a, b, c):
+        return buffer, None
+    return buffer, (a + len(head_marker), b, c)
+
+
+async def _compose_nextjs_stream(
+    chunks: typing.AsyncIterator[bytes],
+    fragments: list[bytes],
+    on_shell: Optional[typing.Callable[[bytes, bytes], None]] = None,
+) -> typing.AsyncIterator[bytes]:
+    """
+    Insert the template fragments between the sections of the Next.js document while it's being streamed.
+
+    The head of the document (sections 1 to 3) is buffered until the body begins.
+    After that, the body is passed through as it arrives.
+    If the document doesn't have the markers, it's streamed unchanged.
+
+    `on_shell` is called with the head of the document and the output until the body begins (the shell).
+    """
+    buffer, head = await _read_nextjs_head(chunks)
+    if head is None:
+        if buffer:
+            yield bytes(buffer)
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    a, b, c = head
+    shell = _join_template_fragments(fragments[:4], (buffer[:a], buffer[a:b], buffer[b:c]))
+    if on_shell is not None:
+        on_shell(bytes(buffer[:c]), shell)
+    yield shell
+    del buffer[:c]
+    async for chunk in _compose_nextjs_body(buffer, chunks, fragments):
+        yield chunk
+
+
+async def _compose_nextjs_body(
+    buffer: bytearray, chunks: typing.AsyncIterator[bytes], fragments: list[bytes]
+) -> typing.AsyncIterator[bytes]:
+    """
+    Stream the body of the Next.js document (sections 4 and 5), starting with the buffered data,
+    and insert the last template fragments.
+    """
+    body_end_marker = ENCODED_MARKERS[3]
+    # Pass the body through, but keep enough data to find the end marker if it's split between chunks.
+    keep = len(body_end_marker) - 1
+    body_ended = False
+    while True:
+        if not body_ended and (d := buffer.find(body_end_marker)) != -1:
+            yield bytes(buffer[:d]) + fragments[4]
+            del buffer[:d]
+            body_ended = True
+        if body_ended:
+            if buffer:
+                yield bytes(buffer)
+                buffer.clear()
+        elif len(buffer) > keep:
+            yield bytes(buffer[:-keep])
+            del buffer[:-keep]
+        chunk = await anext(chunks, None)
+        if chunk is None:
+            break
+        buffer += chunk
+
+    if not body_ended:
+        yield bytes(buffer) + fragments[4]
+    yield fragments[5]
+
+
+async def _splice_nextjs_body(
+    chunks: typing.AsyncIterator[bytes],
+    fragments: list[bytes],
+    shell: CachedShell,
+    shell_key: Optional[tuple],
+    on_head: Optional[typing.Callable[[bytes], None]] = None,
+) -> typing.AsyncIterator[bytes]:
+    """
+    Stream the body of the Next.js document after a cached shell has been sent, instead of its head.
+    If the head of the document has changed (e.g. after a deployment), the shell is replaced for the next requests
+    (unless `shell_key` is None), and `on_head` is called with the new head.
+    """
+    buffer, head = await _read_nextjs_head(chunks)
+    if head is None:
+        logger.warning("The Next.js document doesn't match its cached shell, which is dropped.")
+        shell_cache.delete(shell_key)
+        yield fragments[4] + fragments[5]
+        return
+
+    a, b, c = head
+    if shell_key is not None and buffer[:c] != shell.head:
+        content = _join_template_fragments(fragments[:4], (buffer[:a], buffer[a:b], buffer[b:c]))
+        shell_cache.set(shell_key, shell._replace(content=content, head=bytes(buffer[:c])))
+        if on_head is not None:
+            on_head(bytes(buffer[:c]))
+    del buffer[:c]
+    async for chunk in _compose_nextjs_body(buffer, chunks, fragments):
+        yield chunk
+
+
+def _get_nextjs_request_cookies(request: HttpRequest) -> dict[str, str]:
+    """
+    Ensure we always send a CSRF cookie to Next.js server (if there is none in `request` object, generate one)
+
+    The cookies of the request are sent in its Cookie header, so only the generated cookie is returned.
+    """
+    if ENSURE_CSRF_TOKEN is True and settings.CSRF_COOKIE_NAME not in request.COOKIES:
+        return {settings.CSRF_COOKIE_NAME: get_csrf_token(request)}
+    return {}
+
+
+def _get_nextjs_request_headers(request: HttpRequest, headers: Optional[dict] = None) -> dict[str, str]:
+    meta = request.META
+    nextjs_headers = {
+        "x-real-ip": meta.get("HTTP_X_REAL_IP", "") or meta.get("REMOTE_ADDR", ""),
+        "user-agent": meta.get("HTTP_USER_AGENT", ""),
     }
+    # `request.headers` isn't used, since it copies all the headers of the request the first time it's accessed.
+    forwarded_headers = NEXTJS_REQUEST_HEADERS if request.method in SAFE_METHODS else NEXTJS_BODY_REQUEST_HEADERS
+    for key, name in forwarded_headers.items():
+        if key in meta:
+            nextjs_headers[name] = meta[key]
+    if request.method not in SAFE_METHODS:
+        # Next.js compares the origin of server actions with the forwarded host.
+        nextjs_headers["x-forwarded-host"] = request.get_host()
+    if headers:
+        nextjs_headers.update(headers)
+    return nextjs_headers
+
+
+def _get_nextjs_request_method(request: HttpRequest) -> str:
+    # HEAD requests are sent as GET requests, so that their responses can be cached and shared with GET requests.
+    return "GET" if request.method in SAFE_METHODS else request.method
+
+
+def _get_nextjs_request_body(request: HttpRequest) -> Optional[typing.Union[bytes, typing.AsyncIterator[bytes]]]:
+    """
+    Return the body of the request to Next.js.
+
+    The body is streamed from the request in chunks, unless it has already been read
+    (e.g. by accessing `request.body`), in which case it's sent from memory.
+    """
+    if request.method in SAFE_METHODS:
+        return None
+    if getattr(request, "_read_started", False):
+        # Raises RawPostDataException if the body has been consumed by parsing `request.POST`.
+        return request.body
+    return _iter_request_body(request)
 
 
-def _get_nextjs_response_headers(headers: MultiMapping[str]) -> dict:
-    return filter_mapping_obj(
-        headers,
-        selected_keys=[
-            "Location",
-            "Vary",
-            "Content-Type",
-            "Set-Cookie",
-            "Link",
-            "Cache-Control",
-            "Connection",
-            "Date",
-            "Keep-Alive",
-        ],
+async def _iter_request_body(request: HttpRequest) -> typing.AsyncIterator[bytes]:
+    # The request body may be in a file or the input stream of a WSGI server, so it's read in a thread.
+    loop = asyncio.get_running_loop()
+    while chunk := await loop.run_in_executor(None, request.read, REQUEST_BODY_CHUNK_SIZE):
+        yield chunk
+
+
+def _get_nextjs_response_headers(headers: MultiMapping[str]) -> dict[str, str]:
+    response_headers = {}
+    for name, value in headers.items():
+        name = NEXTJS_RESPONSE_HEADERS.get(name) or NEXTJS_RESPONSE_HEADERS.get(name.lower())
+        if name is None:
+            continue
+        if name in response_headers:
+            separator = SET_COOKIE_SEPARATOR if name == "Set-Cookie" else ", "
+            value = response_headers[name] + separator + value
+        response_headers[name] = value
+    return response_headers
+
+
+class NextJsCookie(Morsel):
+    """
+    A cookie set by Next.js, which is sent to the client with its Set-Cookie header unchanged
+    (unless it's set again with `response.set_cookie`).
+    """
+
+    def __init__(self, header: str):
+        super().__init__()
+        name, _, value = header.partition(";")[0].partition("=")
+        try:
+            self.set(name.strip(), value.strip(), value.strip())
+        except CookieError:
+            # The header is still sent, even though Python can't parse its name.
+            pass
+        self.header = header
+
+    def set(self, key, val, coded_val):
+        super().set(key, val, coded_val)
+        self.header = None
+
+    def OutputString(self, attrs=None):
+        return self.header if self.header is not None else super().OutputString(attrs)
+
+    def __getstate__(self):
+        return {**super().__getstate__(), "header": self.header}
+
+    def __setstate__(self, state):
+        self.header = state.pop("header")
+        super().__setstate__(state)
+
+
+def _get_response(response_class: type[Response], content, status: int, headers: dict[str, str]) -> Response:
+    """
+    Return a response with the headers of a Next.js response, keeping each of the cookies it sets.
+    """
+    set_cookie = headers.get("Set-Cookie")
+    if set_cookie is None:
+        return response_class(content, status=status, headers=headers)
+
+    response = response_class(
+        content, status=status, headers={name: value for name, value in headers.items() if name != "Set-Cookie"}
     )
+    for header in set_cookie.split(SET_COOKIE_SEPARATOR):
+        cookie = NextJsCookie(header)
+        # Cookies with the same name (e.g. for different paths) are all sent.
+        key = cookie.key if cookie.key and cookie.key not in response.cookies else header
+        response.cookies[key] = cookie
+    return response
 
 
-async def _render_nextjs_page_to_string(
+async def _render_nextjs_page_content(
     request: HttpRequest,
     template_name: str = "",
     context: Optional[dict] = None,
     using: Optional[str] = None,
     allow_redirects: bool = False,
     headers: Optional[dict] = None,
-) -> tuple[str, int, dict[str, str]]:
+    template_cache_key: Optional[TemplateCacheKey] = None,
+    stale_while_revalidate: Optional[int] = None,
+) -> tuple[bytes, int, dict[str, str]]:
+    timings = RequestTimings("render", request.method, request.path)
+    try:
+        content, status, response_headers = await _get_nextjs_page(
+            request, allow_redirects, headers, timings, stale_while_revalidate
+        )
+        if _should_learn_early_hints(request, timings):
+            learn_early_hints(request.path, status, response_headers, content)
+
+        # Apply template rendering (HTML customization) if template_name is provided
+        if template_name:
+            template_start = time.perf_counter()
+            content = await _apply_template(
+                content, _get_charset(response_headers), request, template_name, context, using, template_cache_key
+            )
+            timings.template_render = time.perf_counter() - template_start
+    except Exception as error:
+        timings.finish(request, error)
+        raise
+
+    return content, status, _finish_render(request, timings, status, response_headers)
+
+
+def _render_nextjs_page_content_sync(
+    request: HttpRequest,
+    template_name: str = "",
+    context: Optional[dict] = None,
+    using: Optional[str] = None,
+    allow_redirects: bool = False,
+    headers: Optional[dict] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+    stale_while_revalidate: Optional[int] = None,
+) -> tuple[bytes, int, dict[str, str]]:
+    """
+    Synchronous version of `_render_nextjs_page_content`.
+    """
+    timings = RequestTimings("render", request.method, request.path)
+    try:
+        content, status, response_headers = _get_nextjs_page_sync(
+            request, allow_redirects, headers, timings, stale_while_revalidate
+        )
+        if _should_learn_early_hints(request, timings):
+            learn_early_hints(request.path, status, response_headers, content)
+
+        if template_name:
+            template_start = time.perf_counter()
+            content = _apply_template_sync(
+                content, _get_charset(response_headers), request, template_name, context, using, template_cache_key
+            )
+            timings.template_render = time.perf_counter() - template_start
+    except Exception as error:
+        timings.finish(request, error)
+        raise
+
+    return content, status, _finish_render(request, timings, status, response_headers)
+
+
+def _should_learn_early_hints(request: HttpRequest, timings: RequestTimings) -> bool:
+    """
+    Return whether the early hints of the page are learned from its document: when it comes from Next.js,
+    or when they aren't known (e.g. they have been evicted), since the head of a cached page doesn't change.
+    """
+    return (
+        EARLY_HINTS
+        and request.method in SAFE_METHODS
+        and (timings.cache not in ("hit", "stale") or get_early_hints(request.path) is None)
+    )
+
+
+def _finish_render(
+    request: HttpRequest, timings: RequestTimings, status: int, response_headers: dict[str, str]
+) -> dict[str, str]:
+    timings.status = status
+    timings.finish(request)
+    if SERVER_TIMING:
+        # The headers may be shared with the cache, so they are copied.
+        response_headers = {**response_headers, "Server-Timing": timings.server_timing()}
+    return response_headers
+
+
+def _render_template(
+    sections: tuple,
+    charset: str,
+    request: HttpRequest,
+    template_name: str,
+    context: Optional[dict],
+    using: Optional[str],
+) -> bytes:
+    render_context = {
+        **(context or {}),
+        "django_nextjs__": {name: str(section, charset) for name, section in zip(SECTION_NAMES, sections)},
+    }
+    return render_to_string(template_name, context=render_context, request=request, using=using).encode(charset)
+
+
+async def _apply_template(
+    content: bytes,
+    charset: str,
+    request: HttpRequest,
+    template_name: str,
+    context: Optional[dict] = None,
+    using: Optional[str] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+) -> bytes:
+    """
+    Apply the template to the Next.js document without decoding it, if the fragments of the template are cached.
+    Otherwise, the sections are decoded and the template is rendered.
+    """
+    sections = _split_document(content)
+    if sections is None:
+        return content
+
+    if template_cache_key and (
+        fragments := await _get_template_fragments(template_name, context, request, using, charset, template_cache_key)
+    ):
+        return _join_template_fragments(fragments, sections)
+    return await sync_to_async(_render_template)(sections, charset, request, template_name, context, using)
+
+
+def _apply_template_sync(
+    content: bytes,
+    charset: str,
+    request: HttpRequest,
+    template_name: str,
+    context: Optional[dict] = None,
+    using: Optional[str] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+) -> bytes:
+    """
+    Synchronous version of `_apply_template`.
+    """
+    sections = _split_document(content)
+    if sections is None:
+        return content
+
+    if template_cache_key and (
+        fragments := _get_template_fragments_sync(template_name, context, request, using, charset, template_cache_key)
+    ):
+        return _join_template_fragments(fragments, sections)
+    return _render_template(sections, charset, request, template_name, context, using)
+
+
+async def _get_nextjs_page(
+    request: HttpRequest,
+    allow_redirects: bool = False,
+    headers: Optional[dict] = None,
+    timings: Optional[RequestTimings] = None,
+    stale_while_revalidate: Optional[int] = None,
+) -> tuple[bytes, int, dict[str, str]]:
+    """
+    Get the HTML of the page from the cache or the Next.js server.
+    """
+    load = await _run_request_code(
+        _prepare_nextjs_page, request, allow_redirects, headers, timings, stale_while_revalidate
+    )
+    if isinstance(request, ASGIRequest):
+        return await load()
+    # Under WSGI, the view runs in a short-lived event loop (see `BackgroundLoop`).
+    return await background_loop.run(load())
+
+
+async def _run_request_code(function: typing.Callable, *args):
+    """
+    Call a function which reads the request from async code.
+
+    It runs in a thread if it may call `cache_vary`, which may use lazy attributes of the request
+    (e.g. `request.user`) that query the database and can't be used in an event loop.
+    """
+    if CACHE_VARY:
+        return await sync_to_async(function)(*args)
+    return function(*args)
+
+
+def _get_nextjs_page_sync(
+    request: HttpRequest,
+    allow_redirects: bool = False,
+    headers: Optional[dict] = None,
+    timings: Optional[RequestTimings] = None,
+    stale_while_revalidate: Optional[int] = None,
+) -> tuple[bytes, int, dict[str, str]]:
+    """
+    Synchronous version of `_get_nextjs_page`, which loads the page in the process-wide background loop.
+    """
+    load = _prepare_nextjs_page(request, allow_redirects, headers, timings, stale_while_revalidate)
+    return background_loop.run_sync(load())
+
+
+def _prepare_nextjs_page(
+    request: HttpRequest,
+    allow_redirects: bool = False,
+    headers: Optional[dict] = None,
+    timings: Optional[RequestTimings] = None,
+    stale_while_revalidate: Optional[int] = None,
+) -> typing.Callable[[], typing.Awaitable[tuple[bytes, int, dict[str, str]]]]:
+    """
+    Read everything needed from the request (in the thread of the request)
+    and return a function which loads the page from the cache or the Next.js server.
+    """
+    cache_key, coalesce, fetch = _prepare_nextjs_fetch(request, allow_redirects, headers)
+    return functools.partial(_load_nextjs_page, cache_key, coalesce, fetch, timings, stale_while_revalidate)
+
+
+def _prepare_nextjs_fetch(
+    request: HttpRequest, allow_redirects: bool = False, headers: Optional[dict] = None
+) -> tuple[Optional[str], bool, typing.Callable[..., typing.Awaitable[tuple[bytes, int, dict[str, str]]]]]:
+    """
+    Return the cache key of the page (or None if it isn't cacheable), whether its request may be coalesced,
+    and a function which fetches it from the Next.js server.
+    """
+    cookies = _get_nextjs_request_cookies(request)
+    # The responses of requests with other methods (e.g. server actions) are never cached or shared.
+    cacheable = request.method in SAFE_METHODS
+    coalesce = COALESCE_REQUESTS and cacheable and is_shareable(request)
+    cache_key = get_cache_key(request, allow_redirects, headers) if cacheable and (page_cache or coalesce) else None
+
     page_path = quote(request.path_info.lstrip("/"))
     params = [(k, v) for k in request.GET.keys() for v in request.GET.getlist(k)]
 
+    request_headers = _get_nextjs_request_headers(request, headers)
+    if COMPRESS_RESPONSES:
+        # The response is compressed after the template is applied, so Next.js doesn't need to compress it.
+        request_headers["Accept-Encoding"] = "identity"
+
     # Get HTML from Next.js server
-    async with aiohttp.ClientSession(
-        cookies=_get_nextjs_request_cookies(request),
-        headers=_get_nextjs_request_headers(request, headers),
-    ) as session:
-        async with session.get(
-            f"{NEXTJS_SERVER_URL}/{page_path}", params=params, allow_redirects=allow_redirects
-        ) as response:
-            html = await response.text()
-            response_headers = _get_nextjs_response_headers(response.headers)
-
-    # Apply template rendering (HTML customization) if template_name is provided
-    if template_name:
-        render_context = _get_render_context(html, context)
-        if render_context is not None:
-            html = await sync_to_async(render_to_string)(
-                template_name, context=render_context, request=request, using=using
-            )
-    return html, response.status, response_headers
+    fetch = functools.partial(
+        _fetch_nextjs_page,
+        getattr(request, "scope", None),
+        _get_nextjs_request_method(request),
+        f"/{page_path}",
+        params=params,
+        data=_get_nextjs_request_body(request),
+        allow_redirects=allow_redirects,
+        cookies=cookies,
+        headers=request_headers,
+    )
+    return cache_key, coalesce, fetch
+
+
+async def _load_nextjs_page(
+    cache_key: Optional[str],
+    coalesce: bool,
+    fetch: typing.Callable[..., typing.Awaitable[tuple[bytes, int, dict[str, str]]]],
+    timings: Optional[RequestTimings] = None,
+    stale_while_revalidate: Optional[int] = None,
+) -> tuple[bytes, int, dict[str, str]]:
+    """
+    Load the page from the cache or the Next.js server.
+    A stale cached page is returned immediately and refreshed in the background.
+    """
+    cached_page = None
+    if cache_key and page_cache:
+        if (cached_page := await page_cache.get(cache_key)) and cached_page.is_fresh():
+            if timings is not None:
+                timings.cache = "hit"
+            return cached_page.content, cached_page.status, cached_page.headers
+        if timings is not None:
+            timings.cache = "miss"
+
+    if cached_page is not None and time.time() < cached_page.stale_until:
+        if timings is not None:
+            timings.cache = "stale"
+        single_flight.start(
+            f"refresh:{cache_key}",
+            functools.partial(_refresh_nextjs_page, cache_key, fetch, stale_while_revalidate),
+        )
+        return cached_page.content, cached_page.status, cached_page.headers
+
+    fetch = functools.partial(fetch, timings=timings)
+    if coalesce and cache_key:
+        # Concurrent identical requests share a single request to Next.js
+        fetch = functools.partial(_fetch_coalesced_nextjs_page, cache_key, fetch)
+    try:
+        content, status, response_headers = await fetch()
+    except UPSTREAM_ERRORS:
+        if cached_page is None:
+            raise
+        status = None
+
+    if cached_page is not None and (status is None or status in UNAVAILABLE_STATUSES):
+        # The Next.js server is unavailable, so the stale page is served instead of an error.
+        if timings is not None:
+            timings.cache = "stale"
+        return cached_page.content, cached_page.status, cached_page.headers
+
+    if cache_key and page_cache:
+        await _store_nextjs_page(cache_key, content, status, response_headers, stale_while_revalidate)
+    return content, status, response_headers
+
+
+async def _fetch_coalesced_nextjs_page(
+    cache_key: str, fetch: typing.Callable[[], typing.Awaitable[tuple[bytes, int, dict[str, str]]]]
+) -> tuple[bytes, int, dict[str, str]]:
+    sent = False
+
+    async def send():
+        nonlocal sent
+        sent = True
+        return await fetch()
+
+    content, status, headers = await single_flight.run(cache_key, send)
+    if "Set-Cookie" in headers and not sent:
+        # The cookies set by Next.js may be specific to the visitor (e.g. an A/B test bucket),
+        # so a response which sets cookies isn't shared with the other requests; they're sent on their own.
+        return await fetch()
+    return content, status, headers
+
+
+async def _store_nextjs_page(
+    cache_key: str,
+    content: bytes,
+    status: int,
+    headers: dict[str, str],
+    stale_while_revalidate: Optional[int] = None,
+) -> bool:
+    """
+    Store the page in the cache if its response is cacheable, and return whether it's stored.
+    """
+    if lifetime := get_cache_lifetime(status, headers):
+        max_age, upstream_stale_while_revalidate = lifetime
+        if stale_while_revalidate is None:
+            stale_while_revalidate = upstream_stale_while_revalidate
+        expires = time.time() + max_age
+        headers = {name: value for name, value in headers.items() if name not in UNCACHED_HEADERS}
+        await page_cache.set(cache_key, CachedPage(content, status, headers, expires, expires + stale_while_revalidate))
+        return True
+    return False
+
+
+async def _refresh_nextjs_page(
+    cache_key: str,
+    fetch: typing.Callable[[], typing.Awaitable],
+    stale_while_revalidate: Optional[int],
+) -> None:
+    try:
+        content, status, headers = await fetch()
+    except UPSTREAM_ERRORS as error:
+        logger.warning("Failed to refresh the cached Next.js page: %r", error)
+        return
+    if status not in UNAVAILABLE_STATUSES:
+        await _store_nextjs_page(cache_key, content, status, headers, stale_while_revalidate)
+
+
+async def _fetch_nextjs_page(
+    scope: Optional[dict], method: str, path: str, timings: Optional[RequestTimings] = None, **kwargs
+) -> tuple[bytes, int, dict[str, str]]:
+    async with upstreams.request(get_session(scope), method, path, timings=timings, **kwargs) as response:
+        return await response.read(), response.status, _get_nextjs_response_headers(response.headers)
+
+
+def _get_unavailable_response(request: HttpRequest, error: Exception) -> HttpResponse:
+    """
+    Return the response of a page when the Next.js server is unavailable.
+    """
+    logger.warning("Next.js server is unavailable: %r", error)
+    headers = {"Retry-After": str(UPSTREAM_COOLDOWN)}
+    if UNAVAILABLE_TEMPLATE:
+        return HttpResponse(render_to_string(UNAVAILABLE_TEMPLATE, request=request), status=503, headers=headers)
+    return HttpResponse("Service Unavailable", status=503, content_type="text/plain", headers=headers)
+
+
+def _get_content_encoding(request: HttpRequest, response: HttpResponse) -> Optional[str]:
+    """
+    Return the best encoding the client accepts to compress the content of the response with
+    (if `compress_responses` is set), or None if it isn't compressed.
+    """
+    if not COMPRESS_RESPONSES or response.has_header("Content-Encoding"):
+        return None
+    encoding = get_response_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""), response.get("Content-Type", ""))
+    if encoding is not None:
+        patch_vary_headers(response, ("Accept-Encoding",))
+    return encoding
+
+
+def _set_compressed_content(response: HttpResponse, content: Optional[bytes], encoding: str) -> HttpResponse:
+    if content is not None and len(content) < len(response.content):
+        response.content = content
+        response["Content-Encoding"] = encoding
+    return response
+
+
+async def _compress_response(request: HttpRequest, response: HttpResponse) -> HttpResponse:
+    """
+    Compress the content of the response with the best encoding the client accepts (if `compress_responses` is set).
+    Large responses are compressed in a thread, so that they don't block the event loop.
+    """
+    if (encoding := _get_content_encoding(request, response)) is None:
+        return response
+    if len(response.content) < THREADED_COMPRESSION_MIN_BYTES:
+        return _set_compressed_content(response, compress(response.content, encoding), encoding)
+    return _set_compressed_content(response, await asyncio.to_thread(compress, response.content, encoding), encoding)
+
+
+def _compress_response_sync(request: HttpRequest, response: HttpResponse) -> HttpResponse:
+    """
+    Synchronous version of `_compress_response`.
+    """
+    if (encoding := _get_content_encoding(request, response)) is None:
+        return response
+    return _set_compressed_content(response, compress(response.content, encoding), encoding)
 
 
 async def render_nextjs_page_to_string(
@@ -128,16 +967,20 @@ async def render_nextjs_page_to_string(
     using: Optional[str] = None,
     allow_redirects: bool = False,
     headers: Optional[dict] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+    stale_while_revalidate: Optional[int] = None,
 ):
-    html, _, _ = await _render_nextjs_page_to_string(
+    content, _, response_headers = await _render_nextjs_page_content(
         request,
         template_name,
         context,
         using=using,
         allow_redirects=allow_redirects,
         headers=headers,
+        template_cache_key=template_cache_key,
+        stale_while_revalidate=stale_while_revalidate,
     )
-    return html
+    return content.decode(_get_charset(response_headers))
 
 
 async def render_nextjs_page(
@@ -147,64 +990,324 @@ async def render_nextjs_page(
     using: Optional[str] = None,
     allow_redirects: bool = False,
     headers: Optional[dict] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+    stale_while_revalidate: Optional[int] = None,
+):
+    try:
+        content, status, response_headers = await _render_nextjs_page_content(
+            request,
+            template_name,
+            context,
+            using=using,
+            allow_redirects=allow_redirects,
+            headers=headers,
+            template_cache_key=template_cache_key,
+            stale_while_revalidate=stale_while_revalidate,
+        )
+    except UPSTREAM_ERRORS as error:
+        return await sync_to_async(_get_unavailable_response)(request, error)
+    return await _compress_response(request, _get_response(HttpResponse, content, status, response_headers))
+
+
+def render_nextjs_page_to_string_sync(
+    request: HttpRequest,
+    template_name: str = "",
+    context: Optional[dict] = None,
+    using: Optional[str] = None,
+    allow_redirects: bool = False,
+    headers: Optional[dict] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+    stale_while_revalidate: Optional[int] = None,
 ):
-    content, status, response_headers = await _render_nextjs_page_to_string(
+    """
+    Synchronous version of `render_nextjs_page_to_string` for WSGI deployments.
+    """
+    content, _, response_headers = _render_nextjs_page_content_sync(
         request,
         template_name,
         context,
         using=using,
         allow_redirects=allow_redirects,
         headers=headers,
+        template_cache_key=template_cache_key,
+        stale_while_revalidate=stale_while_revalidate,
     )
-    return HttpResponse(content=content, status=status, headers=response_headers)
+    return content.decode(_get_charset(response_headers))
+
+
+def render_nextjs_page_sync(
+    request: HttpRequest,
+    template_name: str = "",
+    context: Optional[dict] = None,
+    using: Optional[str] = None,
+    allow_redirects: bool = False,
+    headers: Optional[dict] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+    stale_while_revalidate: Optional[int] = None,
+):
+    """
+    Synchronous version of `render_nextjs_page` for WSGI deployments.
+    """
+    try:
+        content, status, response_headers = _render_nextjs_page_content_sync(
+            request,
+            template_name,
+            context,
+            using=using,
+            allow_redirects=allow_redirects,
+            headers=headers,
+            template_cache_key=template_cache_key,
+            stale_while_revalidate=stale_while_revalidate,
+        )
+    except UPSTREAM_ERRORS as error:
+        return _get_unavailable_response(request, error)
+    return _compress_response_sync(request, _get_response(HttpResponse, content, status, response_headers))
 
 
 async def stream_nextjs_page(
     request: ASGIRequest,
+    template_name: str = "",
+    context: Optional[dict] = None,
+    using: Optional[str] = None,
     allow_redirects: bool = False,
     headers: Optional[dict] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+    cache_shell: bool = False,
 ):
     """
     Stream a Next.js page response.
     This function is used to stream the response from a Next.js server.
+
+    The method and the body of the request are forwarded, so server actions and route handlers can be streamed too.
+
+    If `template_name` is provided, the template is applied to the document while it's being streamed.
+
+    If `cache_shell` is True, the beginning of the page until the body of the Next.js document (the shell)
+    is cached for each path, and sent at once on the following requests while the page is rendered by Next.js.
     """
     page_path = quote(request.path_info.lstrip("/"))
     params = [(k, v) for k in request.GET.keys() for v in request.GET.getlist(k)]
-    next_url = f"{NEXTJS_SERVER_URL}/{page_path}"
 
-    if session := request.scope.get("state", {}).get(NextJsMiddleware.HTTP_SESSION_KEY):
-        session_is_temporary = False
-    else:
-        # If the shared session is not available, we create a temporary session.
-        # This is typically the case when the ASGI server does not support the lifespan protocol (e.g. Daphne).
-        session = aiohttp.ClientSession()
-        session_is_temporary = True
+    timings = RequestTimings("stream", request.method, request.path)
 
-    try:
-        nextjs_response = await session.get(
-            next_url,
-            params=params,
-            allow_redirects=allow_redirects,
-            cookies=_get_nextjs_request_cookies(request),
-            headers=_get_nextjs_request_headers(request, headers),
+    shell_key = None
+    if cache_shell and request.method == "GET" and "HTTP_RSC" not in request.META:
+        shell_key = await _get_shell_cache_key(request, template_name, context, using, headers, template_cache_key)
+
+    request_headers = _get_nextjs_request_headers(request, headers)
+    # Without a template, the response of Next.js is passed through, compressed or not.
+    pass_through_encoding = COMPRESS_RESPONSES and not template_name and shell_key is None
+    if pass_through_encoding:
+        # Otherwise, aiohttp would accept its default encodings on behalf of the client.
+        request_headers["Accept-Encoding"] = request.META.get("HTTP_ACCEPT_ENCODING") or "identity"
+    elif COMPRESS_RESPONSES:
+        # The template is applied to the decoded document, which is compressed afterwards.
+        request_headers["Accept-Encoding"] = "identity"
+
+    send_request = functools.partial(
+        upstreams.request,
+        get_session(request.scope),
+        _get_nextjs_request_method(request),
+        f"/{page_path}",
+        timings=timings,
+        params=params,
+        data=_get_nextjs_request_body(request),
+        allow_redirects=allow_redirects,
+        cookies=_get_nextjs_request_cookies(request),
+        headers=request_headers,
+        auto_decompress=not pass_through_encoding,
+    )
+    learn_hints = EARLY_HINTS and request.method in SAFE_METHODS
+
+    if shell_key is not None and (shell := shell_cache.get(shell_key)) is not None:
+        return _stream_nextjs_page_with_shell(
+            request, send_request, shell, shell_key, template_name, context, using, template_cache_key, timings
         )
+
+    # The upstream request is released when the stream is exhausted or closed.
+    exit_stack = AsyncExitStack()
+    try:
+        nextjs_response = await exit_stack.enter_async_context(send_request())
         response_headers = _get_nextjs_response_headers(nextjs_response.headers)
+        charset = _get_charset(response_headers)
+
+        encoding = None
+        if pass_through_encoding and "Content-Encoding" in nextjs_response.headers:
+            response_headers["Content-Encoding"] = nextjs_response.headers["Content-Encoding"]
+        elif COMPRESS_RESPONSES and nextjs_response.status not in (204, 304):
+            encoding = get_response_encoding(
+                request.META.get("HTTP_ACCEPT_ENCODING", ""), response_headers.get("Content-Type", "")
+            )
+
+        # The template is only applied to HTML documents, so other responses (e.g. the RSC payloads
+        # of client-side navigations) are passed through as they're received.
+        content_type = response_headers.get("Content-Type", "")
+        is_document = content_type.startswith("text/html") and "HTTP_RSC" not in request.META
+        fragments = None
+        if template_name and is_document:
+            template_start = time.perf_counter()
+            fragments = await _get_template_fragments(
+                template_name, context, request, using, charset, template_cache_key
+            )
+            timings.template_render = time.perf_counter() - template_start
+        elif shell_key is not None and is_document:
+            fragments = EMPTY_TEMPLATE_FRAGMENTS
+
+        on_shell = None
+        if (
+            shell_key is not None
+            and nextjs_response.status == 200
+            and response_headers.get("Content-Type", "").startswith("text/html")
+        ):
+            on_shell = functools.partial(_store_shell, shell_key, dict(response_headers), charset)
+    except Exception as error:
+        await exit_stack.aclose()
+        timings.finish(request, error)
+        if isinstance(error, UPSTREAM_ERRORS):
+            return await sync_to_async(_get_unavailable_response)(request, error)
+        raise
+
+    if SERVER_TIMING:
+        # The response headers are sent before the body, so the total time is measured until then.
+        response_headers["Server-Timing"] = timings.server_timing()
+
+    async def stream_nextjs_response():
+        error = None
+        try:
+            async with exit_stack:
+                chunks = iter_coalesced(nextjs_response.content)
+                if learn_hints:
+                    chunks = learn_early_hints_from_stream(
+                        request.path, nextjs_response.status, response_headers, chunks
+                    )
+                if fragments is not None:
+                    async for chunk in _compose_nextjs_stream(chunks, fragments, on_shell):
+                        yield chunk
+                elif not template_name or not is_document:
+                    async for chunk in chunks:
+                        yield chunk
+                else:
+                    # The template can't be applied to a stream, so the whole document is rendered at once.
+                    content = await nextjs_response.read()
+                    if learn_hints:
+                        learn_early_hints(request.path, nextjs_response.status, response_headers, content)
+                    yield await _apply_template(content, charset, request, template_name, context, using)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            timings.finish(request, error)
+
+    return _get_streaming_response(stream_nextjs_response(), nextjs_response.status, response_headers, encoding)
+
 
-        async def stream_nextjs_response():
-            try:
-                async for chunk in nextjs_response.content.iter_any():
+def _stream_nextjs_page_with_shell(
+    request: ASGIRequest,
+    send_request: typing.Callable[[], typing.AsyncContextManager],
+    shell: CachedShell,
+    shell_key: tuple,
+    template_name: str,
+    context: Optional[dict],
+    using: Optional[str],
+    template_cache_key: Optional[TemplateCacheKey],
+    timings: RequestTimings,
+) -> StreamingHttpResponse:
+    """
+    Send the cached shell of the page at once, then request the page from Next.js and stream its body.
+
+    The status and the headers of the response are those of the cached shell, because they're sent
+    before the response of Next.js arrives.
+    """
+    timings.cache = "shell"
+    response_headers = dict(shell.headers)
+    if SERVER_TIMING:
+        response_headers["Server-Timing"] = timings.server_timing()
+
+    async def stream_nextjs_response():
+        error = None
+        try:
+            yield shell.content
+            async with send_request() as nextjs_response:
+                key = shell_key
+                if nextjs_response.status != 200:
+                    # e.g. the page has been removed; its body is still sent, since the status can't be changed.
+                    logger.warning(
+                        "Next.js responded with status %s to a page whose shell was sent, the shell is dropped.",
+                        nextjs_response.status,
+                    )
+                    shell_cache.delete(shell_key)
+                    key = None
+
+                fragments = EMPTY_TEMPLATE_FRAGMENTS
+                if template_name:
+                    template_start = time.perf_counter()
+                    fragments = await _get_template_fragments(
+                        template_name, context, request, using, shell.charset, template_cache_key
+                    )
+                    timings.template_render = time.perf_counter() - template_start
+
+                chunks = iter_coalesced(nextjs_response.content)
+                on_head = None
+                if EARLY_HINTS and (key is None or get_early_hints(request.path) is None):
+                    # e.g. the page has been removed, or its early hints have been evicted
+                    chunks = learn_early_hints_from_stream(request.path, nextjs_response.status, shell.headers, chunks)
+                elif EARLY_HINTS:
+                    # The early hints are learned again only when the head of the shell changes.
+                    on_head = functools.partial(learn_early_hints, request.path, nextjs_response.status, shell.headers)
+                async for chunk in _splice_nextjs_body(
+                    chunks, fragments or EMPTY_TEMPLATE_FRAGMENTS, shell, key, on_head
+                ):
                     yield chunk
-            finally:
-                await nextjs_response.release()
-                if session_is_temporary:
-                    await session.close()
-
-        return StreamingHttpResponse(
-            stream_nextjs_response(),
-            status=nextjs_response.status,
-            headers=response_headers,
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            timings.finish(request, error)
+
+    encoding = None
+    if COMPRESS_RESPONSES:
+        encoding = get_response_encoding(
+            request.META.get("HTTP_ACCEPT_ENCODING", ""), response_headers.get("Content-Type", "")
         )
-    except:
-        if session_is_temporary:
-            await session.close()
-        raise
+    return _get_streaming_response(stream_nextjs_response(), 200, response_headers, encoding)
+
+
+async def _get_shell_cache_key(
+    request: HttpRequest,
+    template_name: str,
+    context: Optional[dict],
+    using: Optional[str],
+    headers: Optional[dict],
+    template_cache_key: Optional[TemplateCacheKey],
+) -> Optional[tuple]:
+    """
+    Return the key of the shell of the page, or None if it can't be cached (the context can't be hashed).
+    The shell is shared by all requests to the path with the same template and context,
+    or for each value of `template_cache_key`.
+    """
+    context_key = _get_context_key(context)
+    if context_key is None:
+        return None
+    template_key = None
+    if template_cache_key is not None and iscoroutinefunction(template_cache_key):
+        template_key = await template_cache_key(request)
+    elif template_cache_key is not None:
+        template_key = await sync_to_async(template_cache_key)(request)
+    return request.path_info, template_name, context_key, using, tuple(sorted((headers or {}).items())), template_key
+
+
+def _store_shell(shell_key: tuple, headers: dict[str, str], charset: str, head: bytes, content: bytes) -> None:
+    headers = {name: value for name, value in headers.items() if name not in UNCACHED_HEADERS}
+    shell_cache.set(shell_key, CachedShell(content, head, headers, charset))
+
+
+def _get_streaming_response(
+    content: typing.AsyncIterator[bytes], status: int, headers: dict[str, str], encoding: Optional[str]
+) -> StreamingHttpResponse:
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+        content = compress_stream(content, encoding)
+    response = _get_response(StreamingHttpResponse, content, status, headers)
+    if COMPRESS_RESPONSES:
+        patch_vary_headers(response, ("Accept-Encoding",))
+    return response
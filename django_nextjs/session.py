@@ -0,0 +1,163 @@
+import asyncio
+import atexit
+import os
+import threading
+import typing
+import weakref
+from typing import Optional
+
+import aiohttp
+
+from .app_settings import (
+    CONNECT_TIMEOUT,
+    CONNECTION_LIMIT,
+    CONNECTION_LIMIT_PER_HOST,
+    DNS_CACHE_TTL,
+    KEEPALIVE_TIMEOUT,
+    TOTAL_TIMEOUT,
+    UNIX_SOCKET_PATH,
+    UPSTREAM_HTTP2,
+)
+from .instrumentation import create_trace_config
+from .transports import Http2Session
+
+# The sessions of the upstream transports have the interface of aiohttp.ClientSession used by this package.
+Session = typing.Union[aiohttp.ClientSession, Http2Session]
+
+# Key under which NextJsMiddleware stores the lifespan-managed session in the ASGI scope's state.
+HTTP_SESSION_KEY = "django_nextjs_http_session"
+
+# Fallback sessions, one per event loop.
+# aiohttp sessions are bound to the loop they were created in, so they can't be shared between loops.
+_loop_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Session]" = weakref.WeakKeyDictionary()
+# Tasks which close the fallback session of their loop when it shuts down
+_session_closers: "set[asyncio.Task]" = set()
+
+
+def create_connector() -> aiohttp.BaseConnector:
+    """
+    Create a connector for the Next.js server according to the connection pool settings.
+    """
+    if UNIX_SOCKET_PATH:
+        # Connect to a co-located Next.js server through a Unix domain socket, skipping the TCP loopback.
+        return aiohttp.UnixConnector(
+            path=UNIX_SOCKET_PATH,
+            limit=CONNECTION_LIMIT,
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+    return aiohttp.TCPConnector(
+        limit=CONNECTION_LIMIT,
+        limit_per_host=CONNECTION_LIMIT_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+
+
+def create_session() -> Session:
+    """
+    Create a session for making requests to the Next.js server.
+
+    The session is shared between requests of different users, so it must not store cookies.
+    Per-request cookies and headers are passed to each request instead.
+    """
+    if UPSTREAM_HTTP2:
+        return Http2Session()
+    return aiohttp.ClientSession(
+        connector=create_connector(),
+        cookie_jar=aiohttp.DummyCookieJar(),
+        timeout=aiohttp.ClientTimeout(total=TOTAL_TIMEOUT, sock_connect=CONNECT_TIMEOUT),
+        trace_configs=[create_trace_config()],
+    )
+
+
+def get_session(scope: Optional[typing.Mapping[str, typing.Any]] = None) -> Session:
+    """
+    Return a pooled session for making requests to the Next.js server.
+
+    The session created by NextJsMiddleware during the ASGI lifespan startup is preferred.
+    If it is not available (e.g. the ASGI server does not support the lifespan protocol, like Daphne),
+    a long-lived session bound to the running event loop is returned.
+    """
+    if scope is not None:
+        session = scope.get("state", {}).get(HTTP_SESSION_KEY)
+        if session is not None and not session.closed:
+            return session
+
+    loop = asyncio.get_running_loop()
+    session = _loop_sessions.get(loop)
+    if session is None or session.closed:
+        if session is None:
+            closer = loop.create_task(_close_loop_session())
+            _session_closers.add(closer)
+            closer.add_done_callback(_session_closers.discard)
+        session = _loop_sessions[loop] = create_session()
+    return session
+
+
+async def _close_loop_session() -> None:
+    """
+    Wait until the loop shuts down, then close its fallback session.
+
+    `asyncio.run` and asgiref's `async_to_sync` cancel the remaining tasks of a loop before closing it.
+    The session (through its connector) references the loop, so it's also removed from `_loop_sessions`,
+    which would otherwise keep both of them alive.
+    """
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        session = _loop_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+
+class BackgroundLoop:
+    """
+    An event loop running forever in a daemon thread.
+
+    In WSGI deployments, Django runs each async view in a new short-lived event loop,
+    so a session bound to that loop can't be reused by the next request.
+    Running upstream requests in this process-wide loop allows them to share a single pooled session.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        # The thread doesn't survive a fork (e.g. gunicorn with --preload), so it's started again in the child.
+        if self._loop is None or self._pid != os.getpid():
+            with self._lock:
+                if self._loop is None or self._pid != os.getpid():
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="django-nextjs", daemon=True).start()
+                    self._loop, self._pid = loop, os.getpid()
+        return self._loop
+
+    async def run(self, coro: typing.Coroutine):
+        """
+        Run the coroutine in the background loop and wait for its result in the current loop.
+        """
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def run_sync(self, coro: typing.Coroutine):
+        """
+        Run the coroutine in the background loop and block the current thread until it's done.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        """
+        Close the session of the background loop, if it has been created in this process.
+        """
+        if self._loop is not None and self._pid == os.getpid():
+            if session := _loop_sessions.get(self._loop):
+                self.run_sync(session.close())
+
+
+background_loop = BackgroundLoop()
+atexit.register(background_loop.close)
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent when django-nextjs has finished handling a request to a Next.js page or asset,
+# with `timings` (a RequestTimings object) and `request` (the HttpRequest, if available) arguments.
+# The sender is the source of the request: "render", "stream", "proxy" or "prefetch".
+nextjs_request_finished = Signal()
@@ -0,0 +1,121 @@
+import mimetypes
+import os
+import stat
+import typing
+from typing import Optional
+
+from django import http
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views import View
+
+from .app_settings import PUBLIC_DIRECTORY, PUBLIC_SUBDIRECTORY, STATIC_DIRECTORY
+from .assets import STATIC_ASSETS_PREFIX, is_not_modified
+
+# Precompressed variants of the files (e.g. created by a build step), in the order of preference
+PRECOMPRESSED_SUFFIXES = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PUBLIC_CACHE_CONTROL = "public, max-age=0"
+
+
+class StaticFile(typing.NamedTuple):
+    path: str
+    size: int
+    headers: dict[str, str]
+
+
+def get_static_routes() -> list[tuple[str, str, str]]:
+    """
+    Return the (URL prefix, directory, Cache-Control) of each configured directory.
+    """
+    routes = []
+    if STATIC_DIRECTORY:
+        routes.append((STATIC_ASSETS_PREFIX, STATIC_DIRECTORY, IMMUTABLE_CACHE_CONTROL))
+    if PUBLIC_DIRECTORY:
+        prefix = PUBLIC_SUBDIRECTORY.rstrip("/") + "/"
+        routes.append((prefix, os.path.join(PUBLIC_DIRECTORY, prefix.strip("/")), PUBLIC_CACHE_CONTROL))
+    return routes
+
+
+def find_static_file(
+    path: str, accept_encoding: str = "", routes: Optional[list[tuple[str, str, str]]] = None
+) -> Optional[StaticFile]:
+    """
+    Return the file which is served for the URL path, or None if there's no such file.
+
+    If the client accepts it, a precompressed variant of the file (`.br` or `.gz`) is returned.
+    The ETag is computed from the modification time and the size, so the file isn't read.
+    """
+    for prefix, directory, cache_control in static_routes if routes is None else routes:
+        if path.startswith(prefix):
+            break
+    else:
+        return None
+
+    try:
+        file_path = safe_join(directory, path[len(prefix) :])
+    except SuspiciousFileOperation:
+        return None
+    if (file_stat := _stat_file(file_path)) is None:
+        return None
+
+    content_type, _ = mimetypes.guess_type(file_path)
+    headers = {
+        "Content-Type": content_type or "application/octet-stream",
+        "Cache-Control": cache_control,
+        "Last-Modified": http_date(file_stat.st_mtime),
+        "Vary": "Accept-Encoding",
+    }
+    accepted = {value.split(";")[0].strip().lower() for value in accept_encoding.split(",")}
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES:
+        if encoding in accepted and (variant_stat := _stat_file(file_path + suffix)) is not None:
+            file_path, file_stat = file_path + suffix, variant_stat
+            headers["Content-Encoding"] = encoding
+            break
+    headers["ETag"] = f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+    return StaticFile(file_path, file_stat.st_size, headers)
+
+
+def _stat_file(path: str) -> Optional[os.stat_result]:
+    try:
+        file_stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return file_stat if stat.S_ISREG(file_stat.st_mode) else None
+
+
+class NextJSStaticFilesView(View):
+    """
+    Serves the files of the `static_directory` and `public_directory` settings.
+    This is the WSGI counterpart of `NextJsStaticFiles`; `FileResponse` lets the WSGI server use sendfile.
+    """
+
+    # The view which handles the requests for missing files (e.g. the assets proxy) instead of responding with 404
+    fallback_view: Optional[typing.Callable[..., http.HttpResponse]] = None
+
+    def get(self, request):
+        static_file = find_static_file(request.path, request.headers.get("Accept-Encoding", ""))
+        if static_file is None:
+            if self.fallback_view is not None:
+                return self.fallback_view(request)
+            raise http.Http404()
+        if is_not_modified(
+            static_file.headers,
+            request.headers.get("If-None-Match", ""),
+            request.headers.get("If-Modified-Since", ""),
+        ):
+            return http.HttpResponseNotModified(
+                headers={name: value for name, value in static_file.headers.items() if name != "Content-Type"}
+            )
+        response = http.FileResponse(open(static_file.path, "rb"), headers=static_file.headers)
+        # FileResponse guesses the headers from the file name (e.g. "main.js.br"), which are replaced.
+        for name, value in static_file.headers.items():
+            response[name] = value
+        if "Content-Disposition" in response:
+            del response["Content-Disposition"]
+        return response
+
+
+static_routes = get_static_routes()
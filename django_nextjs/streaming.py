@@ -0,0 +1,59 @@
+import asyncio
+import sys
+import typing
+
+import aiohttp
+
+from .app_settings import STREAM_FLUSH_BYTES, STREAM_FLUSH_INTERVAL, STREAM_FLUSH_MARKERS
+
+if sys.version_info >= (3, 11):
+    from asyncio import timeout_at
+else:
+    from async_timeout import timeout_at  # A dependency of aiohttp on Python < 3.11
+
+
+async def iter_coalesced(
+    content: aiohttp.StreamReader,
+    flush_bytes: int = STREAM_FLUSH_BYTES,
+    flush_interval: float = STREAM_FLUSH_INTERVAL,
+    flush_markers: typing.Sequence[bytes] = STREAM_FLUSH_MARKERS,
+) -> typing.AsyncIterator[bytes]:
+    """
+    Like `StreamReader.iter_any`, but merge the small chunks of the stream (e.g. a streamed RSC response),
+    so that each of them isn't sent to the client with a separate ASGI message and socket write.
+
+    The buffered data is sent when it reaches `flush_bytes`, when it contains one of `flush_markers`
+    (e.g. the script which reveals a resolved Suspense boundary), or `flush_interval` seconds after its first
+    chunk was received, so a slow stream is still rendered progressively.
+    The data which has already been received is taken without waiting, and nothing is read ahead of the client,
+    so its backpressure is still applied to the upstream. If `flush_bytes` is 0, the chunks are yielded as they are.
+    """
+    if flush_bytes <= 0:
+        async for chunk in content.iter_any():
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    while chunk := await content.readany():
+        buffer = bytearray(chunk)
+        try:
+            # Cancelling `readany` on timeout doesn't lose data, it stays in the buffer of the stream.
+            async with timeout_at(loop.time() + flush_interval):
+                while len(buffer) < flush_bytes and not _has_marker(buffer, len(buffer) - len(chunk), flush_markers):
+                    # Take the data which has already been received, or wait for more.
+                    if not (chunk := content.read_nowait()):
+                        if content.at_eof() or not (chunk := await content.readany()):
+                            break
+                    buffer += chunk
+        except asyncio.TimeoutError:
+            # The stream is waiting for the server (e.g. a Suspense boundary is being rendered).
+            pass
+        yield bytes(buffer)
+
+
+def _has_marker(buffer: bytearray, start: int, markers: typing.Sequence[bytes]) -> bool:
+    # Search the end of the old data too, in case a marker is split between chunks.
+    for marker in markers:
+        if buffer.find(marker, max(start - len(marker) + 1, 0)) != -1:
+            return True
+    return False
@@ -0,0 +1,188 @@
+import asyncio
+import typing
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from http.cookies import SimpleCookie
+from typing import Optional
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+
+from .app_settings import (
+    CONNECT_TIMEOUT,
+    CONNECTION_LIMIT,
+    KEEPALIVE_TIMEOUT,
+    TOTAL_TIMEOUT,
+    UNIX_SOCKET_PATH,
+)
+from .exceptions import NextJsImproperlyConfigured
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class UpstreamConnectError(aiohttp.ClientConnectionError):
+    """
+    The connection to a Next.js server instance couldn't be established, so nothing has been sent to it.
+    """
+
+
+class Http2StreamReader:
+    """
+    The part of `aiohttp.StreamReader` used by this package, for the body of an HTTP/2 response.
+    """
+
+    def __init__(self, chunks: typing.AsyncIterator[bytes]):
+        self._chunks = chunks
+        self._next_chunk: Optional[asyncio.Future] = None
+        self._eof = False
+        self.total_bytes = 0
+
+    async def readany(self) -> bytes:
+        if self._eof:
+            return b""
+        if self._next_chunk is None:
+            self._next_chunk = asyncio.ensure_future(self._read_chunk())
+        # If the caller is cancelled (e.g. on a timeout), the chunk is kept for the next call.
+        chunk = await asyncio.shield(self._next_chunk)
+        self._next_chunk = None
+        return chunk
+
+    def read_nowait(self) -> bytes:
+        if self._next_chunk is None or not self._next_chunk.done():
+            return b""
+        chunk, self._next_chunk = self._next_chunk.result(), None
+        return chunk
+
+    def at_eof(self) -> bool:
+        return self._eof
+
+    async def iter_any(self) -> typing.AsyncIterator[bytes]:
+        while chunk := await self.readany():
+            yield chunk
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_any()])
+
+    async def _read_chunk(self) -> bytes:
+        try:
+            chunk = await anext(self._chunks, b"")
+        except httpx.HTTPError as error:
+            raise _convert_error(error) from error
+        self._eof = not chunk
+        self.total_bytes += len(chunk)
+        return chunk
+
+    def close(self) -> None:
+        if self._next_chunk is not None:
+            self._next_chunk.cancel()
+
+
+# Tasks closing the released HTTP/2 responses
+_closing_responses: "set[asyncio.Future]" = set()
+
+
+class Http2Response:
+    """
+    The part of `aiohttp.ClientResponse` used by this package, for a response received over HTTP/2.
+    """
+
+    def __init__(self, response: "httpx.Response", auto_decompress: bool = True):
+        self._response = response
+        self.status = response.status_code
+        self.headers = CIMultiDictProxy(CIMultiDict(response.headers.multi_items()))
+        self.content = Http2StreamReader(response.aiter_bytes() if auto_decompress else response.aiter_raw())
+
+    async def read(self) -> bytes:
+        return await self.content.read()
+
+    def release(self) -> None:
+        # Closing the response resets its stream, the connection stays open for the other streams.
+        self.content.close()
+        # The task is referenced until it's done, otherwise it may be garbage collected before closing the stream.
+        task = asyncio.ensure_future(self._response.aclose())
+        _closing_responses.add(task)
+        task.add_done_callback(_closing_responses.discard)
+
+
+class Http2Session:
+    """
+    Sends requests to the Next.js server over HTTP/2 without TLS (h2c, with prior knowledge) using httpx,
+    so that a few connections carry all concurrent requests, instead of a connection per concurrent request.
+
+    It's used instead of `aiohttp.ClientSession` (with the same interface, for the arguments used by this package)
+    when the `upstream_http2` setting is enabled.
+    """
+
+    def __init__(self):
+        if httpx is None:
+            raise NextJsImproperlyConfigured(
+                "The upstream_http2 setting requires httpx with HTTP/2 support: pip install django-nextjs[http2]"
+            )
+        try:
+            transport = httpx.AsyncHTTPTransport(
+                http1=False,
+                http2=True,
+                uds=UNIX_SOCKET_PATH,
+                limits=httpx.Limits(max_connections=CONNECTION_LIMIT or None, keepalive_expiry=KEEPALIVE_TIMEOUT),
+            )
+        except ImportError as error:
+            raise NextJsImproperlyConfigured(
+                "The upstream_http2 setting requires the h2 package: pip install django-nextjs[http2]"
+            ) from error
+        self._client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(TOTAL_TIMEOUT, connect=CONNECT_TIMEOUT),
+            # The client is shared between requests of different users, so it must not store cookies.
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+        )
+
+    @property
+    def closed(self) -> bool:
+        return self._client.is_closed
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Optional[typing.Sequence[tuple[str, str]]] = None,
+        data: Optional[typing.Union[bytes, typing.AsyncIterable[bytes]]] = None,
+        headers: Optional[typing.Mapping[str, str]] = None,
+        cookies: Optional[typing.Mapping[str, str]] = None,
+        allow_redirects: bool = True,
+        auto_decompress: bool = True,
+        trace_request_ctx: typing.Any = None,
+    ) -> Http2Response:
+        headers = httpx.Headers(headers)
+        if cookies:
+            headers["Cookie"] = _merge_cookies(headers.get("Cookie", ""), cookies)
+        request = self._client.build_request(method, url, params=params, content=data, headers=headers)
+        try:
+            response = await self._client.send(request, stream=True, follow_redirects=allow_redirects)
+        except httpx.HTTPError as error:
+            raise _convert_error(error) from error
+        return Http2Response(response, auto_decompress)
+
+
+def _merge_cookies(cookie_header: str, cookies: typing.Mapping[str, str]) -> str:
+    # Like aiohttp, the cookies of the request override the cookies of the Cookie header with the same name.
+    merged = SimpleCookie(cookie_header)
+    for name, value in cookies.items():
+        merged[name] = value
+    return "; ".join(f"{morsel.key}={morsel.coded_value}" for morsel in merged.values())
+
+
+def _convert_error(error: "httpx.HTTPError") -> Exception:
+    """
+    Convert the errors of httpx to the errors of aiohttp, which are handled by this package.
+    """
+    if isinstance(error, httpx.TimeoutException):
+        return asyncio.TimeoutError(str(error))
+    if isinstance(error, httpx.ConnectError):
+        return UpstreamConnectError(str(error))
+    return aiohttp.ClientConnectionError(str(error))
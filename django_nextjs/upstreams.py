@@ -0,0 +1,221 @@
+import asyncio
+import collections.abc
+import contextlib
+import threading
+import time
+import typing
+from typing import Optional
+
+import aiohttp
+
+from .app_settings import FIRST_BYTE_TIMEOUT, NEXTJS_SERVER_URLS, UPSTREAM_COOLDOWN, UPSTREAM_MAX_FAILURES
+from .exceptions import NextJsUnavailable
+from .instrumentation import RequestTimings
+from .session import Session
+from .transports import Http2Response, UpstreamConnectError
+
+# Responses with these statuses may mean that the Next.js server is unavailable, so a stale cached page is served
+# instead of them. They don't eject the instance, since pages and route handlers may return them on purpose.
+UNAVAILABLE_STATUSES = frozenset([502, 503, 504])
+
+# Errors raised when a response can't be received from the Next.js server
+UPSTREAM_ERRORS = (NextJsUnavailable, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class Upstream:
+    """
+    A Next.js server instance.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0  # Number of in-flight requests
+        self.failures = 0  # Number of consecutive failed requests
+        self.ejected_until = 0.0  # Monotonic time until which the instance is considered unhealthy
+        self.probing = False  # Whether a request is checking if the ejected instance has recovered
+
+    def __repr__(self):
+        return f"<Upstream {self.url}>"
+
+
+class _StreamedBody:
+    """
+    Wraps the body of a request which is streamed from the client,
+    to know when it has been sent and whether it couldn't be received from the client.
+    """
+
+    def __init__(self, chunks: typing.AsyncIterable[bytes]):
+        self.chunks = chunks
+        self.sent = asyncio.Event()
+        self.error: Optional[Exception] = None
+
+    async def __aiter__(self) -> typing.AsyncIterator[bytes]:
+        try:
+            async for chunk in self.chunks:
+                yield chunk
+        except Exception as error:
+            self.error = error
+            raise
+        self.sent.set()
+
+    def caused(self, error: Exception) -> bool:
+        """
+        Return whether the error of the request is caused by the client, e.g. it disconnected during the upload,
+        or it's uploading so slowly that the request timed out.
+        """
+        return self.error is not None or (isinstance(error, asyncio.TimeoutError) and not self.sent.is_set())
+
+
+class UpstreamPool:
+    """
+    Distributes requests between Next.js server instances.
+
+    Each request is sent to the healthy instance with the least outstanding requests.
+    An instance is ejected for `cooldown` seconds after `max_failures` consecutive failed requests
+    (connection errors and timeouts, except those caused by the client, e.g. when it disconnects during an upload). After that, a single request is sent to it
+    to check if it has recovered, and it's ejected again if that request fails.
+    If all instances are ejected, requests fail fast with `NextJsUnavailable`.
+    """
+
+    def __init__(
+        self,
+        urls: typing.Iterable[str],
+        max_failures: int = 3,
+        cooldown: float = 10,
+        first_byte_timeout: Optional[float] = None,
+    ):
+        self.upstreams = [Upstream(url) for url in urls]
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.first_byte_timeout = first_byte_timeout
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def acquire(self, exclude: typing.Container[Upstream] = ()) -> Upstream:
+        """
+        Select an upstream for a new request. Each call must be followed by a call to `release`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [upstream for upstream in self.upstreams if upstream not in exclude] or self.upstreams
+            # Rotate the candidates, so that ties are broken in a round-robin fashion.
+            start = self._counter % len(candidates)
+            self._counter += 1
+            candidates = candidates[start:] + candidates[:start]
+            healthy = [upstream for upstream in candidates if upstream.ejected_until <= now and not upstream.probing]
+            if not healthy:
+                raise NextJsUnavailable("All Next.js server instances are unavailable.")
+            upstream = min(healthy, key=lambda u: u.outstanding)
+            if upstream.failures >= self.max_failures:
+                upstream.probing = True
+            upstream.outstanding += 1
+            return upstream
+
+    def release(self, upstream: Upstream, failed: Optional[bool] = False) -> None:
+        """
+        Release an upstream selected by `acquire`. `failed` is None if the request doesn't tell whether the upstream
+        is healthy (e.g. it has been cancelled), in which case its health isn't changed.
+        """
+        with self._lock:
+            upstream.outstanding -= 1
+            upstream.probing = False
+            if failed is None:
+                return
+            if not failed:
+                upstream.failures = 0
+                return
+            upstream.failures += 1
+            if upstream.failures >= self.max_failures:
+                upstream.ejected_until = time.monotonic() + self.cooldown
+
+    @contextlib.asynccontextmanager
+    async def request(
+        self,
+        session: Session,
+        method: str,
+        path: str,
+        timings: Optional[RequestTimings] = None,
+        **kwargs,
+    ) -> typing.AsyncIterator[typing.Union[aiohttp.ClientResponse, Http2Response]]:
+        """
+        Send a request to an upstream and release the response on exit.
+
+        If the connection to an instance can't be established, the request is retried on the other instances.
+        This is safe for all methods, because nothing has been sent yet.
+
+        If `timings` is provided, the upstream timings of the request are recorded in it.
+        """
+        if timings is not None:
+            kwargs["trace_request_ctx"] = timings
+            start = time.perf_counter()
+        tried: list[Upstream] = []
+        data = kwargs.get("data")
+        while True:
+            upstream = self.acquire(exclude=tried)
+            body = _StreamedBody(data) if isinstance(data, collections.abc.AsyncIterable) else None
+            try:
+                response = await self._send(session, method, upstream.url + path, kwargs, body)
+            except (aiohttp.ClientConnectorError, UpstreamConnectError):
+                self.release(upstream, failed=True)
+                tried.append(upstream)
+                if len(tried) < len(self.upstreams):
+                    continue
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                self.release(upstream, failed=None if body is not None and body.caused(error) else True)
+                raise
+            except BaseException:
+                self.release(upstream, failed=None)
+                raise
+            break
+
+        if timings is not None:
+            timings.upstream_url = upstream.url
+            timings.status = response.status
+            timings.ttfb = time.perf_counter() - start
+
+        failed: Optional[bool] = False
+        try:
+            yield response
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            failed = None if body is not None and body.caused(error) else True
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            failed = None
+            raise
+        finally:
+            response.release()
+            self.release(upstream, failed=failed)
+            if timings is not None:
+                timings.upstream_total = time.perf_counter() - start
+                timings.bytes_received = response.content.total_bytes
+
+    async def _send(self, session: Session, method: str, url: str, kwargs: dict, body: Optional[_StreamedBody]):
+        """
+        Send the request, and wait for its response for at most `first_byte_timeout` seconds after its body is sent.
+        The total and connect timeouts are set on the session.
+        """
+        if body is None or self.first_byte_timeout is None:
+            if body is not None:
+                kwargs = {**kwargs, "data": body}
+            return await asyncio.wait_for(session.request(method, url, **kwargs), self.first_byte_timeout)
+
+        # A streamed body is sent at the pace of the client, which isn't a sign of the health of the instance.
+        request = asyncio.ensure_future(session.request(method, url, **{**kwargs, "data": body}))
+        body_sent = asyncio.ensure_future(body.sent.wait())
+        try:
+            await asyncio.wait((request, body_sent), return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            request.cancel()
+            raise
+        finally:
+            body_sent.cancel()
+        return await asyncio.wait_for(request, self.first_byte_timeout)
+
+
+upstreams = UpstreamPool(
+    NEXTJS_SERVER_URLS,
+    max_failures=UPSTREAM_MAX_FAILURES,
+    cooldown=UPSTREAM_COOLDOWN,
+    first_byte_timeout=FIRST_BYTE_TIMEOUT,
+)
@@ -1,7 +1,12 @@
+import re
+
 from django.conf import settings
 from django.urls import re_path
 
-from .proxy import NextJSProxyView
+from .app_settings import ASSETS_PROXY
+from .assets import STATIC_ASSETS_PREFIX
+from .proxy import NextJSProxyView, NextJSStaticAssetsView
+from .static_files import NextJSStaticFilesView, static_routes
 
 app_name = "django_nextjs"
 urlpatterns = []
@@ -9,3 +14,13 @@ urlpatterns = []
 if settings.DEBUG:
     # only in dev environment
     urlpatterns.append(re_path(r"^(?:_next|__nextjs|next).*$", NextJSProxyView.as_view()))
+else:
+    # Like NextJsMiddleware, the missing static files are requested from Next.js if the assets proxy is enabled.
+    assets_view = NextJSStaticAssetsView.as_view() if ASSETS_PROXY else None
+    for prefix, _, _ in static_routes:
+        fallback_view = assets_view if prefix == STATIC_ASSETS_PREFIX else None
+        urlpatterns.append(
+            re_path(rf"^{re.escape(prefix.lstrip('/'))}", NextJSStaticFilesView.as_view(fallback_view=fallback_view))
+        )
+    if ASSETS_PROXY:
+        urlpatterns.append(re_path(r"^_next/static/", NextJSStaticAssetsView.as_view()))
@@ -1,5 +1,8 @@
+import logging
 import typing
 
+logger = logging.getLogger(__name__)
+
 Key = typing.TypeVar("Key")
 Value = typing.TypeVar("Value")
 
@@ -8,5 +11,8 @@ def filter_mapping_obj(mapping_obj: typing.Mapping[Key, Value], *, selected_keys
     """
     Selects the items in a mapping object (dict, etc.)
     """
-
+    logger.warning(
+        "filter_mapping_obj is deprecated and will be removed in the next major release. "
+        "Use a dict comprehension instead.",
+    )
     return {key: mapping_obj[key] for key in selected_keys if key in mapping_obj}
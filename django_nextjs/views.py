@@ -1,6 +1,6 @@
 from typing import Optional
 
-from .render import render_nextjs_page, stream_nextjs_page
+from .render import TemplateCacheKey, render_nextjs_page, render_nextjs_page_sync, stream_nextjs_page
 
 
 def nextjs_page(
@@ -11,13 +11,31 @@ def nextjs_page(
     using: Optional[str] = None,
     allow_redirects: bool = False,
     headers: Optional[dict] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+    stale_while_revalidate: Optional[int] = None,
+    cache_shell: bool = False,
 ):
-    if stream and (template_name or context or using):
-        raise ValueError("When 'stream' is set to True, you should not use 'template_name', 'context', or 'using'")
+    if stream and (context or using) and not template_name:
+        raise ValueError(
+            "When 'stream' is set to True, you should not use 'context' or 'using' without 'template_name'"
+        )
+    if stream and stale_while_revalidate is not None:
+        raise ValueError("When 'stream' is set to True, you should not use 'stale_while_revalidate'")
+    if cache_shell and not stream:
+        raise ValueError("'cache_shell' can only be used when 'stream' is set to True")
 
     async def view(request, *args, **kwargs):
         if stream:
-            return await stream_nextjs_page(request=request, allow_redirects=allow_redirects, headers=headers)
+            return await stream_nextjs_page(
+                request=request,
+                template_name=template_name,
+                context=context,
+                using=using,
+                allow_redirects=allow_redirects,
+                headers=headers,
+                template_cache_key=template_cache_key,
+                cache_shell=cache_shell,
+            )
 
         return await render_nextjs_page(
             request=request,
@@ -26,6 +44,37 @@ def nextjs_page(
             using=using,
             allow_redirects=allow_redirects,
             headers=headers,
+            template_cache_key=template_cache_key,
+            stale_while_revalidate=stale_while_revalidate,
+        )
+
+    return view
+
+
+def nextjs_page_sync(
+    *,
+    template_name: str = "",
+    context: Optional[dict] = None,
+    using: Optional[str] = None,
+    allow_redirects: bool = False,
+    headers: Optional[dict] = None,
+    template_cache_key: Optional[TemplateCacheKey] = None,
+    stale_while_revalidate: Optional[int] = None,
+):
+    """
+    Synchronous version of `nextjs_page` for WSGI deployments (streaming is not supported).
+    """
+
+    def view(request, *args, **kwargs):
+        return render_nextjs_page_sync(
+            request=request,
+            template_name=template_name,
+            context=context,
+            using=using,
+            allow_redirects=allow_redirects,
+            headers=headers,
+            template_cache_key=template_cache_key,
+            stale_while_revalidate=stale_while_revalidate,
         )
 
     return view
@@ -15,6 +15,7 @@ dev_requirements = [
     "pytest-asyncio",
     "black",
     "isort",
+    "httpx[http2]",
 ]
 
 LONG_DESCRIPTION = """
@@ -39,8 +40,8 @@ setup(
     download_url="https://github.com/QueraTeam/django-nextjs",
     packages=find_packages(".", include=("django_nextjs", "django_nextjs.*")),
     include_package_data=True,
-    install_requires=["Django >= 4.2", "aiohttp", "websockets"],
-    extras_require={"dev": dev_requirements},
+    install_requires=["Django >= 4.2", "aiohttp >= 3.9", "websockets"],
+    extras_require={"dev": dev_requirements, "http2": ["httpx[http2]"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Environment :: Web Environment",
@@ -0,0 +1,41 @@
+from unittest.mock import patch
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from django_nextjs.upstreams import UpstreamPool, upstreams
+
+
+@pytest.fixture(autouse=True)
+def reset_upstreams():
+    """
+    Tests which simulate failures of the Next.js server must not eject it for the following tests.
+    """
+    yield
+    for upstream in upstreams.upstreams:
+        upstream.failures = 0
+        upstream.ejected_until = 0.0
+        upstream.probing = False
+
+
+@pytest_asyncio.fixture
+async def nextjs_server():
+    """
+    Run a fake Next.js server and send the requests of the proxy and the views to it.
+    Return the list of the received (method, path, body, headers) of the requests.
+    """
+    received = []
+
+    async def handler(request: web.Request):
+        chunks = [chunk async for chunk in request.content.iter_any()]
+        received.append((request.method, request.path_qs, b"".join(chunks), request.headers))
+        return web.Response(text="ok", content_type="text/x-component", headers={"X-Action-Revalidated": "[[],0,0]"})
+
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", handler)
+    async with TestServer(app) as server:
+        pool = UpstreamPool([str(server.make_url(""))])
+        with patch("django_nextjs.asgi.upstreams", pool), patch("django_nextjs.render.upstreams", pool):
+            yield received
@@ -0,0 +1,90 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from django_nextjs.asgi import NextJsHttpProxy, NextJsWebSocketProxy
+from django_nextjs.upstreams import UpstreamPool
+
+
+def make_scope(method: str):
+    return {
+        "type": "http",
+        "method": method,
+        "path": "/_next/action",
+        "query_string": b"a=1",
+        "headers": [(b"content-type", b"application/octet-stream")],
+        "state": {},
+    }
+
+
+@pytest.mark.asyncio
+async def test_http_proxy_streams_request_body(nextjs_server, settings):
+    settings.DEBUG = True
+    chunks = [b"a" * 100_000, b"b" * 100_000, b"c" * 10]
+    received_messages = 0
+
+    async def receive():
+        nonlocal received_messages
+        received_messages += 1
+        if received_messages <= len(chunks):
+            await asyncio.sleep(0)
+            return {"type": "http.request", "body": chunks[received_messages - 1], "more_body": received_messages < 3}
+        return {"type": "http.disconnect"}
+
+    messages = []
+    await NextJsHttpProxy.as_asgi()(make_scope("POST"), receive, AsyncMock(side_effect=messages.append))
+
+    assert [request[:3] for request in nextjs_server] == [("POST", "/_next/action?a=1", b"".join(chunks))]
+    assert messages[0]["status"] == 200
+    assert b"".join(message.get("body", b"") for message in messages[1:]) == b"ok"
+
+
+@pytest.mark.asyncio
+async def test_http_proxy_client_disconnects_during_upload(nextjs_server, settings):
+    settings.DEBUG = True
+    receive = AsyncMock(
+        side_effect=[{"type": "http.request", "body": b"a", "more_body": True}, {"type": "http.disconnect"}]
+    )
+    send = AsyncMock()
+
+    await NextJsHttpProxy.as_asgi()(make_scope("PUT"), receive, send)
+
+    send.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_websocket_proxy_doesnt_hold_upstream(settings):
+    settings.DEBUG = True
+    pool = UpstreamPool(["http://a"], max_failures=1)
+    upstream = pool.upstreams[0]
+    # The instance has failed and its cooldown is over, so the next request checks if it has recovered.
+    upstream.failures = 1
+    connected = asyncio.Event()
+    disconnect = asyncio.Event()
+
+    async def receive():
+        if not connected.is_set():
+            connected.set()
+            return {"type": "websocket.connect"}
+        await disconnect.wait()
+        return {"type": "websocket.disconnect"}
+
+    with (
+        patch("django_nextjs.asgi.upstreams", pool),
+        patch("django_nextjs.asgi.websockets.connect", new_callable=AsyncMock) as connect,
+    ):
+        connect.return_value.__aiter__.return_value = []
+        proxy = asyncio.create_task(
+            NextJsWebSocketProxy.as_asgi()({"type": "websocket", "path": "/_next/webpack-hmr"}, receive, AsyncMock())
+        )
+        await connected.wait()
+        await asyncio.sleep(0.01)
+
+        # While the connection is open, the instance is available to other requests.
+        assert (upstream.outstanding, upstream.failures, upstream.probing) == (0, 0, False)
+        assert pool.acquire() is upstream
+        disconnect.set()
+        await proxy
+
+    assert connect.call_args.args == ("ws://a/_next/webpack-hmr",)
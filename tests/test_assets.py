@@ -0,0 +1,199 @@
+import os
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from django_nextjs.asgi import NextJsMiddleware
+from django_nextjs.assets import AssetCache, get_asset_encoding, get_static_asset, is_not_modified
+from django_nextjs.proxy import NextJSStaticAssetsView
+
+ASSET_PATH = "/_next/static/chunks/main-0123456789abcdef.js"
+
+
+@pytest.fixture
+def mock_request():
+    with (
+        patch("django_nextjs.assets.asset_cache", AssetCache(max_bytes=1024 * 1024)),
+        patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request,
+    ):
+        mock_request.return_value = MagicMock(
+            status=200,
+            headers={
+                "Content-Type": "application/javascript",
+                "Content-Encoding": "gzip",
+                "Cache-Control": "public, max-age=31536000, immutable",
+                "ETag": '"abc"',
+                "X-Powered-By": "Next.js",
+            },
+        )
+        mock_request.return_value.read = AsyncMock(return_value=b"compressed")
+        yield mock_request
+
+
+def test_asset_cache_spills_to_disk(tmp_path):
+    cache = AssetCache(max_bytes=10, directory=str(tmp_path), disk_max_bytes=15)
+    cache.set(("/a", "gzip"), {}, b"a" * 8)
+    cache.set(("/b", "gzip"), {}, b"b" * 8)
+
+    asset = cache.get(("/a", "gzip"))
+    assert asset.content is None
+    assert cache.read(asset) == b"a" * 8
+    assert cache.get(("/b", "gzip")).content == b"b" * 8
+
+    # The disk budget is exceeded, so the least recently used file is removed
+    cache.set(("/c", "gzip"), {}, b"c" * 8)
+    cache.set(("/d", "gzip"), {}, b"d" * 8)
+    assert cache.get(("/b", "gzip")) is None
+    assert len(os.listdir(tmp_path)) == 1
+    assert len(cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_asset_removed_by_other_process_is_fetched_again(mock_request, tmp_path):
+    # Two processes sharing the cache directory
+    cache = AssetCache(max_bytes=10, directory=str(tmp_path), disk_max_bytes=15)
+    other_cache = AssetCache(max_bytes=0, directory=str(tmp_path), disk_max_bytes=15)
+    with patch("django_nextjs.assets.asset_cache", cache):
+        status, _, _ = await get_static_asset(None, ASSET_PATH, accept_encoding="gzip")
+        assert status == 200
+        cache.set(("/other", "gzip"), {}, b"o" * 10)
+        assert cache.get((ASSET_PATH, "gzip")).content is None
+
+        # The other process evicts the same file from its disk cache
+        other_cache.set((ASSET_PATH, "gzip"), {}, b"compressed")
+        other_cache.set(("/a", "gzip"), {}, b"a" * 8)
+        other_cache.set(("/b", "gzip"), {}, b"b" * 8)
+        assert other_cache.get((ASSET_PATH, "gzip")) is None
+
+        status, _, content = await get_static_asset(None, ASSET_PATH, accept_encoding="gzip")
+        assert (status, content) == (200, b"compressed")
+        assert mock_request.call_count == 2
+
+
+def test_asset_cache_without_directory_drops_evicted_assets():
+    cache = AssetCache(max_bytes=10)
+    cache.set(("/a", "gzip"), {}, b"a" * 8)
+    cache.set(("/b", "gzip"), {}, b"b" * 8)
+    assert cache.get(("/a", "gzip")) is None
+    assert cache.size == 8
+
+
+def test_get_asset_encoding():
+    assert get_asset_encoding("gzip, deflate, br, zstd") == "br"
+    assert get_asset_encoding("gzip;q=1.0, identity") == "gzip"
+    assert get_asset_encoding("") == "identity"
+
+
+def test_is_not_modified():
+    headers = {"ETag": '"abc"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}
+    assert is_not_modified(headers, '"xyz", W/"abc"', "")
+    assert not is_not_modified(headers, '"xyz"', "Wed, 21 Oct 2015 07:28:00 GMT")
+    assert is_not_modified(headers, "", "Wed, 21 Oct 2015 07:28:00 GMT")
+    assert not is_not_modified(headers, "", "Tue, 20 Oct 2015 07:28:00 GMT")
+    assert not is_not_modified(headers, "", "")
+
+
+@pytest.mark.asyncio
+async def test_get_static_asset_is_cached(mock_request):
+    for _ in range(2):
+        status, headers, content = await get_static_asset(None, ASSET_PATH, accept_encoding="gzip, deflate")
+        assert (status, content) == (200, b"compressed")
+        assert headers["Content-Encoding"] == "gzip"
+        assert headers["Cache-Control"] == "public, max-age=31536000, immutable"
+        assert "X-Powered-By" not in headers
+    assert mock_request.call_count == 1
+    args, kwargs = mock_request.call_args
+    assert kwargs["headers"] == {"Accept-Encoding": "gzip"}
+    assert kwargs["auto_decompress"] is False
+
+    # Each encoding is cached separately
+    await get_static_asset(None, ASSET_PATH)
+    assert mock_request.call_count == 2
+
+    status, headers, content = await get_static_asset(None, ASSET_PATH, accept_encoding="gzip", if_none_match='"abc"')
+    assert (status, content) == (304, b"")
+    assert headers["ETag"] == '"abc"'
+    assert mock_request.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_static_asset_does_not_cache_errors(mock_request):
+    mock_request.return_value.status = 404
+    for _ in range(2):
+        status, _, _ = await get_static_asset(None, ASSET_PATH)
+        assert status == 404
+    assert mock_request.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_middleware_serves_static_assets(mock_request, settings):
+    settings.DEBUG = False
+    inner_app = AsyncMock()
+    with patch("django_nextjs.asgi.ASSETS_PROXY", True):
+        app = NextJsMiddleware(inner_app)
+
+    messages = []
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": ASSET_PATH,
+        "query_string": b"",
+        "headers": [(b"accept-encoding", b"gzip")],
+    }
+    receive = AsyncMock(
+        side_effect=[{"type": "http.request", "body": b"", "more_body": False}, {"type": "http.disconnect"}]
+    )
+    with patch("django_nextjs.asgi.ASSETS_PROXY", True):
+        await app(scope, receive, AsyncMock(side_effect=messages.append))
+
+    inner_app.assert_not_called()
+    assert messages[0]["status"] == 200
+    assert (b"content-encoding", b"gzip") in messages[0]["headers"]
+    assert messages[1]["body"] == b"compressed"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "method,request_headers,status,content_length,body",
+    [
+        ("HEAD", [], 200, b"10", b""),
+        ("GET", [(b"if-none-match", b'"abc"')], 304, None, b""),
+    ],
+)
+async def test_middleware_content_length_of_static_assets(
+    mock_request, settings, method, request_headers, status, content_length, body
+):
+    settings.DEBUG = False
+    with patch("django_nextjs.asgi.ASSETS_PROXY", True):
+        app = NextJsMiddleware(AsyncMock())
+
+    messages = []
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": ASSET_PATH,
+        "query_string": b"",
+        "headers": [(b"accept-encoding", b"gzip"), *request_headers],
+    }
+    receive = AsyncMock(
+        side_effect=[{"type": "http.request", "body": b"", "more_body": False}, {"type": "http.disconnect"}]
+    )
+    with patch("django_nextjs.asgi.ASSETS_PROXY", True):
+        await app(scope, receive, AsyncMock(side_effect=messages.append))
+
+    assert messages[0]["status"] == status
+    assert dict(messages[0]["headers"]).get(b"content-length") == content_length
+    assert messages[1]["body"] == body
+
+
+def test_static_assets_view(mock_request, rf):
+    view = NextJSStaticAssetsView.as_view()
+
+    response = view(rf.get(ASSET_PATH, HTTP_ACCEPT_ENCODING="gzip"))
+    assert response.status_code == 200
+    assert response.content == b"compressed"
+    assert response["Content-Encoding"] == "gzip"
+
+    response = view(rf.get(ASSET_PATH, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH='"abc"'))
+    assert response.status_code == 304
+    assert mock_request.call_count == 1
@@ -0,0 +1,245 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiohttp
+import pytest
+from django.test import RequestFactory
+from django.utils.asyncio import async_unsafe
+from django.utils.functional import SimpleLazyObject
+
+from django_nextjs.cache import CachedPage, MemoryCache, get_cache_key, get_cache_lifetime, single_flight
+from django_nextjs.views import nextjs_page
+
+
+def test_get_cache_lifetime():
+    assert get_cache_lifetime(200, {"Cache-Control": "s-maxage=60, stale-while-revalidate=30"}) == (60, 30)
+    assert get_cache_lifetime(200, {"Cache-Control": "s-maxage=31536000, stale-while-revalidate"}) == (
+        31536000,
+        31536000,
+    )
+    assert get_cache_lifetime(200, {"Cache-Control": "public, max-age=10"}) == (10, 0)
+    assert get_cache_lifetime(200, {"Cache-Control": "max-age=10"}) is None
+    assert get_cache_lifetime(200, {"Cache-Control": "private, no-cache, no-store, max-age=0, must-revalidate"}) is None
+    assert get_cache_lifetime(200, {"Cache-Control": "s-maxage=60", "Set-Cookie": "a=b"}) is None
+    assert get_cache_lifetime(500, {"Cache-Control": "s-maxage=60"}) is None
+    assert get_cache_lifetime(200, {}) is None
+
+
+def test_get_cache_key(rf: RequestFactory):
+    key = get_cache_key(rf.get("/page?a=1"))
+    assert key == get_cache_key(rf.get("/page?a=1", HTTP_USER_AGENT="other"))
+    assert key != get_cache_key(rf.get("/page?a=2"))
+    assert key != get_cache_key(rf.get("/page?a=1", HTTP_RSC="1"))
+    assert key != get_cache_key(rf.get("/page?a=1", HTTP_NEXT_ROUTER_STATE_TREE="%5B%5D"))
+    assert key != get_cache_key(rf.get("/page?a=1"), headers={"extra": "header"})
+
+    with patch("django_nextjs.cache.CACHE_VARY", lambda request: request.headers.get("Accept-Language")):
+        assert get_cache_key(rf.get("/page")) is None
+        assert get_cache_key(rf.get("/page", HTTP_ACCEPT_LANGUAGE="en")) != get_cache_key(
+            rf.get("/page", HTTP_ACCEPT_LANGUAGE="fa")
+        )
+
+
+@pytest.mark.asyncio
+async def test_cache_vary_may_use_lazy_request_attributes(async_rf):
+    def vary(request):
+        return None if request.user.is_authenticated else ""
+
+    request = async_rf.get("/page")
+    # Like `request.user` of AuthenticationMiddleware, which queries the database when it's used
+    request.user = SimpleLazyObject(async_unsafe(lambda: MagicMock(is_authenticated=False)))
+
+    with (
+        patch("django_nextjs.cache.CACHE_VARY", vary),
+        patch("django_nextjs.render.CACHE_VARY", vary),
+        patch("django_nextjs.render.page_cache", MemoryCache(max_bytes=1024 * 1024)),
+        patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request,
+    ):
+        mock_request.return_value = MagicMock(status=200, headers={"Cache-Control": "s-maxage=60"})
+        mock_request.return_value.read = AsyncMock(return_value=b"<html>cached</html>")
+
+        for _ in range(2):
+            http_response = await nextjs_page()(request)
+            assert http_response.content == b"<html>cached</html>"
+        assert mock_request.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_lru_eviction():
+    def page(size):
+        return CachedPage(b"x" * size, 200, {}, time.time() + 60, time.time() + 60)
+
+    cache = MemoryCache(max_bytes=3000)
+    await cache.set("a", page(1000))
+    await cache.set("b", page(1000))
+    assert await cache.get("a")  # "b" is now the least recently used
+    await cache.set("c", page(1000))
+    assert await cache.get("b") is None
+    assert await cache.get("a") and await cache.get("c")
+    assert cache.size <= 3000
+
+    await cache.set("d", page(5000))
+    assert await cache.get("d") is None
+
+    await cache.set("e", CachedPage(b"", 200, {}, time.time() - 10, time.time() - 1))
+    assert await cache.get("e") is None
+
+
+@pytest.mark.asyncio
+async def test_render_nextjs_page_uses_cache(rf: RequestFactory):
+    with (
+        patch("django_nextjs.render.page_cache", MemoryCache(max_bytes=1024 * 1024)),
+        patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request,
+    ):
+        mock_request.return_value = MagicMock(
+            status=200,
+            headers={
+                "Cache-Control": "s-maxage=60",
+                "Date": "Mon, 01 Jan 2024 00:00:00 GMT",
+                "Connection": "keep-alive",
+                "Keep-Alive": "timeout=5",
+            },
+        )
+        mock_request.return_value.read = AsyncMock(return_value=b"<html>cached</html>")
+
+        for index in range(3):
+            http_response = await nextjs_page()(rf.get("/page"))
+            assert http_response.content == b"<html>cached</html>"
+            assert http_response["Cache-Control"] == "s-maxage=60"
+            # The headers of the response the page is cached from aren't sent with the cached page.
+            assert all((name in http_response) == (index == 0) for name in ("Date", "Connection", "Keep-Alive"))
+        assert mock_request.call_count == 1
+
+        await nextjs_page()(rf.get("/page?other"))
+        assert mock_request.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_are_coalesced(async_rf):
+    release_response = asyncio.Event()
+
+    async def slow_request(*args, **kwargs):
+        await release_response.wait()
+        response = MagicMock(status=200, headers={})
+        response.read = AsyncMock(return_value=b"<html></html>")
+        return response
+
+    with (
+        patch("django_nextjs.render.COALESCE_REQUESTS", True),
+        patch("aiohttp.ClientSession.request", side_effect=slow_request) as mock_request,
+    ):
+        view = nextjs_page()
+        requests = [async_rf.get("/page") for _ in range(5)]
+        requests.append(async_rf.get("/page"))
+        requests[-1].COOKIES["sessionid"] = "abc"
+        tasks = [asyncio.create_task(view(request)) for request in requests]
+        await asyncio.sleep(0.01)
+        assert len(single_flight) == 1
+        release_response.set()
+
+        responses = await asyncio.gather(*tasks)
+        assert all(response.content == b"<html></html>" for response in responses)
+        # One request for the anonymous users and one for the user with a session
+        assert mock_request.call_count == 2
+        assert len(single_flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_coalesced_requests_dont_share_cookies(async_rf):
+    release_response = asyncio.Event()
+    sent = 0
+
+    async def slow_request(*args, **kwargs):
+        nonlocal sent
+        sent += 1
+        bucket = sent
+        await release_response.wait()
+        response = MagicMock(status=200, headers={"Set-Cookie": f"bucket={bucket}; Path=/"})
+        response.read = AsyncMock(return_value=b"<html></html>")
+        return response
+
+    with (
+        patch("django_nextjs.render.COALESCE_REQUESTS", True),
+        patch("aiohttp.ClientSession.request", side_effect=slow_request),
+    ):
+        view = nextjs_page()
+        tasks = [asyncio.create_task(view(async_rf.get("/page"))) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert sent == 1
+        release_response.set()
+
+        responses = await asyncio.gather(*tasks)
+        # The other requests are sent again, so each client gets its own cookie
+        assert sent == 3
+        assert sorted(response.cookies["bucket"].value for response in responses) == ["1", "2", "3"]
+
+
+async def wait_for_refresh():
+    while len(single_flight):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_stale_page_is_served_and_refreshed_in_background(async_rf):
+    cache = MemoryCache(max_bytes=1024 * 1024)
+    stale_page = CachedPage(b"<html>stale</html>", 200, {}, time.time() - 10, time.time() + 60)
+    await cache.set(get_cache_key(async_rf.get("/page")), stale_page)
+    release_response = asyncio.Event()
+
+    async def slow_request(*args, **kwargs):
+        await release_response.wait()
+        response = MagicMock(status=200, headers={"Cache-Control": "s-maxage=60"})
+        response.read = AsyncMock(return_value=b"<html>fresh</html>")
+        return response
+
+    with (
+        patch("django_nextjs.render.page_cache", cache),
+        patch("aiohttp.ClientSession.request", side_effect=slow_request) as mock_request,
+    ):
+        for _ in range(3):
+            http_response = await nextjs_page()(async_rf.get("/page"))
+            assert http_response.content == b"<html>stale</html>"
+
+        release_response.set()
+        await wait_for_refresh()
+        assert mock_request.call_count == 1
+
+        http_response = await nextjs_page()(async_rf.get("/page"))
+        assert http_response.content == b"<html>fresh</html>"
+        assert mock_request.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_page_is_kept_when_refresh_fails(async_rf):
+    cache = MemoryCache(max_bytes=1024 * 1024)
+    stale_page = CachedPage(b"<html>stale</html>", 200, {}, time.time() - 10, time.time() + 60)
+    await cache.set(get_cache_key(async_rf.get("/page")), stale_page)
+
+    with (
+        patch("django_nextjs.render.page_cache", cache),
+        patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request,
+    ):
+        mock_request.side_effect = aiohttp.ServerDisconnectedError()
+        for _ in range(2):
+            http_response = await nextjs_page()(async_rf.get("/page"))
+            assert http_response.status_code == 200
+            assert http_response.content == b"<html>stale</html>"
+            await wait_for_refresh()
+        assert mock_request.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_view_stale_while_revalidate(async_rf):
+    cache = MemoryCache(max_bytes=1024 * 1024)
+
+    with (
+        patch("django_nextjs.render.page_cache", cache),
+        patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request,
+    ):
+        mock_request.return_value = MagicMock(status=200, headers={"Cache-Control": "s-maxage=10"})
+        mock_request.return_value.read = AsyncMock(return_value=b"<html></html>")
+        await nextjs_page(stale_while_revalidate=30)(async_rf.get("/page"))
+
+    cached_page = await cache.get(get_cache_key(async_rf.get("/page")))
+    assert cached_page.stale_until - cached_page.expires == pytest.approx(30)
@@ -0,0 +1,146 @@
+import asyncio
+import gzip
+import threading
+import zlib
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiohttp
+import pytest
+from django.test import AsyncRequestFactory
+
+from django_nextjs.asgi import NextJsMiddleware
+from django_nextjs.compression import compress, compress_stream, get_response_encoding
+from django_nextjs.views import nextjs_page
+
+NEXTJS_RESPONSE = (
+    b"""<html><head><link/></head><body id="__django_nextjs_body"><div id="__django_nextjs_body_begin"/>"""
+    + b"<main>"
+    + b"content " * 100
+    + b"</main>"
+    + b"""<div id="__django_nextjs_body_end"/></body></html>"""
+)
+
+
+@pytest.fixture
+def compress_responses():
+    with patch("django_nextjs.render.COMPRESS_RESPONSES", True):
+        yield
+
+
+def mock_session(request, headers=None):
+    content = aiohttp.StreamReader(MagicMock(), 2**16, loop=asyncio.get_running_loop())
+    content.feed_data(NEXTJS_RESPONSE)
+    content.feed_eof()
+    nextjs_response = MagicMock(status=200, headers={"Content-Type": "text/html; charset=utf-8", **(headers or {})})
+    nextjs_response.read = AsyncMock(return_value=NEXTJS_RESPONSE)
+    nextjs_response.content = content
+    session = MagicMock(closed=False, request=AsyncMock(return_value=nextjs_response))
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: session}
+    return session
+
+
+def test_get_response_encoding():
+    assert get_response_encoding("gzip, deflate", "text/html; charset=utf-8") == "gzip"
+    assert get_response_encoding("gzip;q=0, deflate", "text/html") is None
+    assert get_response_encoding("*", "text/x-component") == "gzip"
+    assert get_response_encoding("*, gzip;q=0", "text/html") is None
+    assert get_response_encoding("gzip", "image/png") is None
+    assert get_response_encoding("", "text/html") is None
+
+
+@pytest.mark.asyncio
+async def test_compress_stream_flushes_each_chunk():
+    async def chunks():
+        yield b"<html><head>"
+        yield b"<body>"
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    decoded = [decompressor.decompress(chunk) async for chunk in compress_stream(chunks(), "gzip")]
+    # Each chunk can be decoded as soon as it's received
+    assert decoded == [b"<html><head>", b"<body>", b""]
+
+
+@pytest.mark.asyncio
+async def test_render_compresses_response(async_rf: AsyncRequestFactory, compress_responses):
+    request = async_rf.get("/random/path", headers={"Accept-Encoding": "gzip, deflate"})
+    session = mock_session(request)
+
+    http_response = await nextjs_page(template_name="custom_document.html")(request)
+
+    assert http_response["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in http_response["Vary"]
+    assert b"content content" in gzip.decompress(http_response.content)
+    # Next.js doesn't need to compress the document, which is decoded to apply the template
+    assert session.request.call_args.kwargs["headers"]["Accept-Encoding"] == "identity"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("threaded_compression_min_bytes", [0, 1024 * 1024])
+async def test_render_compresses_large_response_in_thread(
+    async_rf: AsyncRequestFactory, compress_responses, threaded_compression_min_bytes: int
+):
+    request = async_rf.get("/random/path", headers={"Accept-Encoding": "gzip"})
+    mock_session(request)
+    threads = []
+
+    def compress_in_thread(content, encoding):
+        threads.append(threading.get_ident())
+        return compress(content, encoding)
+
+    with (
+        patch("django_nextjs.render.THREADED_COMPRESSION_MIN_BYTES", threaded_compression_min_bytes),
+        patch("django_nextjs.render.compress", compress_in_thread),
+    ):
+        http_response = await nextjs_page()(request)
+
+    assert gzip.decompress(http_response.content) == NEXTJS_RESPONSE
+    assert (threads[0] != threading.get_ident()) == (len(NEXTJS_RESPONSE) >= threaded_compression_min_bytes)
+
+
+@pytest.mark.asyncio
+async def test_render_does_not_compress_without_setting(async_rf: AsyncRequestFactory):
+    request = async_rf.get("/random/path", headers={"Accept-Encoding": "gzip"})
+    mock_session(request)
+
+    http_response = await nextjs_page()(request)
+
+    assert "Content-Encoding" not in http_response
+    assert http_response.content == NEXTJS_RESPONSE
+
+
+@pytest.mark.asyncio
+async def test_stream_compresses_templated_response(async_rf: AsyncRequestFactory, compress_responses):
+    request = async_rf.get("/random/path", headers={"Accept-Encoding": "gzip"})
+    session = mock_session(request)
+
+    http_response = await nextjs_page(stream=True, template_name="custom_document.html")(request)
+    content = b"".join([chunk async for chunk in http_response.streaming_content])
+
+    assert http_response["Content-Encoding"] == "gzip"
+    assert b"content content" in gzip.decompress(content)
+    assert session.request.call_args.kwargs["headers"]["Accept-Encoding"] == "identity"
+
+
+@pytest.mark.asyncio
+async def test_stream_passes_compressed_response_through(async_rf: AsyncRequestFactory, compress_responses):
+    request = async_rf.get("/random/path", headers={"Accept-Encoding": "br, gzip"})
+    # The content is opaque to the stream, so it's passed through as it is.
+    session = mock_session(request, headers={"Content-Encoding": "br"})
+
+    http_response = await nextjs_page(stream=True)(request)
+    content = b"".join([chunk async for chunk in http_response.streaming_content])
+
+    assert http_response["Content-Encoding"] == "br"
+    assert content == NEXTJS_RESPONSE
+    assert session.request.call_args.kwargs["auto_decompress"] is False
+    assert session.request.call_args.kwargs["headers"]["Accept-Encoding"] == "br, gzip"
+
+
+@pytest.mark.asyncio
+async def test_stream_passes_only_accepted_encodings(async_rf: AsyncRequestFactory, compress_responses):
+    request = async_rf.get("/random/path")
+    session = mock_session(request)
+
+    await nextjs_page(stream=True)(request)
+
+    assert session.request.call_args.kwargs["headers"]["Accept-Encoding"] == "identity"
@@ -0,0 +1,158 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiohttp
+import pytest
+from django.test import AsyncRequestFactory
+
+from django_nextjs.asgi import NextJsMiddleware
+from django_nextjs.cache import LRUCache, MemoryCache
+from django_nextjs.early_hints import get_early_hints, get_preload_links
+from django_nextjs.views import nextjs_page
+
+NEXTJS_HEAD = (
+    b'<meta charSet="utf-8"/>'
+    b'<link rel="stylesheet" href="/_next/static/css/app.css" data-precedence="next"/>'
+    b'<link rel="preload" as="script" fetchPriority="low" href="/_next/static/chunks/webpack.js"/>'
+    b'<link rel="preload" href="/_next/static/media/font.woff2" as="font" crossorigin="" type="font/woff2"/>'
+    b'<link rel="preload" as="image" imageSrcSet="/_next/image?url=a.png&amp;w=640 640w"/>'
+    b'<link rel="icon" href="/favicon.ico"/>'
+    b'<link rel="stylesheet" href="https://cdn.example.com/external.css"/>'
+    b'<script src="/_next/static/chunks/main-app.js?v=1&amp;x=2" async=""></script>'
+    b'<script src="/_next/static/chunks/polyfills.js" noModule=""></script>'
+    b'<script src="/_next/static/chunks/webpack.js" async=""></script>'
+    b"<script>inline()</script>"
+)
+NEXTJS_RESPONSE = (
+    b"<!DOCTYPE html><html><head>"
+    + NEXTJS_HEAD
+    + b"""</head><body id="__django_nextjs_body"><div id="__django_nextjs_body_begin"/>"""
+    + b"""<main>content</main><div id="__django_nextjs_body_end"/></body></html>"""
+)
+PRELOAD_LINKS = [
+    b"</_next/static/css/app.css>; rel=preload; as=style",
+    b"</_next/static/chunks/webpack.js>; rel=preload; as=script",
+    b"</_next/static/media/font.woff2>; rel=preload; as=font; crossorigin",
+    b"</_next/static/chunks/main-app.js?v=1&x=2>; rel=preload; as=script",
+]
+
+
+@pytest.fixture
+def early_hints():
+    with (
+        patch("django_nextjs.early_hints.early_hints_cache", LRUCache(10)) as early_hints_cache,
+        patch("django_nextjs.render.EARLY_HINTS", True),
+        patch("django_nextjs.asgi.EARLY_HINTS", True),
+    ):
+        yield early_hints_cache
+
+
+def mock_session(request, status=200, content_type="text/html; charset=utf-8", headers=None, document=NEXTJS_RESPONSE):
+    content = aiohttp.StreamReader(MagicMock(), 2**16, loop=asyncio.get_running_loop())
+    content.feed_data(document)
+    content.feed_eof()
+    nextjs_response = MagicMock(status=status, headers={"Content-Type": content_type, **(headers or {})})
+    nextjs_response.read = AsyncMock(return_value=document)
+    nextjs_response.content = content
+    request.scope["state"] = {
+        NextJsMiddleware.HTTP_SESSION_KEY: MagicMock(closed=False, request=AsyncMock(return_value=nextjs_response))
+    }
+
+
+async def call_middleware(path, headers=(), extensions=None):
+    messages = []
+    inner_app = AsyncMock()
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": b"",
+        "headers": list(headers),
+        "extensions": {"http.response.early_hint": {}} if extensions is None else extensions,
+    }
+    await NextJsMiddleware(inner_app)(scope, AsyncMock(), AsyncMock(side_effect=messages.append))
+    inner_app.assert_called_once()
+    return messages
+
+
+def test_get_preload_links():
+    assert get_preload_links(NEXTJS_HEAD) == PRELOAD_LINKS
+    assert get_preload_links(b"<title>No assets</title>") == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_rendered_page_sends_early_hints(async_rf: AsyncRequestFactory, early_hints, stream: bool):
+    assert await call_middleware("/page") == []
+
+    request = async_rf.get("/page")
+    mock_session(request)
+    http_response = await nextjs_page(stream=stream)(request)
+    if stream:
+        assert b"".join([chunk async for chunk in http_response.streaming_content]) == NEXTJS_RESPONSE
+
+    assert get_early_hints("/page") == PRELOAD_LINKS
+    assert await call_middleware("/page") == [{"type": "http.response.early_hint", "links": PRELOAD_LINKS}]
+    # The server doesn't support early hints
+    assert await call_middleware("/page", extensions={}) == []
+    # Client-side navigations don't need the assets of the document
+    assert await call_middleware("/page", headers=[(b"rsc", b"1")]) == []
+
+
+@pytest.mark.asyncio
+async def test_early_hints_are_forgotten(async_rf: AsyncRequestFactory, early_hints):
+    request = async_rf.get("/page")
+    mock_session(request)
+    await nextjs_page()(request)
+    assert get_early_hints("/page") == PRELOAD_LINKS
+
+    # The RSC payload of the page doesn't change its early hints
+    request = async_rf.get("/page", headers={"Rsc": "1"})
+    mock_session(request, content_type="text/x-component")
+    await nextjs_page()(request)
+    assert get_early_hints("/page") == PRELOAD_LINKS
+
+    request = async_rf.get("/page")
+    mock_session(request, status=404)
+    await nextjs_page()(request)
+    assert get_early_hints("/page") is None
+
+
+@pytest.mark.asyncio
+async def test_early_hints_arent_learned_from_cached_pages(async_rf: AsyncRequestFactory, early_hints):
+    with (
+        patch("django_nextjs.render.page_cache", MemoryCache(max_bytes=1024 * 1024)),
+        patch("django_nextjs.early_hints.get_preload_links", wraps=get_preload_links) as mock_get_preload_links,
+    ):
+        for _ in range(3):
+            request = async_rf.get("/page")
+            mock_session(request, headers={"Cache-Control": "s-maxage=60"})
+            await nextjs_page()(request)
+        assert get_early_hints("/page") == PRELOAD_LINKS
+        assert mock_get_preload_links.call_count == 1
+
+        # The early hints are learned again from the cached page if they have been evicted.
+        early_hints.delete("/page")
+        request = async_rf.get("/page")
+        mock_session(request, headers={"Cache-Control": "s-maxage=60"})
+        await nextjs_page()(request)
+        assert get_early_hints("/page") == PRELOAD_LINKS
+        assert mock_get_preload_links.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_early_hints_are_learned_when_cached_shell_changes(async_rf: AsyncRequestFactory, early_hints):
+    view = nextjs_page(stream=True, cache_shell=True)
+    new_document = NEXTJS_RESPONSE.replace(b"app.css", b"new.css")
+
+    with (
+        patch("django_nextjs.render.shell_cache", LRUCache(10)),
+        patch("django_nextjs.early_hints.get_preload_links", wraps=get_preload_links) as mock_get_preload_links,
+    ):
+        for document in [NEXTJS_RESPONSE, NEXTJS_RESPONSE, NEXTJS_RESPONSE, new_document]:
+            request = async_rf.get("/page")
+            mock_session(request, document=document)
+            http_response = await view(request)
+            b"".join([chunk async for chunk in http_response.streaming_content])
+        assert mock_get_preload_links.call_count == 2
+        assert get_early_hints("/page") == [link.replace(b"app.css", b"new.css") for link in PRELOAD_LINKS]
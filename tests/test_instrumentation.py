@@ -0,0 +1,130 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiohttp
+import pytest
+from django.test import AsyncRequestFactory
+
+from django_nextjs.asgi import NextJsMiddleware
+from django_nextjs.render import _get_meta_keys
+from django_nextjs.signals import nextjs_request_finished
+from django_nextjs.views import nextjs_page
+
+NEXTJS_RESPONSE = (
+    b"""<html><head><link/></head><body id="__django_nextjs_body"><div id="__django_nextjs_body_begin"/>"""
+    b"""<div id="__django_nextjs_body_end"/></body></html>"""
+)
+
+
+@pytest.fixture
+def finished_requests():
+    received = []
+
+    def receiver(sender, timings, request, **kwargs):
+        received.append((sender, timings, request))
+
+    nextjs_request_finished.connect(receiver)
+    yield received
+    nextjs_request_finished.disconnect(receiver)
+
+
+def mock_session(**kwargs):
+    session = MagicMock(closed=False, request=AsyncMock(**kwargs))
+    session.request.return_value = MagicMock(status=200, headers={})
+    session.request.return_value.read = AsyncMock(return_value=NEXTJS_RESPONSE)
+    session.request.return_value.content.total_bytes = len(NEXTJS_RESPONSE)
+    return session
+
+
+@pytest.mark.asyncio
+async def test_render_sends_request_finished_signal(async_rf: AsyncRequestFactory, finished_requests):
+    request = async_rf.get("/random/path")
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: mock_session()}
+
+    await nextjs_page(template_name="custom_document.html")(request)
+
+    [(sender, timings, sent_request)] = finished_requests
+    assert sender == "render" and sent_request is request
+    assert timings.method == "GET" and timings.path == "/random/path"
+    assert timings.status == 200
+    assert timings.bytes_received == len(NEXTJS_RESPONSE)
+    assert timings.upstream_url is not None
+    assert timings.ttfb is not None and timings.upstream_total is not None
+    assert timings.template_render is not None
+    assert timings.total >= timings.upstream_total
+    assert timings.error is None
+
+
+@pytest.mark.asyncio
+async def test_stream_sends_request_finished_signal_after_body(async_rf: AsyncRequestFactory, finished_requests):
+    content = aiohttp.StreamReader(MagicMock(), 2**16, loop=asyncio.get_running_loop())
+    content.feed_data(NEXTJS_RESPONSE)
+    content.feed_eof()
+
+    request = async_rf.get("/random/path")
+    session = mock_session()
+    session.request.return_value.content = content
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: session}
+
+    http_response = await nextjs_page(stream=True)(request)
+    assert finished_requests == []
+    assert b"".join([chunk async for chunk in http_response.streaming_content]) == NEXTJS_RESPONSE
+
+    [(sender, timings, _)] = finished_requests
+    assert sender == "stream"
+    assert timings.template_render is None and timings.error is None
+
+
+@pytest.mark.asyncio
+async def test_failed_request_sends_request_finished_signal(async_rf: AsyncRequestFactory, finished_requests):
+    request = async_rf.get("/random/path")
+    request.scope["state"] = {
+        NextJsMiddleware.HTTP_SESSION_KEY: mock_session(side_effect=aiohttp.ServerDisconnectedError())
+    }
+
+    http_response = await nextjs_page()(request)
+
+    assert http_response.status_code == 503
+
+    [(_, timings, _)] = finished_requests
+    assert isinstance(timings.error, aiohttp.ServerDisconnectedError)
+    assert timings.status is None and timings.total is not None
+
+
+@pytest.mark.asyncio
+async def test_server_timing_header(async_rf: AsyncRequestFactory):
+    request = async_rf.get("/random/path")
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: mock_session()}
+
+    with patch("django_nextjs.render.SERVER_TIMING", True):
+        http_response = await nextjs_page(template_name="custom_document.html")(request)
+
+    metrics = [metric.split(";")[0] for metric in http_response.headers["Server-Timing"].split(", ")]
+    assert metrics == ["nextjs-ttfb", "nextjs-template", "nextjs-total"]
+
+
+@pytest.mark.asyncio
+async def test_server_timing_header_is_disabled_by_default(async_rf: AsyncRequestFactory):
+    request = async_rf.get("/random/path")
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: mock_session()}
+
+    http_response = await nextjs_page()(request)
+
+    assert "Server-Timing" not in http_response.headers
+
+
+@pytest.mark.asyncio
+async def test_trace_headers_are_forwarded(async_rf: AsyncRequestFactory):
+    traceparent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+    request = async_rf.get("/random/path", headers={"traceparent": traceparent, "X-Request-ID": "42"})
+    session = mock_session()
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: session}
+
+    trace_headers = _get_meta_keys(["traceparent", "tracestate", "X-Request-ID"])
+    with patch.dict("django_nextjs.render.NEXTJS_REQUEST_HEADERS", trace_headers):
+        await nextjs_page()(request)
+
+    args, kwargs = session.request.call_args
+    assert kwargs["headers"]["traceparent"] == traceparent
+    assert kwargs["headers"]["X-Request-ID"] == "42"
+    assert "tracestate" not in kwargs["headers"]
@@ -0,0 +1,114 @@
+import asyncio
+from io import StringIO
+from unittest.mock import AsyncMock, patch
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from django.core.management import CommandError, call_command
+
+from django_nextjs.cache import MemoryCache
+from django_nextjs.prefetch import PrefetchResult, build_request, prefetch_nextjs_pages
+from django_nextjs.upstreams import UpstreamPool
+
+DOCUMENT = (
+    """<html><head><link/></head><body id="__django_nextjs_body"><div id="__django_nextjs_body_begin"/>"""
+    """<main>{path}</main><div id="__django_nextjs_body_end"/></body></html>"""
+)
+
+
+@pytest_asyncio.fixture
+async def nextjs_pages():
+    """
+    Run a fake Next.js server which renders each page slowly, and return the maximum number of concurrent requests.
+    """
+    concurrency = {"current": 0, "max": 0}
+
+    async def handler(request: web.Request):
+        concurrency["current"] += 1
+        concurrency["max"] = max(concurrency["max"], concurrency["current"])
+        await asyncio.sleep(0.01)
+        concurrency["current"] -= 1
+        if request.path == "/missing":
+            return web.Response(status=404, text="Not found", content_type="text/html")
+        cache_control = "s-maxage=60" if request.path.startswith("/cacheable") else "private, no-store"
+        return web.Response(
+            text=DOCUMENT.format(path=request.path_qs),
+            content_type="text/html",
+            headers={"Cache-Control": cache_control},
+        )
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", handler)
+    page_cache = MemoryCache(1024 * 1024)
+    async with TestServer(app) as server:
+        with (
+            patch("django_nextjs.render.upstreams", UpstreamPool([str(server.make_url(""))])),
+            patch("django_nextjs.render.page_cache", page_cache),
+            patch("django_nextjs.prefetch.page_cache", page_cache),
+        ):
+            yield concurrency
+
+
+def test_build_request(settings):
+    settings.ALLOWED_HOSTS = ["example.com"]
+    request = build_request("/blog/post?tab=comments&page=2", host="example.com")
+    assert request.path == request.path_info == "/blog/post"
+    assert request.GET.dict() == {"tab": "comments", "page": "2"}
+    assert request.get_host() == "example.com"
+
+
+@pytest.mark.asyncio
+async def test_prefetch_nextjs_pages(nextjs_pages, tmp_path):
+    paths = [f"/cacheable/{i}" for i in range(10)] + ["/private", "/missing", "/../outside", "/cacheable/0?page=2"]
+
+    results = await prefetch_nextjs_pages(
+        paths, template_name="custom_document.html", output_dir=str(tmp_path), concurrency=3
+    )
+
+    assert nextjs_pages["max"] == 3
+    assert [result.path for result in results] == paths
+    assert all(result.status == 200 and result.cached for result in results[:10])
+    assert (tmp_path / "cacheable" / "0" / "index.html").read_text().count("before_head") == 1
+
+    private, missing, outside, query = results[10:]
+    assert (private.status, private.cached, private.error) == (200, False, None)
+    assert "<main>/private</main>" in (tmp_path / "private" / "index.html").read_text()
+    assert (missing.status, missing.file, missing.error) == (404, None, None)
+    assert outside.error is not None
+    assert not (tmp_path.parent / "outside").exists()
+    # The page with a query string would overwrite the file of the page without it, so it isn't fetched.
+    assert (query.status, query.cached, query.file) == (None, False, None)
+    assert isinstance(query.error, ValueError)
+    assert "<main>/cacheable/0</main>" in (tmp_path / "cacheable" / "0" / "index.html").read_text()
+
+
+@pytest.mark.asyncio
+async def test_prefetch_nextjs_pages_with_query_string(nextjs_pages):
+    results = await prefetch_nextjs_pages(["/cacheable/0?page=2"])
+
+    assert (results[0].status, results[0].cached, results[0].error) == (200, True, None)
+
+
+def test_prefetch_command(tmp_path):
+    paths_file = tmp_path / "paths.txt"
+    paths_file.write_text("# Popular pages\n/about\n\n/missing\n")
+    results = [PrefetchResult("/", 200, True, None, None), PrefetchResult("/about", 200, False, "about.html", None)]
+    stdout, stderr = StringIO(), StringIO()
+
+    with patch(
+        "django_nextjs.management.commands.nextjs_prefetch.prefetch_nextjs_pages", AsyncMock(return_value=results)
+    ) as prefetch:
+        call_command("nextjs_prefetch", "/", paths_file=str(paths_file), concurrency=2, stdout=stdout, stderr=stderr)
+    assert prefetch.call_args.args == (["/", "/about", "/missing"],)
+    assert prefetch.call_args.kwargs["concurrency"] == 2
+    assert stdout.getvalue() == "200 / (cached)\n200 /about (about.html)\n"
+
+    results.append(PrefetchResult("/missing", 404, False, None, None))
+    with patch(
+        "django_nextjs.management.commands.nextjs_prefetch.prefetch_nextjs_pages", AsyncMock(return_value=results)
+    ):
+        with pytest.raises(CommandError, match="1 of 3 pages"):
+            call_command("nextjs_prefetch", "/", stdout=stdout, stderr=stderr)
+    assert stderr.getvalue() == "404 /missing\n"
@@ -1,12 +1,33 @@
+import asyncio
+import pickle
+import tracemalloc
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import aiohttp
 import pytest
-from django.test import RequestFactory
+from asgiref.sync import sync_to_async
+from django.template.loader import render_to_string
+from django.test import AsyncRequestFactory, RequestFactory
+from django.utils.asyncio import async_unsafe
 from django.utils.datastructures import MultiValueDict
+from django.utils.functional import SimpleLazyObject
+from multidict import CIMultiDict, CIMultiDictProxy
 
 from django_nextjs.app_settings import NEXTJS_SERVER_URL
-from django_nextjs.render import _get_render_context, render_nextjs_page_to_string
-from django_nextjs.views import nextjs_page
+from django_nextjs.asgi import NextJsMiddleware
+from django_nextjs.cache import LRUCache
+from django_nextjs.render import (
+    _compose_nextjs_stream,
+    _get_meta_keys,
+    _get_render_context,
+    _join_template_fragments,
+    _render_template_fragments,
+    _split_document,
+    render_nextjs_page_to_string,
+    render_nextjs_page_to_string_sync,
+)
+from django_nextjs.session import _loop_sessions, background_loop
+from django_nextjs.views import nextjs_page, nextjs_page_sync
 
 
 def test_get_render_context_empty_html():
@@ -50,52 +71,95 @@ async def test_nextjs_page(rf: RequestFactory):
     request = rf.get(f"/{path}", data=params)
     nextjs_response = "<html><head></head><body></body></html>"
 
-    with patch("aiohttp.ClientSession") as mock_session:
-        with patch("aiohttp.ClientSession.get") as mock_get:
-            mock_get.return_value.__aenter__.return_value.text = AsyncMock(return_value=nextjs_response)
-            mock_get.return_value.__aenter__.return_value.status = 200
-            mock_get.return_value.__aenter__.return_value.headers = {"Location": "target_value", "unimportant": ""}
-            mock_session.return_value.__aenter__ = AsyncMock(return_value=MagicMock(get=mock_get))
+    with patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request:
+        mock_request.return_value = MagicMock()
+        mock_request.return_value.read = AsyncMock(return_value=nextjs_response.encode())
+        mock_request.return_value.status = 200
+        mock_request.return_value.headers = {"Location": "target_value", "unimportant": ""}
 
-            http_response = await nextjs_page(allow_redirects=True, headers={"extra": "headers"})(request)
+        http_response = await nextjs_page(allow_redirects=True, headers={"extra": "headers"})(request)
 
-            assert http_response.content == nextjs_response.encode()
-            assert http_response.status_code == 200
-            assert http_response.has_header("Location")
-            assert http_response.has_header("unimportant") is False
+        assert http_response.content == nextjs_response.encode()
+        assert http_response.status_code == 200
+        assert http_response.has_header("Location")
+        assert http_response.has_header("unimportant") is False
 
-            # Arguments passed to aiohttp.ClientSession.get
-            args, kwargs = mock_get.call_args
-            url = args[0]
-            assert url == f"{NEXTJS_SERVER_URL}/{path}"
-            assert [(k, v) for k in params.keys() for v in params.getlist(k)] == kwargs["params"]
-            assert kwargs["allow_redirects"] is True
-
-        args, kwargs = mock_session.call_args
+        # Arguments passed to aiohttp.ClientSession.request
+        args, kwargs = mock_request.call_args
+        method, url = args
+        assert method == "GET"
+        assert url == f"{NEXTJS_SERVER_URL}/{path}"
+        assert [(k, v) for k in params.keys() for v in params.getlist(k)] == kwargs["params"]
+        assert kwargs["allow_redirects"] is True
         assert "csrftoken" in kwargs["cookies"]
         assert kwargs["headers"]["user-agent"] == ""
         assert kwargs["headers"]["x-real-ip"] == "127.0.0.1"
         assert kwargs["headers"]["extra"] == "headers"
 
 
+@pytest.mark.asyncio
+async def test_nextjs_page_keeps_repeated_response_headers(rf: RequestFactory):
+    request = rf.get("/random/path", headers={"X-Tenant": "acme", "X-Unknown": "1"})
+    nextjs_headers = CIMultiDict(
+        [
+            ("Content-Type", "text/html"),
+            ("link", "</a.css>; rel=preload; as=style"),
+            ("Link", "</b.js>; rel=preload; as=script"),
+            ("Set-Cookie", "NEXT_LOCALE=en; Path=/; SameSite=Lax"),
+            ("Set-Cookie", "hint=1; Path=/a; HttpOnly"),
+            ("Set-Cookie", "hint=2; Path=/b; Partitioned"),
+            ("X-Powered-By", "Next.js"),
+        ]
+    )
+
+    with (
+        patch.dict("django_nextjs.render.NEXTJS_REQUEST_HEADERS", _get_meta_keys(["X-Tenant"])),
+        patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request,
+    ):
+        mock_request.return_value = MagicMock(status=200, headers=CIMultiDictProxy(nextjs_headers))
+        mock_request.return_value.read = AsyncMock(return_value=b"<html></html>")
+        http_response = await nextjs_page()(request)
+
+    args, kwargs = mock_request.call_args
+    assert kwargs["headers"]["X-Tenant"] == "acme"
+    assert "X-Unknown" not in kwargs["headers"]
+
+    assert http_response["Link"] == "</a.css>; rel=preload; as=style, </b.js>; rel=preload; as=script"
+    assert "X-Powered-By" not in http_response
+    set_cookie_headers = [
+        "Set-Cookie: NEXT_LOCALE=en; Path=/; SameSite=Lax",
+        "Set-Cookie: hint=1; Path=/a; HttpOnly",
+        "Set-Cookie: hint=2; Path=/b; Partitioned",
+    ]
+    assert [cookie.output() for cookie in http_response.cookies.values()] == set_cookie_headers
+    assert http_response.cookies["NEXT_LOCALE"].value == "en"
+    # The cookies are kept when the response is pickled (e.g. by the cache middleware)
+    assert [cookie.output() for cookie in pickle.loads(pickle.dumps(http_response)).cookies.values()] == (
+        set_cookie_headers
+    )
+
+    # A cookie set by Django replaces the one set by Next.js
+    http_response.set_cookie("NEXT_LOCALE", "fr")
+    assert http_response.cookies["NEXT_LOCALE"].output() == "Set-Cookie: NEXT_LOCALE=fr; Path=/"
+
+
 @pytest.mark.asyncio
 async def test_set_csrftoken(rf: RequestFactory):
-    def get_mock_request():
-        return rf.get("/random/path")
+    def get_mock_request(cookie=None):
+        return rf.get("/random/path", headers={"Cookie": cookie} if cookie else {})
 
     async def get_mock_response(request: RequestFactory):
-        with patch("aiohttp.ClientSession") as mock_session:
-            with patch("aiohttp.ClientSession.get") as mock_get:
-                mock_get.return_value.__aenter__.return_value.text = AsyncMock(return_value="<html></html>")
-                mock_get.return_value.__aenter__.return_value.status = 200
-                mock_session.return_value.__aenter__ = AsyncMock(return_value=MagicMock(get=mock_get))
-                return await nextjs_page(allow_redirects=True)(request), mock_session
+        with patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request:
+            mock_request.return_value = MagicMock()
+            mock_request.return_value.read = AsyncMock(return_value=b"<html></html>")
+            mock_request.return_value.status = 200
+            return await nextjs_page(allow_redirects=True)(request), mock_request
 
     # User does not have csrftoken and django-nextjs is not configured to guarantee one
     with patch("django_nextjs.render.ENSURE_CSRF_TOKEN", False):
         http_request = get_mock_request()
-        _, mock_session = await get_mock_response(http_request)
-        args, kwargs = mock_session.call_args
+        _, mock_request = await get_mock_response(http_request)
+        args, kwargs = mock_request.call_args
         # This triggers CsrfViewMiddleware to call response.set_cookie with updated csrftoken value
         assert "CSRF_COOKIE_NEEDS_UPDATE" not in http_request.META
         assert "csrftoken" not in kwargs["cookies"]
@@ -103,28 +167,30 @@ async def test_set_csrftoken(rf: RequestFactory):
     # User does not have csrftoken and django-nextjs is configured to guarantee one
     with patch("django_nextjs.render.ENSURE_CSRF_TOKEN", True):
         http_request = get_mock_request()
-        _, mock_session = await get_mock_response(http_request)
-        args, kwargs = mock_session.call_args
+        _, mock_request = await get_mock_response(http_request)
+        args, kwargs = mock_request.call_args
         assert "CSRF_COOKIE_NEEDS_UPDATE" in http_request.META
         assert "csrftoken" in kwargs["cookies"]
 
     # User has csrftoken and django-nextjs is not configured to guarantee one
     with patch("django_nextjs.render.ENSURE_CSRF_TOKEN", False):
-        http_request = get_mock_request()
-        http_request.COOKIES["csrftoken"] = "whatever"
-        _, mock_session = await get_mock_response(http_request)
-        args, kwargs = mock_session.call_args
+        http_request = get_mock_request(cookie="csrftoken=whatever")
+        _, mock_request = await get_mock_response(http_request)
+        args, kwargs = mock_request.call_args
         assert "CSRF_COOKIE_NEEDS_UPDATE" not in http_request.META
-        assert "csrftoken" in kwargs["cookies"]
+        # The cookies of the user are sent in the Cookie header
+        assert "csrftoken" not in kwargs["cookies"]
+        assert kwargs["headers"]["Cookie"] == "csrftoken=whatever"
 
     # User has csrftoken and django-nextjs is configured to guarantee one
     with patch("django_nextjs.render.ENSURE_CSRF_TOKEN", True):
-        http_request = get_mock_request()
-        http_request.COOKIES["csrftoken"] = "whatever"
-        _, mock_session = await get_mock_response(http_request)
-        args, kwargs = mock_session.call_args
+        http_request = get_mock_request(cookie="csrftoken=whatever")
+        _, mock_request = await get_mock_response(http_request)
+        args, kwargs = mock_request.call_args
         assert "CSRF_COOKIE_NEEDS_UPDATE" not in http_request.META
-        assert "csrftoken" in kwargs["cookies"]
+        # The cookies of the user are sent in the Cookie header
+        assert "csrftoken" not in kwargs["cookies"]
+        assert kwargs["headers"]["Cookie"] == "csrftoken=whatever"
 
 
 @pytest.mark.asyncio
@@ -132,11 +198,423 @@ async def test_render_nextjs_page_to_string(rf: RequestFactory):
     request = rf.get(f"/random/path")
     nextjs_response = """<html><head><link/></head><body id="__django_nextjs_body"><div id="__django_nextjs_body_begin"/><div id="__django_nextjs_body_end"/></body></html>"""
 
-    with patch("aiohttp.ClientSession") as mock_session:
-        with patch("aiohttp.ClientSession.get") as mock_get:
-            mock_get.return_value.__aenter__.return_value.text = AsyncMock(return_value=nextjs_response)
-            mock_session.return_value.__aenter__ = AsyncMock(return_value=MagicMock(get=mock_get))
+    with patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request:
+        mock_request.return_value = MagicMock()
+        mock_request.return_value.read = AsyncMock(return_value=nextjs_response.encode())
+
+        response_text = await render_nextjs_page_to_string(request, template_name="custom_document.html")
+        assert "before_head" in response_text
+        assert "after_head" in response_text
+
+
+@pytest.mark.asyncio
+async def test_render_nextjs_page_uses_lifespan_session(async_rf: AsyncRequestFactory):
+    request = async_rf.get("/random/path")
+    session = MagicMock(closed=False, request=AsyncMock(return_value=MagicMock()))
+    session.request.return_value.read = AsyncMock(return_value=b"<html></html>")
+    session.request.return_value.status = 200
+    session.request.return_value.headers = {}
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: session}
+
+    http_response = await nextjs_page()(request)
+
+    assert http_response.content == b"<html></html>"
+    args, kwargs = session.request.call_args
+    assert "csrftoken" in kwargs["cookies"]
+    assert kwargs["headers"]["x-real-ip"] == "127.0.0.1"
+
+
+async def iterate_chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+async def test_stream_nextjs_page_with_template(async_rf: AsyncRequestFactory, chunk_size: int):
+    nextjs_response = (
+        """<html><head><link/></head><body id="__django_nextjs_body"><div id="__django_nextjs_body_begin"/>"""
+        """<main>content</main><div id="__django_nextjs_body_end"/></body></html><script>late</script>"""
+    )
+    request = async_rf.get("/random/path")
+    nextjs_headers = {"Content-Type": "text/html; charset=utf-8"}
+    session = MagicMock(closed=False, request=AsyncMock(return_value=MagicMock(status=200, headers=nextjs_headers)))
+    session.request.return_value.content.iter_any = lambda: iterate_chunks(nextjs_response.encode(), chunk_size)
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: session}
+
+    # The chunks aren't coalesced, to test the markers which are split between chunks.
+    with patch("django_nextjs.render.iter_coalesced", lambda content: content.iter_any()):
+        http_response = await nextjs_page(stream=True, template_name="custom_document.html")(request)
+        content = b"".join([chunk async for chunk in http_response.streaming_content]).decode()
+
+    expected = render_to_string("custom_document.html", _get_render_context(nextjs_response), request)
+    assert content == expected
+    assert "before_head" in content and "<main>content</main>" in content
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "request_headers,content_type",
+    [({"Rsc": "1"}, "text/x-component"), ({}, "application/json"), ({"Rsc": "1"}, "text/html")],
+)
+async def test_stream_nextjs_page_with_template_passes_other_responses_through(
+    async_rf: AsyncRequestFactory, request_headers: dict, content_type: str
+):
+    request = async_rf.get("/random/path", headers=request_headers)
+    content = aiohttp.StreamReader(MagicMock(), 2**16, loop=asyncio.get_running_loop())
+    nextjs_response = MagicMock(status=200, headers={"Content-Type": content_type}, content=content)
+    session = MagicMock(closed=False, request=AsyncMock(return_value=nextjs_response))
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: session}
+
+    http_response = await nextjs_page(stream=True, template_name="custom_document.html")(request)
+    chunks = aiter(http_response.streaming_content)
+    # Each chunk is sent as it's received, without waiting for the rest of the response
+    for chunk in [b'0:["$","div"]\n', b'1:{"a":1}\n']:
+        content.feed_data(chunk)
+        assert await asyncio.wait_for(anext(chunks), 1) == chunk
+    content.feed_eof()
+    assert [chunk async for chunk in chunks] == []
+
+
+@pytest.mark.asyncio
+async def test_compose_nextjs_stream_without_markers():
+    document = b"<html><head></head><body>" + b"x" * 100 + b"</body></html>"
+    fragments = [f"[{i}]".encode() for i in range(6)]
+    composed = [chunk async for chunk in _compose_nextjs_stream(iterate_chunks(document, 10), fragments)]
+    assert b"".join(composed) == document
+
+
+def test_render_template_fragments(rf: RequestFactory):
+    fragments = _render_template_fragments("custom_document.html", None, rf.get("/"), None)
+    assert len(fragments) == 6
+    assert b"before_head" in fragments[1] and b"after_head" in fragments[2]
+
+    with patch("django_nextjs.render.render_to_string", lambda *args, **kwargs: "no sections"):
+        assert _render_template_fragments("custom_document.html", None, rf.get("/"), None) is None
+
+
+@pytest.mark.asyncio
+async def test_render_nextjs_page_to_string_with_template_cache_key(rf: RequestFactory):
+    nextjs_response = """<html><head><link/></head><body id="__django_nextjs_body"><div id="__django_nextjs_body_begin"/><div id="__django_nextjs_body_end"/></body></html>"""
+
+    with (
+        patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request,
+        patch("django_nextjs.render._render_template_fragments", wraps=_render_template_fragments) as mock_render,
+    ):
+        mock_request.return_value = MagicMock()
+        mock_request.return_value.read = AsyncMock(return_value=nextjs_response.encode())
+
+        for language in ["en", "en", "fa"]:
+            request = rf.get("/random/path", HTTP_ACCEPT_LANGUAGE=language)
+            response_text = await render_nextjs_page_to_string(
+                request,
+                template_name="custom_document.html",
+                template_cache_key=lambda request: request.headers["Accept-Language"],
+            )
+            assert response_text == render_to_string(
+                "custom_document.html", _get_render_context(nextjs_response), request
+            )
+        assert mock_render.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_template_cache_key_with_contexts(rf: RequestFactory):
+    document = make_document("<link/>", "<main/>")
+    contexts = [{"page_title": "Page A"}, {"page_title": "Page B"}, {"page_title": "Page C", "menu": []}]
+
+    with (
+        patch("django_nextjs.render.template_fragments_cache", LRUCache(10)) as template_fragments_cache,
+        patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request,
+    ):
+        mock_request.return_value = MagicMock(status=200, headers={"Content-Type": "text/html"})
+        mock_request.return_value.read = AsyncMock(return_value=document)
+
+        for context in contexts * 2:
+            view = nextjs_page(
+                template_name="custom_document.html", context=context, template_cache_key=lambda request: None
+            )
+            http_response = await view(rf.get("/random/path"))
+            # The views using the same template with different contexts don't share its output.
+            assert context["page_title"].encode() in http_response.content
+            assert http_response.content.count(b"Page") == 1
+        # The output of the template isn't cached for contexts which can't be hashed.
+        assert len(template_fragments_cache) == 2
+
+
+def test_bytes_pipeline_allocates_less_than_str_pipeline():
+    """
+    Benchmark: applying cached template fragments to the raw bytes of a large document (with an inline RSC payload)
+    allocates less memory than decoding it, slicing the string and encoding the result.
+    """
+    document = (
+        '<html><head><link rel="stylesheet"/></head><body id="__django_nextjs_body">'
+        '<div id="__django_nextjs_body_begin"/><main>'
+        + '<script>self.__next_f.push([1,"ØÆ"])</script>' * 10000
+        + '</main><div id="__django_nextjs_body_end"/></body></html>'
+    ).encode()
+    fragments = [f"<!--{i}-->".encode() for i in range(6)]
+
+    def str_pipeline():
+        sections = _get_render_context(document.decode())["django_nextjs__"]
+        parts = [fragments[0].decode()]
+        for name, fragment in zip(["section1", "section2", "section3", "section4", "section5"], fragments[1:]):
+            parts += (sections[name], fragment.decode())
+        return "".join(parts).encode()
+
+    def bytes_pipeline():
+        return _join_template_fragments(fragments, _split_document(document))
+
+    def peak_allocation(function):
+        tracemalloc.start()
+        try:
+            result = function()
+            return tracemalloc.get_traced_memory()[1], result
+        finally:
+            tracemalloc.stop()
+
+    str_peak, str_result = peak_allocation(str_pipeline)
+    bytes_peak, bytes_result = peak_allocation(bytes_pipeline)
+    assert bytes_result == str_result
+    assert bytes_peak < len(document) * 1.5
+    assert bytes_peak < str_peak / 2
+
+
+@pytest.mark.asyncio
+async def test_unavailable_response(async_rf: AsyncRequestFactory):
+    request = async_rf.get("/random/path")
+    session = MagicMock(closed=False, request=AsyncMock(side_effect=asyncio.TimeoutError()))
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: session}
+
+    http_response = await nextjs_page()(request)
+    assert http_response.status_code == 503
+    assert "Retry-After" in http_response.headers
+
+    with patch("django_nextjs.render.UNAVAILABLE_TEMPLATE", "unavailable.html"):
+        http_response = await nextjs_page(stream=True)(request)
+    assert http_response.status_code == 503
+    assert http_response.content == b"<html><body>/random/path is temporarily unavailable</body></html>\n"
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"stream": True, "context": {"a": 1}},
+        {"stream": True, "using": "django"},
+        {"stream": True, "stale_while_revalidate": 60},
+        {"cache_shell": True},
+    ],
+)
+def test_nextjs_page_rejects_options_without_effect(options):
+    with pytest.raises(ValueError):
+        nextjs_page(**options)
+
+
+def test_nextjs_page_sync(rf: RequestFactory):
+    nextjs_response = """<html><head><link/></head><body id="__django_nextjs_body"><div id="__django_nextjs_body_begin"/><div id="__django_nextjs_body_end"/></body></html>"""
+
+    with patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request:
+        mock_request.return_value = MagicMock(status=200, headers={"Content-Type": "text/html"})
+        mock_request.return_value.read = AsyncMock(return_value=nextjs_response.encode())
+
+        request = rf.get("/random/path?a=1")
+        http_response = nextjs_page_sync(template_name="custom_document.html")(request)
+
+    assert http_response.status_code == 200
+    assert http_response.content.decode() == render_to_string(
+        "custom_document.html", _get_render_context(nextjs_response), request
+    )
+    args, kwargs = mock_request.call_args
+    assert args == ("GET", f"{NEXTJS_SERVER_URL}/random/path")
+    assert kwargs["params"] == [("a", "1")]
+    assert "csrftoken" in kwargs["cookies"]
+
+
+def test_render_nextjs_page_to_string_sync_uses_background_loop(rf: RequestFactory):
+    with patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request:
+        mock_request.return_value = MagicMock(status=200, headers={})
+        mock_request.return_value.read = AsyncMock(return_value=b"<html></html>")
+
+        for _ in range(2):
+            assert render_nextjs_page_to_string_sync(rf.get("/random/path")) == "<html></html>"
+
+    # Both requests were sent with the long-lived session of the background loop
+    assert mock_request.call_count == 2
+    session = _loop_sessions.get(background_loop.loop)
+    assert session is not None and not session.closed
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_nextjs_page_forwards_server_actions(nextjs_server, async_rf: AsyncRequestFactory, stream: bool):
+    body = b'["a"]' * 50_000
+    request = async_rf.post(
+        "/random/path?a=1",
+        data=body,
+        content_type="text/plain;charset=UTF-8",
+        headers={"Next-Action": "0123abcd", "Accept": "text/x-component", "Origin": "http://testserver"},
+    )
+
+    http_response = await nextjs_page(stream=stream)(request)
+
+    content = b"".join([chunk async for chunk in http_response]) if stream else http_response.content
+    assert content == b"ok"
+    assert http_response["Content-Type"].startswith("text/x-component")
+    assert http_response["X-Action-Revalidated"] == "[[],0,0]"
+    [(method, path, received_body, headers)] = nextjs_server
+    assert (method, path, received_body) == ("POST", "/random/path?a=1", body)
+    assert headers["Next-Action"] == "0123abcd"
+    assert headers["Content-Type"] == "text/plain;charset=UTF-8"
+    assert headers["Origin"] == "http://testserver"
+    assert headers["X-Forwarded-Host"] == "testserver"
+
+
+@pytest.mark.asyncio
+async def test_nextjs_page_sync_forwards_methods(nextjs_server, rf: RequestFactory):
+    view = sync_to_async(nextjs_page_sync())
+
+    await view(rf.delete("/api/items/1"))
+    await view(rf.head("/random/path"))
+    request = rf.put("/api/items/1", data=b"{}", content_type="application/json")
+    request.body  # The body has already been read (e.g. by a middleware)
+    await view(request)
+
+    assert [received[:3] for received in nextjs_server] == [
+        ("DELETE", "/api/items/1", b""),
+        ("GET", "/random/path", b""),
+        ("PUT", "/api/items/1", b"{}"),
+    ]
+
+
+def make_document(head: str, body: str) -> bytes:
+    return (
+        f"""<html><head>{head}</head><body id="__django_nextjs_body"><div id="__django_nextjs_body_begin"/>"""
+        f"""{body}<div id="__django_nextjs_body_end"/></body></html>"""
+    ).encode()
+
+
+def mock_stream_session(request, document: bytes, status=200, upstream_ready=None):
+    """
+    Send the requests to Next.js to a mock session which responds with `document` (when `upstream_ready` is set).
+    """
+    content = aiohttp.StreamReader(MagicMock(), 2**16, loop=asyncio.get_running_loop())
+    content.feed_data(document)
+    content.feed_eof()
+    nextjs_response = MagicMock(
+        status=status,
+        headers={"Content-Type": "text/html; charset=utf-8", "Set-Cookie": "a=1", "Cache-Control": "private"},
+    )
+    nextjs_response.content = content
+
+    async def send_request(*args, **kwargs):
+        if upstream_ready is not None:
+            await upstream_ready.wait()
+        return nextjs_response
+
+    request.scope["state"] = {NextJsMiddleware.HTTP_SESSION_KEY: MagicMock(closed=False, request=send_request)}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("template_name", ["", "custom_document.html"])
+async def test_stream_nextjs_page_with_cached_shell(async_rf: AsyncRequestFactory, template_name: str):
+    view = nextjs_page(stream=True, template_name=template_name, cache_shell=True)
+    head = "<title>Page</title>"
+
+    with patch("django_nextjs.render.shell_cache", LRUCache(10)) as shell_cache:
+        request = async_rf.get("/random/path")
+        mock_stream_session(request, make_document(head, "<main>first</main>"))
+        http_response = await view(request)
+        first_content = b"".join([chunk async for chunk in http_response.streaming_content])
+        assert len(shell_cache) == 1
+
+        # The shell is sent before Next.js responds, then the body of its response follows.
+        upstream_ready = asyncio.Event()
+        request = async_rf.get("/random/path")
+        mock_stream_session(request, make_document(head, "<main>second</main>"), upstream_ready=upstream_ready)
+        http_response = await view(request)
+        assert http_response.status_code == 200
+        assert http_response["Cache-Control"] == "private"
+        assert "Set-Cookie" not in http_response
+        chunks = aiter(http_response.streaming_content)
+        shell = await asyncio.wait_for(anext(chunks), 1)
+        assert first_content.startswith(shell) and b"<title>Page</title>" in shell and b"<main>" not in shell
+        upstream_ready.set()
+        content = shell + b"".join([chunk async for chunk in chunks])
+        assert content == first_content.replace(b"first", b"second")
+
+        # A changed head is sent on the next request
+        request = async_rf.get("/random/path")
+        mock_stream_session(request, make_document("<title>New</title>", "<main>third</main>"))
+        http_response = await view(request)
+        assert b"<title>Page</title>" in b"".join([chunk async for chunk in http_response.streaming_content])
+        request = async_rf.get("/random/path")
+        mock_stream_session(request, make_document("<title>New</title>", "<main>third</main>"))
+        http_response = await view(request)
+        assert b"<title>New</title>" in b"".join([chunk async for chunk in http_response.streaming_content])
+
+        # The shell isn't used for RSC requests, and it's dropped when the page isn't found
+        request = async_rf.get("/random/path", headers={"Rsc": "1"})
+        mock_stream_session(request, b"0:rsc", upstream_ready=asyncio.Event())
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(view(request), 0.1)
+        request = async_rf.get("/random/path")
+        mock_stream_session(request, make_document(head, "<main>not found</main>"), status=404)
+        http_response = await view(request)
+        assert b"not found" in b"".join([chunk async for chunk in http_response.streaming_content])
+        assert len(shell_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_nextjs_page_with_cached_shell_and_contexts(async_rf: AsyncRequestFactory):
+    contexts = [{"page_title": "Page A"}, {"page_title": "Page B"}, {"page_title": "Page C", "menu": []}]
+
+    with patch("django_nextjs.render.shell_cache", LRUCache(10)) as shell_cache:
+        for context in contexts * 2:
+            view = nextjs_page(stream=True, template_name="custom_document.html", context=context, cache_shell=True)
+            request = async_rf.get("/random/path")
+            mock_stream_session(request, make_document("<title>Page</title>", "<main/>"))
+            http_response = await view(request)
+            content = b"".join([chunk async for chunk in http_response.streaming_content])
+            # The views using the same template with different contexts don't share their shell.
+            assert context["page_title"].encode() in content
+            assert content.count(b"Page ") == 1
+        # The shell isn't cached for contexts which can't be hashed.
+        assert len(shell_cache) == 2
+
+
+async def get_user_template_key(request):
+    return (await request.auser()).is_authenticated
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("template_cache_key", [lambda request: request.user.is_authenticated, get_user_template_key])
+async def test_template_cache_key_may_use_lazy_request_attributes(
+    async_rf: AsyncRequestFactory, stream: bool, template_cache_key
+):
+    view = nextjs_page(
+        stream=stream, template_name="custom_document.html", template_cache_key=template_cache_key, cache_shell=stream
+    )
+    # Like the attributes set by AuthenticationMiddleware, which query the database when they're used
+    get_user = async_unsafe(lambda: MagicMock(is_authenticated=False))
+
+    with (
+        patch("django_nextjs.render.template_fragments_cache", LRUCache(10)),
+        patch("django_nextjs.render.shell_cache", LRUCache(10)),
+        patch("aiohttp.ClientSession.request", new_callable=AsyncMock) as mock_request,
+    ):
+        mock_request.return_value = MagicMock(status=200, headers={"Content-Type": "text/html"})
+        mock_request.return_value.read = AsyncMock(return_value=make_document("<title>Page</title>", "<main/>"))
 
-            response_text = await render_nextjs_page_to_string(request, template_name="custom_document.html")
-            assert "before_head" in response_text
-            assert "after_head" in response_text
+        for _ in range(2):
+            request = async_rf.get("/random/path")
+            request.user = SimpleLazyObject(get_user)
+            request.auser = sync_to_async(get_user)
+            if stream:
+                mock_stream_session(request, make_document("<title>Page</title>", "<main/>"))
+            http_response = await view(request)
+            content = (
+                b"".join([chunk async for chunk in http_response.streaming_content])
+                if stream
+                else http_response.content
+            )
+            assert b"before_head" in content and b"<main/>" in content
@@ -0,0 +1,55 @@
+import asyncio
+from unittest.mock import patch
+
+import aiohttp
+import pytest
+
+from django_nextjs.session import _loop_sessions, background_loop, create_connector, get_session
+
+
+@pytest.mark.asyncio
+async def test_get_session_fallback_is_pooled_per_loop():
+    session = get_session()
+    assert get_session({"state": {}}) is session
+    assert isinstance(session.cookie_jar, aiohttp.DummyCookieJar)
+    await session.close()
+    assert (new_session := get_session()) is not session
+    await new_session.close()
+
+
+def test_get_session_fallback_is_closed_with_its_loop():
+    sessions = []
+
+    async def use_session():
+        sessions.append(get_session())
+
+    for _ in range(5):
+        asyncio.run(use_session())
+
+    assert len(set(sessions)) == 5
+    assert all(session.closed for session in sessions)
+    assert not set(sessions) & set(_loop_sessions.values())
+
+
+@pytest.mark.asyncio
+async def test_create_connector():
+    with patch("django_nextjs.session.CONNECTION_LIMIT_PER_HOST", 8):
+        connector = create_connector()
+        assert isinstance(connector, aiohttp.TCPConnector)
+        assert connector.limit_per_host == 8
+        await connector.close()
+
+    with patch("django_nextjs.session.UNIX_SOCKET_PATH", "/run/nextjs.sock"):
+        connector = create_connector()
+        assert isinstance(connector, aiohttp.UnixConnector)
+        assert connector.path == "/run/nextjs.sock"
+        await connector.close()
+
+
+@pytest.mark.asyncio
+async def test_background_loop():
+    async def get_loop():
+        return asyncio.get_running_loop()
+
+    assert await background_loop.run(get_loop()) is background_loop.loop
+    assert background_loop.run_sync(get_loop()) is background_loop.loop
@@ -0,0 +1,131 @@
+import mimetypes
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from django.http import Http404, HttpResponse
+
+from django_nextjs.asgi import NextJsMiddleware
+from django_nextjs.static_files import (
+    IMMUTABLE_CACHE_CONTROL,
+    PUBLIC_CACHE_CONTROL,
+    NextJSStaticFilesView,
+    find_static_file,
+)
+
+JS_CONTENT_TYPE = mimetypes.guess_type("main.js")[0]
+
+
+@pytest.fixture
+def routes(tmp_path):
+    (tmp_path / "static" / "chunks").mkdir(parents=True)
+    (tmp_path / "static" / "chunks" / "main.js").write_bytes(b"console.log(1)")
+    (tmp_path / "static" / "chunks" / "main.js.br").write_bytes(b"br")
+    (tmp_path / "static" / "chunks" / "main.js.gz").write_bytes(b"gz")
+    (tmp_path / "public" / "next").mkdir(parents=True)
+    (tmp_path / "public" / "next" / "logo.svg").write_bytes(b"<svg/>")
+    (tmp_path / "secret.txt").write_bytes(b"secret")
+    routes = [
+        ("/_next/static/", str(tmp_path / "static"), IMMUTABLE_CACHE_CONTROL),
+        ("/next/", str(tmp_path / "public" / "next"), PUBLIC_CACHE_CONTROL),
+    ]
+    with patch("django_nextjs.static_files.static_routes", routes), patch("django_nextjs.asgi.static_routes", routes):
+        yield routes
+
+
+def test_find_static_file(routes):
+    static_file = find_static_file("/_next/static/chunks/main.js")
+    assert static_file.path.endswith("main.js")
+    assert static_file.size == len(b"console.log(1)")
+    assert static_file.headers["Content-Type"] == JS_CONTENT_TYPE
+    assert static_file.headers["Cache-Control"] == IMMUTABLE_CACHE_CONTROL
+    assert "Content-Encoding" not in static_file.headers
+    assert static_file.headers["ETag"].startswith('"')
+
+    static_file = find_static_file("/_next/static/chunks/main.js", "gzip, deflate, br")
+    assert static_file.path.endswith("main.js.br")
+    assert static_file.headers["Content-Encoding"] == "br"
+    assert static_file.headers["Content-Type"] == JS_CONTENT_TYPE
+    assert find_static_file("/_next/static/chunks/main.js", "gzip").headers["Content-Encoding"] == "gzip"
+
+    assert find_static_file("/next/logo.svg").headers["Cache-Control"] == PUBLIC_CACHE_CONTROL
+    assert find_static_file("/next/missing.svg") is None
+    assert find_static_file("/_next/static/chunks") is None
+    assert find_static_file("/_next/static/../secret.txt") is None
+    assert find_static_file("/other/logo.svg") is None
+
+
+async def call_middleware(scope):
+    messages = []
+    inner_app = AsyncMock()
+    receive = AsyncMock(
+        side_effect=[{"type": "http.request", "body": b"", "more_body": False}, {"type": "http.disconnect"}]
+    )
+    await NextJsMiddleware(inner_app)(
+        {"type": "http", "method": "GET", "query_string": b"", **scope}, receive, AsyncMock(side_effect=messages.append)
+    )
+    return messages, inner_app
+
+
+@pytest.mark.asyncio
+async def test_middleware_serves_static_files(routes, settings):
+    settings.DEBUG = False
+
+    messages, inner_app = await call_middleware({"path": "/next/logo.svg", "headers": []})
+    inner_app.assert_not_called()
+    assert messages[0]["status"] == 200
+    headers = dict(messages[0]["headers"])
+    assert headers[b"content-length"] == b"6"
+    assert b"".join(message.get("body", b"") for message in messages[1:]) == b"<svg/>"
+
+    messages, _ = await call_middleware(
+        {"path": "/next/logo.svg", "headers": [(b"if-none-match", headers[b"etag"])]},
+    )
+    assert messages[0]["status"] == 304
+
+    messages, inner_app = await call_middleware({"path": "/next/missing.svg", "headers": []})
+    inner_app.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_middleware_uses_zero_copy_send(routes, settings):
+    settings.DEBUG = False
+
+    messages, _ = await call_middleware(
+        {
+            "path": "/_next/static/chunks/main.js",
+            "headers": [(b"accept-encoding", b"br")],
+            "extensions": {"http.response.zerocopysend": {}},
+        }
+    )
+    assert messages[1]["type"] == "http.response.zerocopysend"
+    assert messages[1]["file"].name.endswith("main.js.br")
+    assert messages[1]["file"].closed
+
+
+def test_static_files_view(routes, rf):
+    view = NextJSStaticFilesView.as_view()
+
+    response = view(rf.get("/_next/static/chunks/main.js", HTTP_ACCEPT_ENCODING="gzip"))
+    assert response.status_code == 200
+    assert b"".join(response.streaming_content) == b"gz"
+    assert response["Content-Encoding"] == "gzip"
+    assert response["Content-Type"] == JS_CONTENT_TYPE
+    assert "Content-Disposition" not in response
+    response.close()
+
+    response = view(
+        rf.get("/_next/static/chunks/main.js", HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response["ETag"])
+    )
+    assert response.status_code == 304
+
+
+def test_static_files_view_passes_missing_files_to_fallback_view(routes, rf):
+    fallback_view = MagicMock(return_value=HttpResponse(b"from next.js"))
+    view = NextJSStaticFilesView.as_view(fallback_view=fallback_view)
+
+    response = view(rf.get("/_next/static/chunks/missing.js"))
+    assert response.content == b"from next.js"
+    fallback_view.assert_called_once()
+
+    with pytest.raises(Http404):
+        NextJSStaticFilesView.as_view()(rf.get("/_next/static/chunks/missing.js"))
@@ -0,0 +1,61 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import aiohttp
+import pytest
+
+from django_nextjs.streaming import iter_coalesced
+
+
+def make_stream(chunks, delays=None) -> tuple[aiohttp.StreamReader, asyncio.Task]:
+    """
+    Return a stream which receives the chunks (after the delays) like the response of Next.js,
+    and the task which feeds it.
+    """
+    stream = aiohttp.StreamReader(MagicMock(), 2**16, loop=asyncio.get_running_loop())
+
+    async def feed():
+        for index, chunk in enumerate(chunks):
+            await asyncio.sleep(delays[index] if delays else 0)
+            stream.feed_data(chunk)
+        stream.feed_eof()
+
+    return stream, asyncio.create_task(feed())
+
+
+async def collect(stream_and_task, **kwargs):
+    stream, task = stream_and_task
+    result = [chunk async for chunk in iter_coalesced(stream, **kwargs)]
+    await task
+    return result
+
+
+@pytest.mark.asyncio
+async def test_iter_coalesced_by_size():
+    stream = make_stream([b"x" * 10] * 25)
+    result = await collect(stream, flush_bytes=100, flush_interval=10, flush_markers=())
+    assert b"".join(result) == b"x" * 250
+    assert [len(chunk) for chunk in result] == [100, 100, 50]
+
+
+@pytest.mark.asyncio
+async def test_iter_coalesced_at_markers():
+    chunks = [b"<div>", b"shell</div>", b"<script>$R", b'C("B:0","S:0")</script>', b"<div>", b"tail</div>"]
+    stream = make_stream(chunks)
+    result = await collect(stream, flush_bytes=1024, flush_interval=10, flush_markers=(b"$RC(",))
+    # The marker is found even though it's split between chunks
+    assert result == [b'<div>shell</div><script>$RC("B:0","S:0")</script>', b"<div>tail</div>"]
+
+
+@pytest.mark.asyncio
+async def test_iter_coalesced_flushes_slow_streams():
+    # The server pauses after "b" (e.g. while a Suspense boundary is rendered)
+    stream = make_stream([b"a", b"b", b"c", b"d"], delays=[0, 0, 0.2, 0])
+    result = await collect(stream, flush_bytes=1024, flush_interval=0.02, flush_markers=())
+    assert result == [b"ab", b"cd"]
+
+
+@pytest.mark.asyncio
+async def test_iter_coalesced_disabled():
+    stream = make_stream([b"a", b"b", b"c"], delays=[0.01, 0.01, 0.01])
+    assert await collect(stream, flush_bytes=0) == [b"a", b"b", b"c"]
@@ -0,0 +1,124 @@
+import asyncio
+
+import aiohttp
+import pytest
+import pytest_asyncio
+
+from django_nextjs import transports
+from django_nextjs.streaming import iter_coalesced
+from django_nextjs.transports import Http2Session, UpstreamConnectError
+from django_nextjs.upstreams import UpstreamPool
+
+h2_connection = pytest.importorskip("h2.connection")
+h2_config = pytest.importorskip("h2.config")
+h2_events = pytest.importorskip("h2.events")
+pytest.importorskip("httpx")
+
+
+class H2cServerProtocol(asyncio.Protocol):
+    """
+    A Next.js server which supports HTTP/2 without TLS (h2c), like a custom server created with `http2.createServer`.
+    It responds with the method, the path, the cookies and the size of the body of the request.
+    """
+
+    connections = 0
+
+    def connection_made(self, transport):
+        type(self).connections += 1
+        self.transport = transport
+        self.connection = h2_connection.H2Connection(h2_config.H2Configuration(client_side=False))
+        self.connection.initiate_connection()
+        self.transport.write(self.connection.data_to_send())
+        self.requests = {}
+
+    def data_received(self, data):
+        for event in self.connection.receive_data(data):
+            if isinstance(event, h2_events.RequestReceived):
+                self.requests[event.stream_id] = (dict(event.headers), bytearray())
+            elif isinstance(event, h2_events.DataReceived):
+                self.requests[event.stream_id][1].extend(event.data)
+                self.connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2_events.StreamEnded):
+                headers, body = self.requests.pop(event.stream_id)
+                content = b" ".join(
+                    [headers[b":method"], headers[b":path"], headers.get(b"cookie", b"-"), str(len(body)).encode()]
+                )
+                self.connection.send_headers(
+                    event.stream_id,
+                    [(":status", "200"), ("content-type", "text/plain"), ("set-cookie", "stored=1")],
+                )
+                self.connection.send_data(event.stream_id, content, end_stream=True)
+        self.transport.write(self.connection.data_to_send())
+
+
+@pytest_asyncio.fixture
+async def h2c_server():
+    H2cServerProtocol.connections = 0
+    server = await asyncio.get_running_loop().create_server(H2cServerProtocol, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        yield f"http://127.0.0.1:{port}"
+
+
+@pytest.mark.asyncio
+async def test_http2_session_multiplexes_requests(h2c_server):
+    session = Http2Session()
+    upstreams = UpstreamPool([h2c_server])
+
+    async def send_request(index: int):
+        async with upstreams.request(
+            session,
+            "POST",
+            f"/page/{index}",
+            params=[("a", "1")],
+            data=b"x" * index,
+            headers={"Cookie": "sessionid=abc; csrftoken=old"},
+            cookies={"csrftoken": "new"},
+        ) as response:
+            assert response.status == 200
+            assert response.headers["Content-Type"] == "text/plain"
+            return await response.read()
+
+    responses = await asyncio.gather(*(send_request(index) for index in range(20)))
+    await session.close()
+
+    assert responses[5] == b"POST /page/5?a=1 sessionid=abc; csrftoken=new 5"
+    # The concurrent requests are sent over a single connection, and the cookies of responses are never stored.
+    assert H2cServerProtocol.connections == 1
+    assert all(b"stored" not in response for response in responses)
+
+
+@pytest.mark.asyncio
+async def test_http2_session_streams_responses(h2c_server):
+    session = Http2Session()
+
+    async def body():
+        yield b"a" * 10
+        yield b"b" * 10
+
+    response = await session.request("PUT", h2c_server + "/stream", data=body())
+    chunks = [chunk async for chunk in iter_coalesced(response.content)]
+    response.release()
+    # The task closing the stream is kept until it's done.
+    assert len(transports._closing_responses) == 1
+    await asyncio.gather(*transports._closing_responses)
+    assert not transports._closing_responses
+    await session.close()
+
+    assert b"".join(chunks) == b"PUT /stream - 20"
+    assert response.content.at_eof()
+    assert response.content.total_bytes == len(b"PUT /stream - 20")
+
+
+@pytest.mark.asyncio
+async def test_http2_session_connection_error():
+    session = Http2Session()
+    upstreams = UpstreamPool(["http://127.0.0.1:1"])
+
+    with pytest.raises(UpstreamConnectError):
+        async with upstreams.request(session, "GET", "/"):
+            pass
+    await session.close()
+
+    assert isinstance(UpstreamConnectError(), aiohttp.ClientError)
+    assert upstreams.upstreams[0].failures == 1
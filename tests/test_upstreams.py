@@ -0,0 +1,181 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from django_nextjs.asgi import StopReceiving
+from django_nextjs.exceptions import NextJsUnavailable
+from django_nextjs.upstreams import UpstreamPool
+
+
+def test_acquire_least_outstanding():
+    pool = UpstreamPool(["http://a", "http://b", "http://c"])
+    a, b, c = pool.upstreams
+    a.outstanding, b.outstanding, c.outstanding = 2, 0, 1
+    assert pool.acquire() is b
+    assert pool.acquire() in (b, c)
+
+
+def test_failing_upstream_is_ejected_and_comes_back(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("django_nextjs.upstreams.time.monotonic", lambda: now)
+    pool = UpstreamPool(["http://a", "http://b"], max_failures=2, cooldown=10)
+    a, b = pool.upstreams
+
+    for _ in range(2):
+        a.outstanding = 1
+        pool.release(a, failed=True)
+    assert a.ejected_until == now + 10
+    assert {pool.acquire() for _ in range(4)} == {b}
+
+    # All upstreams are ejected: requests fail fast
+    b.ejected_until = now + 20
+    with pytest.raises(NextJsUnavailable):
+        pool.acquire()
+
+    # After the cooldown, a single request probes the ejected upstream
+    now += 10
+    b.ejected_until = 0
+    b.outstanding = 5
+    assert pool.acquire() is a
+    assert pool.acquire() is b
+    pool.release(a, failed=True)
+    assert a.ejected_until == now + 10
+
+    now += 10
+    assert pool.acquire() is a
+    pool.release(a)
+    assert a.failures == 0
+    assert pool.acquire() is a and pool.acquire() is a
+
+
+@pytest.mark.asyncio
+async def test_request_retries_other_upstream_on_connection_error():
+    pool = UpstreamPool(["http://a", "http://b"])
+    response = MagicMock(status=200)
+    connection_error = aiohttp.ClientConnectorError(MagicMock(), OSError())
+    session = MagicMock(request=AsyncMock(side_effect=[connection_error, response]))
+
+    async with pool.request(session, "GET", "/page") as nextjs_response:
+        assert nextjs_response is response
+
+    urls = [call.args[1] for call in session.request.call_args_list]
+    assert sorted(urls) == ["http://a/page", "http://b/page"]
+    response.release.assert_called_once()
+    assert all(upstream.outstanding == 0 for upstream in pool.upstreams)
+    assert sorted(upstream.failures for upstream in pool.upstreams) == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_request_first_byte_timeout():
+    pool = UpstreamPool(["http://a"], max_failures=1, first_byte_timeout=0.01)
+
+    async def stalled_request(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    session = MagicMock(request=stalled_request)
+    with pytest.raises(asyncio.TimeoutError):
+        async with pool.request(session, "GET", "/page"):
+            pass
+
+    # The circuit is open, so the next request fails without waiting
+    with pytest.raises(NextJsUnavailable):
+        async with pool.request(session, "GET", "/page"):
+            pass
+    assert pool.upstreams[0].outstanding == 0
+
+
+@pytest.mark.asyncio
+async def test_request_first_byte_timeout_starts_after_streamed_body():
+    async def handler(request: web.Request):
+        body = await request.read()
+        if request.path == "/stalled":
+            await asyncio.sleep(10)
+        return web.Response(body=body)
+
+    async def slow_body():
+        for _ in range(5):
+            await asyncio.sleep(0.02)
+            yield b"a"
+
+    app = web.Application()
+    app.router.add_post("/{path:.*}", handler)
+    async with TestServer(app) as server, aiohttp.ClientSession() as session:
+        pool = UpstreamPool([str(server.make_url(""))], max_failures=2, first_byte_timeout=0.05)
+
+        # The body is uploaded slowly by the client, which takes longer than the timeout.
+        async with pool.request(session, "POST", "/upload", data=slow_body()) as response:
+            assert await response.read() == b"aaaaa"
+        assert pool.upstreams[0].failures == 0
+
+        with pytest.raises(asyncio.TimeoutError):
+            async with pool.request(session, "POST", "/stalled", data=slow_body()):
+                pass
+        assert pool.upstreams[0].failures == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("first_byte_timeout", [None, 10])
+async def test_client_errors_dont_eject_upstream(first_byte_timeout):
+    async def handler(request: web.Request):
+        return web.Response(body=await request.read())
+
+    async def interrupted_body():
+        yield b"a"
+        await asyncio.sleep(0.01)
+        # e.g. the client disconnects during the upload
+        raise StopReceiving
+
+    app = web.Application()
+    app.router.add_post("/{path:.*}", handler)
+    async with TestServer(app) as server, aiohttp.ClientSession() as session:
+        pool = UpstreamPool([str(server.make_url(""))], max_failures=3, first_byte_timeout=first_byte_timeout)
+        upstream = pool.upstreams[0]
+        for _ in range(3):
+            with pytest.raises(aiohttp.ClientConnectionError):
+                async with pool.request(session, "POST", "/upload", data=interrupted_body()):
+                    pass
+        assert (upstream.outstanding, upstream.failures, upstream.ejected_until) == (0, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_doesnt_change_upstream_health():
+    pool = UpstreamPool(["http://a"], max_failures=2)
+    upstream = pool.upstreams[0]
+    upstream.failures = 2
+
+    async def stalled_request(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    session = MagicMock(request=stalled_request)
+
+    async def send_request():
+        async with pool.request(session, "GET", "/page"):
+            pass
+
+    request = asyncio.create_task(send_request())
+    await asyncio.sleep(0.01)
+    assert upstream.probing
+    request.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await request
+
+    # The instance is probed again by the next request.
+    assert (upstream.outstanding, upstream.failures, upstream.probing) == (0, 2, False)
+    assert pool.acquire() is upstream
+
+
+@pytest.mark.asyncio
+async def test_error_responses_dont_eject_upstream():
+    pool = UpstreamPool(["http://a"], max_failures=3)
+    session = MagicMock(request=AsyncMock(return_value=MagicMock(status=503)))
+
+    # e.g. a route handler which returns 503 on purpose
+    for _ in range(5):
+        async with pool.request(session, "GET", "/api/maintenance") as nextjs_response:
+            assert nextjs_response.status == 503
+    assert pool.upstreams[0].failures == 0
+    assert pool.acquire() is pool.upstreams[0]